@@ -14,189 +14,2017 @@ The types of data sets currently supported are: PASCAL VOC, VisDrone, DOTA, NWPU
 """
 
 import os
+import io
+import re
+import json
+import time
+import struct
+import atexit
+import functools
+import threading
 import cv2
+import numpy as np
+try:
+    from lxml import etree
+    lxml_available = True
+except ImportError:
+    import xml.etree.ElementTree as etree
+    lxml_available = False
+
+
+class ImgSizeCache(object):
+
+    cache_file_name = ".img_size_cache.json"
+    # bumped whenever probed sizes change meaning, e.g. version 2 applies the JPEG EXIF orientation
+    cache_version = 2
+    _instances = {}
+    _lock = threading.Lock()
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self.cache_root = os.path.dirname(cache_path)
+        self.entries = None
+        self.updates = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def forFolder(img_folder):
+        cache_path = os.path.join(os.path.dirname(os.path.abspath(img_folder)), ImgSizeCache.cache_file_name)
+        cache = ImgSizeCache._instances.get(cache_path)
+        if cache is None:
+            with ImgSizeCache._lock:
+                cache = ImgSizeCache._instances.get(cache_path)
+                if cache is None:
+                    cache = ImgSizeCache(cache_path)
+                    ImgSizeCache._instances[cache_path] = cache
+        return cache
+
+    @staticmethod
+    def saveAll():
+        for cache in ImgSizeCache._instances.values():
+            cache.save()
+
+    @staticmethod
+    def getStats():
+        caches = list(ImgSizeCache._instances.values())
+        return sum(cache.hits for cache in caches), sum(cache.misses for cache in caches)
+
+    @staticmethod
+    def popUpdates():
+        updates = {}
+        for cache_path, cache in ImgSizeCache._instances.items():
+            if cache.updates:
+                updates[cache_path] = cache.updates
+                cache.updates = {}
+        return updates
+
+    @staticmethod
+    def mergeUpdates(updates):
+        for cache_path, entries in updates.items():
+            cache = ImgSizeCache._instances.get(cache_path)
+            if cache is None:
+                cache = ImgSizeCache(cache_path)
+                ImgSizeCache._instances[cache_path] = cache
+            if cache.entries is None:
+                cache.load()
+            cache.entries.update(entries)
+            cache.dirty = True
+
+    def load(self):
+        self.entries = {}
+        if os.path.exists(self.cache_path):
+            try:
+                with open(self.cache_path, "r") as cache_file:
+                    cache = json.load(cache_file)
+                if cache["version"] == ImgSizeCache.cache_version:
+                    self.entries = cache["entries"]
+            except (ValueError, KeyError, TypeError, OSError):
+                self.entries = {}
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmp_path = self.cache_path + ".%d.tmp" % os.getpid()
+        try:
+            with open(tmp_path, "w") as cache_file:
+                json.dump({"version": ImgSizeCache.cache_version, "entries": self.entries}, cache_file)
+            os.replace(tmp_path, self.cache_path)
+            self.dirty = False
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def getSize(self, img_path):
+        if self.entries is None:
+            with ImgSizeCache._lock:
+                if self.entries is None:
+                    self.load()
+        key = os.path.relpath(os.path.abspath(img_path), self.cache_root)
+        stat = os.stat(img_path)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            self.hits += 1
+            return tuple(entry[2:5])
+        self.misses += 1
+        size = self.probeSize(img_path)
+        self.entries[key] = self.updates[key] = [stat.st_mtime_ns, stat.st_size] + list(size)
+        self.dirty = True
+        return size
+
+    @staticmethod
+    def probeSize(img_path):
+        with open(img_path, "rb") as img_file:
+            head = img_file.read(32)
+            try:
+                if head[:8] == b"\x89PNG\r\n\x1a\n":
+                    size = ImgSizeCache._probePNG(head)
+                elif head[:2] == b"\xff\xd8":
+                    size = ImgSizeCache._probeJPEG(img_file)
+                elif head[:4] in (b"II*\x00", b"MM\x00*"):
+                    size = ImgSizeCache._probeTIFF(img_file, head)
+                elif head[:2] == b"BM":
+                    size = ImgSizeCache._probeBMP(head)
+                elif head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                    size = ImgSizeCache._probeWEBP(head)
+                elif head[:6] == b"\x93NUMPY":
+                    size = ImgSizeCache._probeNPY(img_file)
+                else:
+                    size = None
+            except (struct.error, ValueError):
+                size = None
+        if size is None:
+            # IMREAD_UNCHANGED ignores the EXIF orientation that cv2.imread applies to JPEGs
+            img = cv2.imread(img_path, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH if head[:2] == b"\xff\xd8" else cv2.IMREAD_UNCHANGED)
+            if img is None:
+                raise IOError("can not read image: %s" % img_path)
+            size = (img.shape[0], img.shape[1], img.shape[2] if img.ndim == 3 else 1)
+        return size
+
+    @staticmethod
+    def _probePNG(head):
+        if head[12:16] != b"IHDR":
+            return None
+        w, h = struct.unpack(">II", head[16:24])
+        d = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}.get(head[25])
+        return None if d is None else (h, w, d)
+
+    @staticmethod
+    def _probeJPEG(img_file):
+        # cv2.imread rotates by the EXIF orientation, so orientations 5 to 8 swap width and height
+        img_file.seek(2)
+        orientation = 1
+        while True:
+            marker = img_file.read(2)
+            while marker[:1] == b"\xff" and marker[1:2] == b"\xff":
+                marker = marker[1:] + img_file.read(1)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            code = marker[1]
+            if code == 0x01 or 0xD0 <= code <= 0xD7:
+                continue
+            if code in (0xD9, 0xDA):
+                return None
+            seg_len = struct.unpack(">H", img_file.read(2))[0]
+            if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                h, w, d = struct.unpack(">xHHB", img_file.read(6))
+                return (w, h, d) if 5 <= orientation <= 8 else (h, w, d)
+            if code == 0xE1:
+                segment = img_file.read(seg_len - 2)
+                if segment[:6] == b"Exif\x00\x00":
+                    orientation = ImgSizeCache.readTIFFTags(io.BytesIO(segment[6:])).get(274, [1])[0]
+                continue
+            img_file.seek(seg_len - 2, os.SEEK_CUR)
+
+    @staticmethod
+    def readTIFFTags(img_file):
+        img_file.seek(0)
+        head = img_file.read(8)
+        endian = "<" if head[:2] == b"II" else ">"
+        ifd_offset = struct.unpack(endian + "I", head[4:8])[0]
+        img_file.seek(ifd_offset)
+        entry_count = struct.unpack(endian + "H", img_file.read(2))[0]
+        entries = img_file.read(entry_count * 12)
+        tags = {}
+        for i in range(entry_count):
+            tag, field_type, count = struct.unpack(endian + "HHI", entries[i * 12: i * 12 + 8])
+            if field_type not in (3, 4):
+                continue
+            fmt = endian + ("H" if field_type == 3 else "I") * count
+            value_size = struct.calcsize(fmt)
+            if value_size <= 4:
+                tags[tag] = list(struct.unpack(fmt, entries[i * 12 + 8: i * 12 + 8 + value_size]))
+            else:
+                value_offset = struct.unpack(endian + "I", entries[i * 12 + 8: i * 12 + 12])[0]
+                position = img_file.tell()
+                img_file.seek(value_offset)
+                tags[tag] = list(struct.unpack(fmt, img_file.read(value_size)))
+                img_file.seek(position)
+        return tags
+
+    @staticmethod
+    def _probeTIFF(img_file, head):
+        tags = ImgSizeCache.readTIFFTags(img_file)
+        if 256 not in tags or 257 not in tags:
+            return None
+        return (tags[257][0], tags[256][0], tags.get(277, [1])[0])
+
+    @staticmethod
+    def _probeWEBP(head):
+        chunk = head[12:16]
+        if chunk == b"VP8 ":
+            w, h = struct.unpack("<HH", head[26:30])
+            return (h & 0x3FFF, w & 0x3FFF, 3)
+        elif chunk == b"VP8L":
+            bits = struct.unpack("<I", head[21:25])[0]
+            return (((bits >> 14) & 0x3FFF) + 1, (bits & 0x3FFF) + 1, 4 if bits & (1 << 28) else 3)
+        elif chunk == b"VP8X":
+            w = struct.unpack("<I", head[24:27] + b"\x00")[0] + 1
+            h = struct.unpack("<I", head[27:30] + b"\x00")[0] + 1
+            return (h, w, 4 if head[20] & 0x10 else 3)
+        return None
+
+    @staticmethod
+    def _probeNPY(img_file):
+        img_file.seek(0)
+        version = np.lib.format.read_magic(img_file)
+        if version == (1, 0):
+            shape = np.lib.format.read_array_header_1_0(img_file)[0]
+        else:
+            shape = np.lib.format.read_array_header_2_0(img_file)[0]
+        if len(shape) not in (2, 3):
+            return None
+        return (shape[0], shape[1], shape[2] if len(shape) == 3 else 1)
+
+    @staticmethod
+    def _probeBMP(head):
+        header_size = struct.unpack("<I", head[14:18])[0]
+        if header_size == 12:
+            w, h, bpp = struct.unpack("<HHxxH", head[18:26])
+        else:
+            w, h, bpp = struct.unpack("<iixxH", head[18:30])
+        return (abs(h), w, 4 if bpp == 32 else 3)
+
+
+atexit.register(ImgSizeCache.saveAll)
 
 
 class YoloBoudingBox(object):
 
-    def __init__(self, center_x, center_y, width, height, cls_id):
-        self.center_x = float(center_x)
-        self.center_y = float(center_y)
-        self.width = float(width)
-        self.height = float(height)
-        self.cls_id = int(cls_id)
+    __slots__ = ("center_x", "center_y", "width", "height", "cls_id")
+
+    def __init__(self, center_x, center_y, width, height, cls_id):
+        self.center_x = float(center_x)
+        self.center_y = float(center_y)
+        self.width = float(width)
+        self.height = float(height)
+        self.cls_id = int(cls_id)
+
+
+class VOCBoudingBox(object):
+
+    __slots__ = ("x_min", "x_max", "y_min", "y_max", "cls_name", "is_difficult", "is_truncated")
+
+    def __init__(self, x_min, x_max, y_min, y_max, cls_name, is_difficult=False, is_truncated=False):
+        self.x_min = int(x_min)
+        self.x_max = int(x_max)
+        self.y_min = int(y_min)
+        self.y_max = int(y_max)
+        self.cls_name = str(cls_name)
+        self.is_difficult = bool(is_difficult)
+        self.is_truncated = bool(is_truncated)
+
+
+class OrientedBoudingBox(object):
+
+    __slots__ = ("quad", "cls_name", "is_difficult", "is_truncated")
+
+    def __init__(self, quad, cls_name, is_difficult=False, is_truncated=False):
+        self.quad = [float(i) for i in quad]
+        self.cls_name = str(cls_name)
+        self.is_difficult = bool(is_difficult)
+        self.is_truncated = bool(is_truncated)
+
+
+class ImgPathIndex(object):
+
+    img_exts = (".jpg", ".png", ".bmp", ".jpeg", ".jpe", ".pbm", ".pgm", ".ppm", ".sr", ".ras", ".tiff", ".tif", ".exr", ".jp2", ".webp", ".npy")
+    _instances = {}
+    _lock = threading.Lock()
+
+    def __init__(self, images_folder_path):
+        self.images_folder_path = images_folder_path
+        self.paths = None
+        self.duplicates = {}
+        self.folder_mtimes = {}
+
+    @staticmethod
+    def forFolder(images_folder_path):
+        key = os.path.abspath(images_folder_path)
+        index = ImgPathIndex._instances.get(key)
+        if index is None:
+            with ImgPathIndex._lock:
+                index = ImgPathIndex._instances.get(key)
+                if index is None:
+                    index = ImgPathIndex._instances[key] = ImgPathIndex(images_folder_path)
+        return index
+
+    def scan(self):
+        paths, duplicates, folder_mtimes = {}, {}, {}
+        # breadth first, so an image directly in the folder wins over a nested one with the same stem
+        folders = [""]
+        for folder in folders:
+            folder_path = os.path.join(self.images_folder_path, folder)
+            try:
+                folder_mtimes[folder_path] = os.stat(folder_path).st_mtime_ns
+                entries = sorted(os.scandir(folder_path), key=lambda entry: entry.name)
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                rel_path = os.path.join(folder, entry.name) if folder else entry.name
+                if entry.is_dir():
+                    folders.append(rel_path)
+                    continue
+                stem, ext = os.path.splitext(entry.name)
+                if ext.lower() not in ImgPathIndex.img_exts:
+                    continue
+                if stem in paths:
+                    duplicates.setdefault(stem, [paths[stem]]).append(rel_path)
+                else:
+                    paths[stem] = rel_path
+        self.paths, self.duplicates, self.folder_mtimes = paths, duplicates, folder_mtimes
+        for stem, rel_paths in sorted(duplicates.items()):
+            print("%s: several images named \"%s\" (%s), using %s" % (self.images_folder_path, stem, ", ".join(rel_paths), rel_paths[0]))
+
+    def isStale(self):
+        for folder_path, mtime in self.folder_mtimes.items():
+            try:
+                if os.stat(folder_path).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def load(self, refresh=False):
+        if self.paths is None or refresh and self.isStale():
+            with ImgPathIndex._lock:
+                if self.paths is None or refresh and self.isStale():
+                    self.scan()
+        return self.paths
+
+    def getPath(self, name, default_ext=None):
+        rel_path = self.load().get(name)
+        if rel_path is None:
+            # a miss rescans once the folder has changed since the last scan
+            rel_path = self.load(True).get(name)
+        if rel_path is None:
+            return None if default_ext is None else os.path.join(self.images_folder_path, name + default_ext)
+        return os.path.join(self.images_folder_path, rel_path)
+
+    def getImgs(self):
+        return sorted(self.load(True).values())
+
+    def getUnmatched(self, names):
+        paths = self.load(True)
+        names = set(names)
+        return sorted(name for name in names if name not in paths), sorted(paths[stem] for stem in paths if stem not in names)
+
+
+class ThumbnailCache(object):
+
+    cache_folder_name = ".thumbnail_cache"
+
+    def __init__(self, cache_path, max_bytes=1 << 30):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.total_bytes = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def forFolder(img_folder, max_bytes=1 << 30):
+        return ThumbnailCache(os.path.join(os.path.dirname(os.path.abspath(img_folder)), ThumbnailCache.cache_folder_name), max_bytes)
+
+    @staticmethod
+    def decodeThumbnail(img_path, max_side):
+        if os.path.splitext(img_path)[-1].lower() == ".npy":
+            img = np.load(img_path, mmap_mode="r")
+            step = max(1, max(img.shape[:2]) // max_side)
+            img = np.ascontiguousarray(img[::step, ::step])
+            img = cv2.cvtColor(img.reshape(img.shape[:2]), cv2.COLOR_GRAY2BGR) if img.ndim == 2 or img.shape[2] == 1 else np.ascontiguousarray(img[:, :, :3])
+        else:
+            img_h, img_w = ImgSizeCache.probeSize(img_path)[:2]
+            # let the decoder downscale JPEGs by 2, 4 or 8 while the result stays above max_side
+            reduce = 1
+            while reduce < 8 and max(img_h, img_w) // (reduce * 2) >= max_side:
+                reduce *= 2
+            img = cv2.imread(img_path, {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}[reduce])
+            if img is None:
+                raise IOError("can not read image: %s" % img_path)
+        scale = float(max_side) / max(img.shape[:2])
+        if scale < 1:
+            img = cv2.resize(img, (max(1, int(round(img.shape[1] * scale))), max(1, int(round(img.shape[0] * scale)))), interpolation=cv2.INTER_AREA)
+        return img
+
+    def getEntryPath(self, img_path, max_side):
+        import hashlib
+        stat = os.stat(img_path)
+        key = "%s|%d|%d|%d" % (os.path.abspath(img_path), stat.st_mtime_ns, stat.st_size, max_side)
+        return os.path.join(self.cache_path, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy")
+
+    def get(self, img_path, max_side):
+        # the cache is best effort: a folder that can not be written to just turns caching off
+        entry_path = self.getEntryPath(img_path, max_side)
+        try:
+            thumbnail = np.load(entry_path)
+        except (OSError, ValueError):
+            thumbnail = None
+        if thumbnail is not None:
+            try:
+                os.utime(entry_path)
+            except OSError:
+                pass
+            self.hits += 1
+            return thumbnail
+        self.misses += 1
+        thumbnail = self.decodeThumbnail(img_path, max_side)
+        if self.max_bytes > 0:
+            try:
+                self.put(entry_path, thumbnail)
+            except OSError:
+                self.max_bytes = 0
+        return thumbnail
+
+    def put(self, entry_path, thumbnail):
+        if not os.path.exists(self.cache_path):
+            os.makedirs(self.cache_path, exist_ok=True)
+        if self.total_bytes is None:
+            self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(self.cache_path) if entry.name.endswith(".npy"))
+        tmp_path = entry_path + ".%d.tmp.npy" % os.getpid()
+        try:
+            np.save(tmp_path, thumbnail)
+            os.replace(tmp_path, entry_path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.total_bytes += os.path.getsize(entry_path)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        # least recently used first, hits touch their entry; stop at 90% so eviction does not run on every put
+        entries = sorted((entry.stat().st_mtime_ns, entry.stat().st_size, entry.path) for entry in os.scandir(self.cache_path) if entry.name.endswith(".npy") and ".tmp" not in entry.name)
+        self.total_bytes = sum(entry[1] for entry in entries)
+        for mtime, size, entry_path in entries:
+            if self.total_bytes <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                pass
+            self.total_bytes -= size
+
+
+class ClassNameTable(object):
+
+    def __init__(self, names=None):
+        self.names = []
+        self.ids = {}
+        self.lock = threading.Lock()
+        for name in names or []:
+            self.getId(name)
+
+    def __len__(self):
+        return len(self.names)
+
+    def getId(self, name):
+        cls_id = self.ids.get(name)
+        if cls_id is None:
+            with self.lock:
+                cls_id = self.ids.get(name)
+                if cls_id is None:
+                    self.names.append(name)
+                    cls_id = self.ids[name] = len(self.names) - 1
+        return cls_id
+
+    def getIds(self, names):
+        return np.fromiter((self.getId(name) for name in names), dtype=np.int32, count=len(names))
+
+    def getColumnIds(self, names):
+        # one lookup per distinct name; new names are still registered in order of first appearance
+        unique_names, first_index, inverse = np.unique(np.asarray(names, dtype=str), return_index=True, return_inverse=True)
+        order = np.argsort(first_index)
+        unique_ids = np.empty(len(unique_names), dtype=np.int32)
+        unique_ids[order] = self.getIds(unique_names[order].tolist())
+        return unique_ids[inverse.reshape(-1)]
+
+    def getName(self, cls_id):
+        return self.names[cls_id]
+
+    def getLookup(self, clss):
+        clss_ids = self.getIds(clss)
+        lookup = np.full(len(self.names), -1, dtype=np.int32)
+        lookup[clss_ids[::-1]] = np.arange(len(clss) - 1, -1, -1, dtype=np.int32)
+        return lookup
+
+    def getIndices(self, cls_ids, clss):
+        indices = self.getLookup(clss)[cls_ids]
+        if (indices < 0).any():
+            raise ValueError("%r is not in list" % self.names[cls_ids[np.argmax(indices < 0)]])
+        return indices
+
+
+class BBoxArray(object):
+
+    columns = ()
+
+    def __init__(self, capacity=0):
+        self.count = 0
+        self.data = {}
+        for name, dtype, shape in self.columns:
+            self.data[name] = np.empty((capacity,) + shape, dtype=dtype)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def reserve(self, capacity):
+        if capacity <= len(self.data[self.columns[0][0]]):
+            return
+        capacity = max(capacity, 2 * len(self.data[self.columns[0][0]]), 8)
+        for name, dtype, shape in self.columns:
+            column = np.empty((capacity,) + shape, dtype=dtype)
+            column[:self.count] = self.data[name][:self.count]
+            self.data[name] = column
+
+    def column(self, name):
+        return self.data[name][:self.count]
+
+    def appendRow(self, **values):
+        self.reserve(self.count + 1)
+        for name, value in values.items():
+            self.data[name][self.count] = value
+        self.count += 1
+
+    def extendColumns(self, **columns):
+        n = len(next(iter(columns.values())))
+        self.reserve(self.count + n)
+        for name, dtype, shape in self.columns:
+            self.data[name][self.count: self.count + n] = columns[name] if name in columns else 0
+        self.count += n
+
+    def select(self, indices):
+        subset = self.__class__()
+        subset.count = len(np.arange(self.count)[indices])
+        for name, dtype, shape in self.columns:
+            subset.data[name] = self.column(name)[indices].copy()
+        return subset
+
+    def clear(self):
+        self.count = 0
+
+    def __getstate__(self):
+        return {"columns": dict((name, self.column(name).copy()) for name, dtype, shape in self.columns)}
+
+    def __setstate__(self, state):
+        self.data = state["columns"]
+        self.count = len(self.data[self.columns[0][0]])
+
+
+class LabeledBBoxArray(BBoxArray):
+
+    # flags packs is_difficult (bit 0) and is_truncated (bit 1); cls_ids index the shared class_names table
+    class_names = ClassNameTable()
+    DIFFICULT = 1
+    TRUNCATED = 2
+
+    @property
+    def cls_ids(self):
+        return self.column("cls_ids")
+
+    @property
+    def flags(self):
+        return self.column("flags")
+
+    @property
+    def is_difficult(self):
+        return (self.flags & self.DIFFICULT) != 0
+
+    @property
+    def is_truncated(self):
+        return (self.flags & self.TRUNCATED) != 0
+
+    @property
+    def cls_names(self):
+        names = self.class_names.names
+        return [names[i] for i in self.cls_ids]
+
+    def getFlags(self, count, is_difficult=None, is_truncated=None):
+        flags = np.zeros(count, dtype=np.uint8)
+        if is_difficult is not None:
+            flags |= np.asarray(is_difficult, dtype=bool).astype(np.uint8) * self.DIFFICULT
+        if is_truncated is not None:
+            flags |= np.asarray(is_truncated, dtype=bool).astype(np.uint8) * self.TRUNCATED
+        return flags
+
+    def getClsIds(self, cls_names):
+        return cls_names if isinstance(cls_names, np.ndarray) and cls_names.dtype.kind in "iu" else self.class_names.getIds(cls_names)
+
+    def extend(self, boxes):
+        for box in boxes:
+            self.append(box)
+
+    def __getstate__(self):
+        state = super(LabeledBBoxArray, self).__getstate__()
+        used_ids, local_ids = np.unique(state["columns"]["cls_ids"], return_inverse=True)
+        state["columns"]["cls_ids"] = local_ids.astype(np.int32).reshape(-1)
+        state["cls_names"] = [self.class_names.names[i] for i in used_ids]
+        return state
+
+    def __setstate__(self, state):
+        super(LabeledBBoxArray, self).__setstate__(state)
+        global_ids = self.class_names.getIds(state["cls_names"])
+        self.data["cls_ids"] = global_ids[self.data["cls_ids"]]
+
+
+class VOCBBoxes(LabeledBBoxArray):
+
+    # xyxy holds x_min, y_min, x_max, y_max
+    columns = (("xyxy", np.int32, (4,)), ("cls_ids", np.int32, ()), ("flags", np.uint8, ()))
+
+    @property
+    def xyxy(self):
+        return self.column("xyxy")
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("bounding box index out of range")
+        x_min, y_min, x_max, y_max = self.data["xyxy"][i].tolist()
+        flags = int(self.data["flags"][i])
+        return VOCBoudingBox(x_min, x_max, y_min, y_max, self.class_names.names[self.data["cls_ids"][i]], flags & self.DIFFICULT, flags & self.TRUNCATED)
+
+    def append(self, box):
+        flags = (self.DIFFICULT if box.is_difficult else 0) | (self.TRUNCATED if box.is_truncated else 0)
+        self.appendRow(xyxy=(box.x_min, box.y_min, box.x_max, box.y_max), cls_ids=self.class_names.getId(box.cls_name), flags=flags)
+
+    def extendArrays(self, xyxy, cls_names, is_difficult=None, is_truncated=None):
+        xyxy = np.asarray(xyxy).reshape(-1, 4)
+        self.extendColumns(xyxy=xyxy, cls_ids=self.getClsIds(cls_names), flags=self.getFlags(len(xyxy), is_difficult, is_truncated))
+
+
+class OrientedBBoxes(LabeledBBoxArray):
+
+    # quads holds the four corners x1, y1, ..., x4, y4 in the order they were labelled
+    columns = (("quads", np.float64, (8,)), ("cls_ids", np.int32, ()), ("flags", np.uint8, ()))
+
+    @property
+    def quads(self):
+        return self.column("quads")
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("bounding box index out of range")
+        flags = int(self.data["flags"][i])
+        return OrientedBoudingBox(self.data["quads"][i].tolist(), self.class_names.names[self.data["cls_ids"][i]], flags & self.DIFFICULT, flags & self.TRUNCATED)
+
+    def append(self, box):
+        flags = (self.DIFFICULT if box.is_difficult else 0) | (self.TRUNCATED if box.is_truncated else 0)
+        self.appendRow(quads=box.quad, cls_ids=self.class_names.getId(box.cls_name), flags=flags)
+
+    def extendArrays(self, quads, cls_names, is_difficult=None, is_truncated=None):
+        quads = np.asarray(quads, dtype=np.float64).reshape(-1, 8)
+        self.extendColumns(quads=quads, cls_ids=self.getClsIds(cls_names), flags=self.getFlags(len(quads), is_difficult, is_truncated))
+
+    def getXYXY(self):
+        return RSDataSetsUtils.quads2XYXY(self.quads)
+
+    def getBounds(self):
+        points = self.quads.reshape(-1, 4, 2)
+        return np.concatenate([np.floor(points.min(axis=1)), np.ceil(points.max(axis=1))], axis=1).astype(np.int32)
+
+    def getRBoxes(self):
+        return RSDataSetsUtils.quads2RBoxes(self.quads)
+
+
+class YoloBBoxes(BBoxArray):
+
+    # xywh holds center_x, center_y, width, height, all normalized to the image size
+    columns = (("xywh", np.float64, (4,)), ("cls_ids", np.int32, ()))
+
+    @property
+    def xywh(self):
+        return self.column("xywh")
+
+    @property
+    def cls_ids(self):
+        return self.column("cls_ids")
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError("bounding box index out of range")
+        center_x, center_y, width, height = self.data["xywh"][i].tolist()
+        return YoloBoudingBox(center_x, center_y, width, height, self.data["cls_ids"][i])
+
+    def append(self, box):
+        self.appendRow(xywh=(box.center_x, box.center_y, box.width, box.height), cls_ids=box.cls_id)
+
+    def extend(self, boxes):
+        for box in boxes:
+            self.append(box)
+
+    def extendArrays(self, xywh, cls_ids):
+        self.extendColumns(xywh=np.asarray(xywh, dtype=np.float64).reshape(-1, 4), cls_ids=np.asarray(cls_ids, dtype=np.int32))
+
+
+class VOCLabel(object):
+
+    def __init__(self, img_path, label_path):
+        self.img_path = img_path
+        self.label_path = label_path
+        self.BBoxes = VOCBBoxes()
+        self.OBBoxes = None
+        self.img_w = 0
+        self.img_h = 0
+        self.img_d = 0
+
+    def updateSize(self):
+        size_cache = ImgSizeCache.forFolder(os.path.dirname(self.img_path))
+        self.img_h, self.img_w, self.img_d = size_cache.getSize(self.img_path)
+        return self.img_h, self.img_w, self.img_d
+
+    def updateBBoxes(self):
+        xyxy, cls_names, is_difficult, is_truncated, size = RSDataSetsUtils.readVOCXml(self.label_path)
+        self.BBoxes.extendArrays(xyxy, cls_names, is_difficult, is_truncated)
+        return self.BBoxes
+
+    def selectClasses(self, cls_ids):
+        # keeps the boxes of the given class ids, the oriented boxes stay aligned with BBoxes
+        keep = np.isin(self.BBoxes.cls_ids, cls_ids)
+        self.BBoxes = self.BBoxes.select(keep)
+        if self.OBBoxes is not None:
+            self.OBBoxes = self.OBBoxes.select(keep)
+        return self.BBoxes
+
+    def convert2YoloLabel(self, clss):
+        if not (self.img_w and self.img_h):
+            self.updateSize()
+        yolo_label = YoloLabel(self.img_path, self.label_path)
+        yolo_label.img_w, yolo_label.img_h, yolo_label.img_d = self.img_w, self.img_h, self.img_d
+        xywh = RSDataSetsUtils.voc2YoloBoxes(self.BBoxes.xyxy, self.img_w, self.img_h)
+        yolo_label.BBoxes.extendArrays(xywh, VOCBBoxes.class_names.getIndices(self.BBoxes.cls_ids, clss))
+        return yolo_label
+
+
+class YoloLabel(VOCLabel):
+
+    def __init__(self, img_path, label_path):
+        super(YoloLabel, self).__init__(img_path, label_path)
+        self.BBoxes = YoloBBoxes()
+
+    def updateBBoxes(self):
+        columns = RSDataSetsUtils.splitLabelColumns(self.label_path, 5, 5, np.float64)
+        if columns is None:
+            raise ValueError("%s: malformed line(s)" % self.label_path)
+        values = columns[0]
+        self.BBoxes.extendArrays(values[:, 1:], values[:, 0].astype(np.int32))
+        return self.BBoxes
+
+    def convert2VOCLabel(self, clss):
+        if not (self.img_w and self.img_h):
+            self.updateSize()
+        voc_label = VOCLabel(self.img_path, self.label_path)
+        voc_label.img_w, voc_label.img_h, voc_label.img_d = self.img_w, self.img_h, self.img_d
+        xyxy = RSDataSetsUtils.yolo2VOCBoxes(self.BBoxes.xywh, self.img_w, self.img_h)
+        voc_label.BBoxes.extendArrays(xyxy, VOCBBoxes.class_names.getIds(clss)[self.BBoxes.cls_ids])
+        return voc_label
+
+
+class VOCLabelSet(object):
+
+    def __init__(self):
+        self.img_paths = []
+        self.label_paths = []
+        self.img_sizes = np.zeros((0, 3), dtype=np.int32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.BBoxes = VOCBBoxes()
+
+    def __len__(self):
+        return len(self.label_paths)
+
+    def __getitem__(self, i):
+        voc_label = VOCLabel(self.img_paths[i], self.label_paths[i])
+        voc_label.BBoxes = self.BBoxes.select(slice(self.offsets[i], self.offsets[i + 1]))
+        return voc_label
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def getLabelIndices(self):
+        return np.repeat(np.arange(len(self)), np.diff(self.offsets))
+
+    @staticmethod
+    def fromParsedLabels(parsed_labels):
+        label_set = VOCLabelSet()
+        xyxy_list, cls_ids_list, difficult_list, truncated_list, sizes, counts = [], [], [], [], [], []
+        for img_path, label_path, xyxy, cls_names, is_difficult, is_truncated, size in parsed_labels:
+            label_set.img_paths.append(img_path)
+            label_set.label_paths.append(label_path)
+            xyxy_list.append(xyxy)
+            cls_ids_list.append(cls_names if isinstance(cls_names, np.ndarray) and cls_names.dtype.kind in "iu" else VOCBBoxes.class_names.getIds(cls_names))
+            difficult_list.append(is_difficult)
+            truncated_list.append(is_truncated)
+            sizes.append(size)
+            counts.append(len(xyxy))
+        if counts:
+            label_set.img_sizes = np.array(sizes, dtype=np.int32).reshape(-1, 3)
+            label_set.offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            label_set.BBoxes.extendArrays(np.concatenate(xyxy_list), np.concatenate(cls_ids_list), np.concatenate(difficult_list), np.concatenate(truncated_list))
+        return label_set
+
+    @staticmethod
+    def fromVOCXmlFolder(labels_folder_path, images_folder_path, img_ext=None):
+        img_index = ImgPathIndex.forFolder(images_folder_path)
+
+        def parse():
+            for label_filename in sorted(os.listdir(labels_folder_path)):
+                if os.path.splitext(label_filename)[-1] != ".xml":
+                    continue
+                label_full_path = os.path.join(labels_folder_path, label_filename)
+                name = os.path.splitext(label_filename)[0]
+                img_full_path = img_index.getPath(name, ".jpg") if img_ext is None else os.path.join(images_folder_path, name + img_ext)
+                yield (img_full_path, label_full_path) + RSDataSetsUtils.readVOCXml(label_full_path)
+        return VOCLabelSet.fromParsedLabels(parse())
+
+    @staticmethod
+    def fromTxtLabelFolder(labels_folder_path, images_folder_path, dataset_type, img_ext=None):
+        dataset_type = dataset_type.lower()
+        parser = {"dota": RSDataSetsUtils.parseDOTA, "visdrone": RSDataSetsUtils.parseVisDrone, "vhr": RSDataSetsUtils.parseVHR}[dataset_type]
+        img_index = ImgPathIndex.forFolder(images_folder_path)
+        default_ext = ".png" if dataset_type == "dota" else ".jpg"
+        errors = []
+
+        def parse():
+            for label_filename in sorted(os.listdir(labels_folder_path)):
+                if os.path.splitext(label_filename)[-1] != ".txt":
+                    continue
+                label_full_path = os.path.join(labels_folder_path, label_filename)
+                name = os.path.splitext(label_filename)[0]
+                img_full_path = img_index.getPath(name, default_ext) if img_ext is None else os.path.join(images_folder_path, name + img_ext)
+                xyxy, cls_names, is_difficult, is_truncated, line_errors = parser(label_full_path)
+                if line_errors:
+                    errors.append((label_full_path, line_errors))
+                yield img_full_path, label_full_path, xyxy, cls_names, is_difficult, is_truncated, (0, 0, 0)
+        label_set = VOCLabelSet.fromParsedLabels(parse())
+        label_set.errors = errors
+        return label_set
+
+
+class BoxGridIndex(object):
+
+    def __init__(self, xyxy, cell_w, cell_h):
+        self.xyxy = np.asarray(xyxy).reshape(-1, 4)
+        self.cell_w = max(1, int(cell_w))
+        self.cell_h = max(1, int(cell_h))
+        if len(self.xyxy) == 0:
+            self.origin_x = self.origin_y = 0
+            self.cols = self.rows = 0
+            self.order = np.zeros(0, dtype=np.int64)
+            self.cell_starts = np.zeros(1, dtype=np.int64)
+            self.max_w = self.max_h = 0
+            return
+        cell_x = np.floor_divide(self.xyxy[:, 0], self.cell_w)
+        cell_y = np.floor_divide(self.xyxy[:, 1], self.cell_h)
+        self.origin_x = int(cell_x.min())
+        self.origin_y = int(cell_y.min())
+        self.cols = int(cell_x.max()) - self.origin_x + 1
+        self.rows = int(cell_y.max()) - self.origin_y + 1
+        cells = (cell_y - self.origin_y).astype(np.int64) * self.cols + (cell_x - self.origin_x)
+        self.order = np.argsort(cells, kind="stable")
+        self.cell_starts = np.searchsorted(cells[self.order], np.arange(self.rows * self.cols + 1))
+        self.max_w = max(0, int((self.xyxy[:, 2] - self.xyxy[:, 0]).max()))
+        self.max_h = max(0, int((self.xyxy[:, 3] - self.xyxy[:, 1]).max()))
+
+    def getCandidates(self, x0, y0, x1, y1):
+        c0 = max(0, x0 // self.cell_w - self.origin_x)
+        c1 = min(self.cols - 1, x1 // self.cell_w - self.origin_x)
+        r0 = max(0, y0 // self.cell_h - self.origin_y)
+        r1 = min(self.rows - 1, y1 // self.cell_h - self.origin_y)
+        if c0 > c1 or r0 > r1:
+            return np.zeros(0, dtype=np.int64)
+        parts = [self.order[self.cell_starts[r * self.cols + c0]: self.cell_starts[r * self.cols + c1 + 1]] for r in range(r0, r1 + 1)]
+        return np.concatenate(parts)
+
+    def queryInside(self, x0, y0, x1, y1):
+        candidates = self.getCandidates(x0, y0, x1, y1)
+        boxes = self.xyxy[candidates]
+        mask = (boxes[:, 0] >= x0) & (boxes[:, 2] >= x0) & (boxes[:, 0] <= x1) & (boxes[:, 2] <= x1) & (boxes[:, 1] >= y0) & (boxes[:, 3] >= y0) & (boxes[:, 1] <= y1) & (boxes[:, 3] <= y1)
+        return np.sort(candidates[mask])
+
+    def queryIntersect(self, x0, y0, x1, y1):
+        candidates = self.getCandidates(x0 - self.max_w, y0 - self.max_h, x1, y1)
+        boxes = self.xyxy[candidates]
+        mask = (boxes[:, 0] < x1) & (boxes[:, 2] > x0) & (boxes[:, 1] < y1) & (boxes[:, 3] > y0)
+        return np.sort(candidates[mask])
+
+
+class WindowedImageReader(object):
+
+    # uncompressed strip or tiled TIFFs and .npy files are memory-mapped and only the requested window is copied out;
+    # every other format is decoded whole by cv2.imread
+    def __init__(self, img_path):
+        self.img_path = img_path
+        self.img = None
+        self.blocks = None
+        self.shape = None
+        ext = os.path.splitext(img_path)[-1].lower()
+        try:
+            if ext == ".npy":
+                self.img = np.load(img_path, mmap_mode="r")
+                self.shape = self.img.shape[:2] + (3,)
+            elif ext in (".tif", ".tiff"):
+                self.openTIFF()
+        except (OSError, ValueError, struct.error):
+            self.img = self.blocks = None
+        if self.img is None and self.blocks is None:
+            self.img = cv2.imread(img_path)
+            self.shape = None if self.img is None else self.img.shape
+
+    def openTIFF(self):
+        with open(self.img_path, "rb") as img_file:
+            if img_file.read(4) not in (b"II*\x00", b"MM\x00*"):
+                return
+            tags = ImgSizeCache.readTIFFTags(img_file)
+        channels = tags.get(277, [1])[0]
+        if tags.get(259, [1])[0] != 1 or tags.get(284, [1])[0] != 1 or set(tags.get(258, [8])) != {8} or channels not in (1, 3, 4) or tags.get(262, [1])[0] not in (1, 2):
+            return
+        img_h, img_w = tags[257][0], tags[256][0]
+        data = np.memmap(self.img_path, dtype=np.uint8, mode="r")
+        if 324 in tags:
+            block_w, block_h = tags[322][0], tags[323][0]
+            offsets = tags[324]
+        else:
+            block_w, block_h = img_w, min(tags.get(278, [img_h])[0], img_h)
+            offsets = tags[273]
+        blocks_across = -(-img_w // block_w)
+        self.blocks = []
+        for i, offset in enumerate(offsets):
+            rows = min(block_h, img_h - (i // blocks_across) * block_h) if 324 not in tags else block_h
+            self.blocks.append(data[offset: offset + rows * block_w * channels].reshape(rows, block_w, channels))
+        self.block_w, self.block_h, self.blocks_across = block_w, block_h, blocks_across
+        self.channels = channels
+        self.shape = (img_h, img_w, 3)
+
+    def toBGR(self, window):
+        if window.ndim == 2 or window.shape[2] == 1:
+            return cv2.cvtColor(np.ascontiguousarray(window.reshape(window.shape[:2])), cv2.COLOR_GRAY2BGR)
+        if self.blocks is not None:
+            return cv2.cvtColor(np.ascontiguousarray(window), cv2.COLOR_RGB2BGR if window.shape[2] == 3 else cv2.COLOR_RGBA2BGR)
+        return np.array(window[:, :, :3])
+
+    def __getitem__(self, index):
+        rows, cols = index
+        y0, y1, _ = rows.indices(self.shape[0])
+        x0, x1, _ = cols.indices(self.shape[1])
+        if self.blocks is None:
+            window = self.img[y0: y1, x0: x1]
+            if isinstance(self.img, np.memmap) or window.ndim != 3 or window.shape[2] != 3:
+                window = self.toBGR(window)
+            return window
+        window = np.empty((max(0, y1 - y0), max(0, x1 - x0), self.channels), dtype=np.uint8)
+        for block_row in range(y0 // self.block_h, -(-y1 // self.block_h)):
+            for block_col in range(x0 // self.block_w, -(-x1 // self.block_w)):
+                block = self.blocks[block_row * self.blocks_across + block_col]
+                top, left = block_row * self.block_h, block_col * self.block_w
+                by0, by1 = max(y0, top), min(y1, top + block.shape[0])
+                bx0, bx1 = max(x0, left), min(x1, left + block.shape[1])
+                window[by0 - y0: by1 - y0, bx0 - x0: bx1 - x0] = block[by0 - top: by1 - top, bx0 - left: bx1 - left]
+        return self.toBGR(window)
+
+
+class WriteBehindQueue(object):
+
+    # max_pending_bytes covers the queued tasks and any bytes reserved or held for the data they read from;
+    # waits only last while queued tasks can still free memory, so one item larger than the budget still goes through
+    def __init__(self, workers=1, max_pending_bytes=512 << 20):
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.max_pending_bytes = max_pending_bytes
+        self.pending_bytes = 0
+        self.task_bytes = 0
+        self.condition = threading.Condition()
+        self.errors = []
+
+    def reserve(self, nbytes, wait=True):
+        with self.condition:
+            if not wait:
+                if self.pending_bytes and self.pending_bytes + nbytes > self.max_pending_bytes:
+                    return False
+            else:
+                while self.task_bytes and self.pending_bytes + nbytes > self.max_pending_bytes:
+                    self.condition.wait()
+            self.pending_bytes += nbytes
+            return True
+
+    def release(self, nbytes):
+        with self.condition:
+            self.pending_bytes -= nbytes
+            self.condition.notify_all()
+
+    def holdSource(self, nbytes, tasks, reserved=0):
+        # turns a reservation into nbytes held until the last of the next tasks submitted with this hold is done
+        with self.condition:
+            self.pending_bytes += nbytes - reserved
+            if not tasks:
+                self.pending_bytes -= nbytes
+            self.condition.notify_all()
+        return [tasks, nbytes]
+
+    def submit(self, nbytes, func, *args, hold=None):
+        if self.executor is None:
+            try:
+                func(*args)
+            finally:
+                self.done(None, 0, hold)
+            return
+        with self.condition:
+            while self.task_bytes and self.pending_bytes + nbytes > self.max_pending_bytes:
+                self.condition.wait()
+            self.pending_bytes += nbytes
+            self.task_bytes += nbytes
+        self.executor.submit(func, *args).add_done_callback(lambda future: self.done(future, nbytes, hold))
+
+    def done(self, future, nbytes, hold=None):
+        with self.condition:
+            self.pending_bytes -= nbytes
+            self.task_bytes -= nbytes
+            if hold is not None:
+                hold[0] -= 1
+                if not hold[0]:
+                    self.pending_bytes -= hold[1]
+            if future is not None and future.exception() is not None:
+                self.errors.append(future.exception())
+            self.condition.notify_all()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        if self.errors:
+            raise self.errors[0]
+
+
+class NullStage(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullInstrumentation(object):
+
+    # default instrumentation: every hook is a no-op so it can stay wired into the hot loops
+    enabled = False
+    null_stage = NullStage()
+
+    def stage(self, name):
+        return self.null_stage
+
+    def run(self, name):
+        return self.null_stage
+
+    def count(self, name, value=1):
+        pass
+
+    def progress(self, stage, done, total):
+        pass
+
+    def wrap(self, name, func):
+        return func
+
+    def pop(self):
+        return None
+
+    def merge(self, data):
+        pass
+
+    def summary(self):
+        return None
+
+
+class InstrumentationStage(object):
+
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.addTime(self.name, self.start, time.perf_counter())
+        return False
+
+
+class InstrumentationRun(object):
+
+    def __init__(self, instrumentation, name):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.instrumentation.beginRun()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.endRun(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Instrumentation(object):
+
+    enabled = True
+
+    def __init__(self, progress=None, profile_path=None, trace_path=None, summary_path=None):
+        self.progress_callback = progress
+        self.profile_path = profile_path
+        self.trace_path = trace_path
+        self.summary_path = summary_path
+        self.tracing = trace_path is not None
+        self.reset()
+
+    def reset(self):
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+        self.events = []
+        self.runs = []
+        self.depth = 0
+        self.profiler = None
+        self.cache_stats = ImgSizeCache.getStats()
+
+    def __getstate__(self):
+        # pool workers get an empty copy; what they collect comes back through pop/merge
+        return {"tracing": self.tracing}
+
+    def __setstate__(self, state):
+        self.progress_callback = self.profile_path = self.trace_path = self.summary_path = None
+        self.tracing = state["tracing"]
+        self.reset()
+
+    def stage(self, name):
+        return InstrumentationStage(self, name)
+
+    def run(self, name):
+        return InstrumentationRun(self, name)
+
+    def addTime(self, name, start, end):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0.0, 0]
+            timer[0] += end - start
+            timer[1] += 1
+            if self.tracing:
+                self.events.append({"name": name, "ph": "X", "ts": start * 1e6, "dur": (end - start) * 1e6, "pid": os.getpid(), "tid": threading.get_ident()})
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def progress(self, stage, done, total):
+        if self.progress_callback is not None:
+            self.progress_callback(stage, done, total)
+
+    def wrap(self, name, func):
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with InstrumentationStage(self, name):
+                return func(*args, **kwargs)
+        return timed
+
+    def syncCacheStats(self):
+        hits, misses = ImgSizeCache.getStats()
+        self.count("size_cache_hits", max(0, hits - self.cache_stats[0]))
+        self.count("size_cache_misses", max(0, misses - self.cache_stats[1]))
+        self.cache_stats = (hits, misses)
+
+    def pop(self):
+        self.syncCacheStats()
+        with self.lock:
+            data = {"timers": self.timers, "counters": self.counters, "events": self.events}
+            self.timers, self.counters, self.events = {}, {}, []
+        return data
+
+    def merge(self, data):
+        if data is None:
+            return
+        with self.lock:
+            for name, (seconds, calls) in data["timers"].items():
+                timer = self.timers.setdefault(name, [0.0, 0])
+                timer[0] += seconds
+                timer[1] += calls
+            for name, value in data["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            self.events.extend(data["events"])
+
+    def beginRun(self):
+        self.depth += 1
+        if self.depth == 1 and self.profile_path is not None:
+            if self.profiler is None:
+                import cProfile
+                self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def endRun(self, name, seconds):
+        self.depth -= 1
+        self.runs.append({"name": name, "seconds": seconds})
+        if self.depth:
+            return
+        if self.profiler is not None:
+            # the profile covers the main process and accumulates over runs
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+        if self.trace_path is not None:
+            with open(self.trace_path, "w") as trace_file:
+                json.dump({"traceEvents": self.events}, trace_file)
+        if self.summary_path is not None:
+            with open(self.summary_path, "w") as summary_file:
+                json.dump(self.summary(), summary_file, indent=1)
+
+    def summary(self):
+        self.syncCacheStats()
+        with self.lock:
+            stages = dict((name, {"seconds": seconds, "calls": calls}) for name, (seconds, calls) in sorted(self.timers.items(), key=lambda item: -item[1][0]))
+            return {"runs": list(self.runs), "stages": stages, "counters": dict(self.counters)}
+
+    def printSummary(self):
+        summary = self.summary()
+        for run in summary["runs"]:
+            print("run %-30s %10.3fs" % (run["name"], run["seconds"]))
+        for name, stage in summary["stages"].items():
+            print("stage %-28s %10.3fs %10d calls" % (name, stage["seconds"], stage["calls"]))
+        for name, value in sorted(summary["counters"].items()):
+            print("count %-28s %10d" % (name, value))
+        return summary
+
+
+def instrumentedRun(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            with self.instrumentation.run(name):
+                return func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class IncrementalManifest(object):
+
+    def __init__(self, manifest_path, params, use_hash=False):
+        self.manifest_path = manifest_path
+        self.manifest_root = os.path.dirname(os.path.abspath(manifest_path))
+        self.params = json.loads(json.dumps(params))
+        self.use_hash = use_hash
+        self.entries = {}
+        self.stale = False
+        if os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, "r") as manifest_file:
+                    manifest = json.load(manifest_file)
+                self.entries = manifest["entries"]
+                self.stale = manifest["params"] != self.params or manifest["use_hash"] != use_hash
+            except (ValueError, KeyError, OSError):
+                self.entries = {}
+
+    def getRelPath(self, path):
+        return os.path.relpath(os.path.abspath(path), self.manifest_root)
+
+    def getFingerprint(self, path):
+        try:
+            if self.use_hash:
+                import hashlib
+                digest = hashlib.sha1()
+                with open(path, "rb") as input_file:
+                    for block in iter(lambda: input_file.read(1 << 20), b""):
+                        digest.update(block)
+                return digest.hexdigest()
+            stat = os.stat(path)
+            return [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            return None
+
+    def getFingerprints(self, input_paths):
+        return dict((self.getRelPath(path), self.getFingerprint(path)) for path in input_paths)
+
+    def isUpToDate(self, key, fingerprints):
+        entry = self.entries.get(key)
+        if self.stale or entry is None or entry["inputs"] != fingerprints:
+            return False
+        return all(os.path.exists(os.path.join(self.manifest_root, output)) for output in entry["outputs"])
+
+    def getData(self, key):
+        return self.entries[key].get("data")
+
+    def removeOutputs(self, outputs):
+        removed = []
+        for output in outputs:
+            output_path = os.path.join(self.manifest_root, output)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+                removed.append(output_path)
+        return removed
+
+    def record(self, key, fingerprints, output_paths, data=None):
+        outputs = [self.getRelPath(path) for path in output_paths]
+        entry = self.entries.get(key)
+        removed = self.removeOutputs(set(entry["outputs"]) - set(outputs)) if entry is not None else []
+        self.entries[key] = {"inputs": fingerprints, "outputs": outputs, "data": data}
+        return removed
+
+    def removeOrphans(self, keys):
+        keys = set(keys)
+        removed = []
+        for key in [i for i in self.entries if i not in keys]:
+            removed.extend(self.removeOutputs(self.entries.pop(key)["outputs"]))
+        return removed
+
+    def save(self):
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as manifest_file:
+            json.dump({"params": self.params, "use_hash": self.use_hash, "entries": self.entries}, manifest_file)
+        os.replace(tmp_path, self.manifest_path)
+
+
+class PackedDataSetWriter(object):
+
+    index_dtype = np.dtype([("box_offset", np.int64), ("box_count", np.int32), ("img_w", np.int32), ("img_h", np.int32), ("img_d", np.int32), ("shard", np.int32), ("img_offset", np.int64), ("img_length", np.int64)])
+
+    def __init__(self, dst_path, dataset_name, include_images=False, shard_size=1 << 30):
+        self.dst_path = dst_path
+        self.dataset_name = dataset_name
+        self.include_images = include_images
+        self.shard_size = shard_size
+        self.class_names = ClassNameTable()
+        self.class_lookup = {}
+        self.names = []
+        self.index = []
+        self.bboxes = VOCBBoxes()
+        self.shards = []
+        self.shard_file = None
+        self.shard_offset = 0
+        if not os.path.exists(dst_path):
+            os.makedirs(dst_path)
+
+    def getPath(self, suffix):
+        return os.path.join(self.dst_path, self.dataset_name + suffix)
+
+    def getLocalClassIds(self, cls_ids):
+        used_ids, inverse = np.unique(cls_ids, return_inverse=True)
+        for cls_id in used_ids.tolist():
+            if cls_id not in self.class_lookup:
+                self.class_lookup[cls_id] = self.class_names.getId(VOCBBoxes.class_names.getName(cls_id))
+        return np.array([self.class_lookup[cls_id] for cls_id in used_ids.tolist()], dtype=np.int32)[inverse.reshape(-1)]
+
+    def writeImgBytes(self, img_path):
+        with open(img_path, "rb") as img_file:
+            data = img_file.read()
+        if self.shard_file is None or (self.shard_offset and self.shard_offset + len(data) > self.shard_size):
+            if self.shard_file is not None:
+                self.shard_file.close()
+            self.shards.append(self.dataset_name + "-%05d.bin" % len(self.shards))
+            self.shard_file = open(os.path.join(self.dst_path, self.shards[-1]), "wb")
+            self.shard_offset = 0
+        offset = self.shard_offset
+        self.shard_file.write(data)
+        self.shard_offset += len(data)
+        return len(self.shards) - 1, offset, len(data)
+
+    def add(self, voc_label):
+        if not (voc_label.img_w and voc_label.img_h):
+            voc_label.updateSize()
+        shard, img_offset, img_length = self.writeImgBytes(voc_label.img_path) if self.include_images else (-1, 0, 0)
+        bboxes = voc_label.BBoxes
+        self.index.append((len(self.bboxes), len(bboxes), voc_label.img_w, voc_label.img_h, voc_label.img_d, shard, img_offset, img_length))
+        self.names.append(voc_label.img_path)
+        self.bboxes.extendArrays(bboxes.xyxy, self.getLocalClassIds(bboxes.cls_ids), bboxes.is_difficult, bboxes.is_truncated)
+        return len(self.index) - 1
+
+    def close(self):
+        if self.shard_file is not None:
+            self.shard_file.close()
+            self.shard_file = None
+        np.save(self.getPath(".index.npy"), np.array(self.index, dtype=self.index_dtype))
+        np.save(self.getPath(".xyxy.npy"), self.bboxes.xyxy)
+        np.save(self.getPath(".cls_ids.npy"), self.bboxes.cls_ids)
+        np.save(self.getPath(".flags.npy"), self.bboxes.flags)
+        with open(self.getPath(".meta.json"), "w") as meta_file:
+            json.dump({"dataset_name": self.dataset_name, "class_names": self.class_names.names, "shards": self.shards, "names": self.names}, meta_file)
+        return len(self.index)
+
+
+class PackedDataSetReader(object):
+
+    def __init__(self, src_path, dataset_name):
+        self.src_path = src_path
+        self.dataset_name = dataset_name
+        with open(self.getPath(".meta.json"), "r") as meta_file:
+            meta = json.load(meta_file)
+        self.class_names = meta["class_names"]
+        self.names = meta["names"]
+        self.shard_names = meta["shards"]
+        self.shards = [None] * len(self.shard_names)
+        self.index = np.load(self.getPath(".index.npy"), mmap_mode="r")
+        self.xyxy = np.load(self.getPath(".xyxy.npy"), mmap_mode="r")
+        self.cls_ids = np.load(self.getPath(".cls_ids.npy"), mmap_mode="r")
+        self.flags = np.load(self.getPath(".flags.npy"), mmap_mode="r")
+        self.global_ids = VOCBBoxes.class_names.getIds(self.class_names)
+
+    def getPath(self, suffix):
+        return os.path.join(self.src_path, self.dataset_name + suffix)
+
+    def __len__(self):
+        return len(self.index)
+
+    def getBoxes(self, i):
+        entry = self.index[i]
+        start, end = int(entry["box_offset"]), int(entry["box_offset"]) + int(entry["box_count"])
+        return self.xyxy[start: end], self.cls_ids[start: end], self.flags[start: end]
+
+    def getImgBytes(self, i):
+        entry = self.index[i]
+        if entry["shard"] < 0:
+            return None
+        shard = int(entry["shard"])
+        if self.shards[shard] is None:
+            self.shards[shard] = np.memmap(os.path.join(self.src_path, self.shard_names[shard]), dtype=np.uint8, mode="r")
+        return self.shards[shard][int(entry["img_offset"]): int(entry["img_offset"]) + int(entry["img_length"])]
+
+    def getImg(self, i):
+        data = self.getImgBytes(i)
+        return cv2.imread(self.names[i]) if data is None else cv2.imdecode(np.asarray(data), cv2.IMREAD_COLOR)
+
+    def __getitem__(self, i):
+        entry = self.index[i]
+        xyxy, cls_ids, flags = self.getBoxes(i)
+        voc_label = VOCLabel(self.names[i], None)
+        voc_label.img_w, voc_label.img_h, voc_label.img_d = int(entry["img_w"]), int(entry["img_h"]), int(entry["img_d"])
+        voc_label.BBoxes.extendColumns(xyxy=xyxy, cls_ids=self.global_ids[cls_ids], flags=flags)
+        return voc_label
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class RSDataSetsUtils:
+
+    dota_classes = ["plane", "ship", "storage-tank", "baseball-diamond", "tennis-court", "basketball-court", "ground-track-field", "harbor", "bridge", "large-vehicle", "small-vehicle", "helicopter", "roundabout", "soccer-ball-field", "swimming-pool", "container-crane", "airport", "helipad"]
+    visdrone_classes = ["ignored regions", "pedestrian", "people", "bicycle", "car", "van", "truck", "tricycle", "awning-tricycle", "bus", "motor", "others"]
+    vhr_classes = ["airplane", "ship", "storage tank", "baseball diamond", "tennis court", "basketball court", "ground track field", "harbor", "bridge", "vehicle"]
+    number_pattern = r"[-+]?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?"
+    dota_line_pattern = re.compile(r"^(?:[ \t]*" + r"[ \t]+".join(["(%s)" % number_pattern] * 8) + r"[ \t]+(\S+)[ \t]+(\S+)(?:[ \t]+\S+)*[ \t]*|([^\n]*))$", re.MULTILINE)
+    visdrone_line_pattern = re.compile(r"^(?:[ \t]*" + r"[ \t]*,[ \t]*".join([r"(-?\d+)"] * 5 + [r"(\d+)"] + [r"(-?\d+)"] * 2) + r"[ \t]*(?:,[^\n]*)?|([^\n]*))$", re.MULTILINE)
+    yolo_det_line_pattern = re.compile(r"^(?:[ \t]*(\d+)" + (r"[ \t]+(%s)" % number_pattern) * 4 + r"(?:[ \t]+(%s))?[ \t]*|([^\n]*))$" % number_pattern, re.MULTILINE)
+    yolo_obb_det_line_pattern = re.compile(r"^(?:[ \t]*(\d+)" + (r"[ \t]+(%s)" % number_pattern) * 8 + r"(?:[ \t]+(%s))?[ \t]*|([^\n]*))$" % number_pattern, re.MULTILINE)
+    vhr_line_pattern = re.compile(r"^(?:[ \t]*\([ \t]*(-?\d+)[ \t]*,[ \t]*(-?\d+)[ \t]*\)[ \t]*,[ \t]*\([ \t]*(-?\d+)[ \t]*,[ \t]*(-?\d+)[ \t]*\)[ \t]*,[ \t]*(\d+)[ \t]*|([^\n]*))$", re.MULTILINE)
+
+    @staticmethod
+    def voc2YoloBoxes(xyxy, img_w, img_h):
+        xyxy = np.asarray(xyxy).reshape(-1, 4)
+        dw = 1.0 / np.asarray(img_w, dtype=np.float64)
+        dh = 1.0 / np.asarray(img_h, dtype=np.float64)
+        xywh = np.empty(xyxy.shape, dtype=np.float64)
+        xywh[:, 0] = ((xyxy[:, 0] + xyxy[:, 2]) / 2.0 - 1) * dw
+        xywh[:, 1] = ((xyxy[:, 1] + xyxy[:, 3]) / 2.0 - 1) * dh
+        xywh[:, 2] = (xyxy[:, 2] - xyxy[:, 0]) * dw
+        xywh[:, 3] = (xyxy[:, 3] - xyxy[:, 1]) * dh
+        return xywh
+
+    @staticmethod
+    def yolo2VOCBoxes(xywh, img_w, img_h):
+        xywh = np.asarray(xywh, dtype=np.float64).reshape(-1, 4)
+        img_w = np.asarray(img_w, dtype=np.float64)
+        img_h = np.asarray(img_h, dtype=np.float64)
+        center_x = xywh[:, 0] * img_w + 1
+        center_y = xywh[:, 1] * img_h + 1
+        half_w = xywh[:, 2] * img_w / 2
+        half_h = xywh[:, 3] * img_h / 2
+        xyxy = np.stack([center_x - half_w, center_y - half_h, center_x + half_w, center_y + half_h], axis=1)
+        return np.rint(xyxy).astype(np.int32)
+
+    @staticmethod
+    def quads2XYXY(quads):
+        points = np.asarray(quads, dtype=np.float64).reshape(-1, 4, 2)
+        return np.concatenate([points.min(axis=1), points.max(axis=1)], axis=1).astype(np.int32)
+
+    @staticmethod
+    def xyxy2Quads(xyxy):
+        xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+        x_min, y_min, x_max, y_max = xyxy[:, 0], xyxy[:, 1], xyxy[:, 2], xyxy[:, 3]
+        return np.stack([x_min, y_min, x_max, y_min, x_max, y_max, x_min, y_max], axis=1)
+
+    @staticmethod
+    def quads2RBoxes(quads):
+        # rboxes are center_x, center_y, width, height, angle; width runs along the first edge and angle is its direction in radians
+        points = np.asarray(quads, dtype=np.float64).reshape(-1, 4, 2)
+        edges = np.roll(points, -1, axis=1) - points
+        lengths = np.hypot(edges[:, :, 0], edges[:, :, 1])
+        center = points.mean(axis=1)
+        width = (lengths[:, 0] + lengths[:, 2]) / 2
+        height = (lengths[:, 1] + lengths[:, 3]) / 2
+        angle = np.arctan2(edges[:, 0, 1], edges[:, 0, 0])
+        return np.stack([center[:, 0], center[:, 1], width, height, angle], axis=1)
+
+    @staticmethod
+    def rBoxes2Quads(rboxes):
+        rboxes = np.asarray(rboxes, dtype=np.float64).reshape(-1, 5)
+        cos = np.cos(rboxes[:, 4])[:, None]
+        sin = np.sin(rboxes[:, 4])[:, None]
+        corner_x = np.array([-0.5, 0.5, 0.5, -0.5]) * rboxes[:, 2:3]
+        corner_y = np.array([-0.5, -0.5, 0.5, 0.5]) * rboxes[:, 3:4]
+        xs = rboxes[:, 0:1] + corner_x * cos - corner_y * sin
+        ys = rboxes[:, 1:2] + corner_x * sin + corner_y * cos
+        return np.stack([xs, ys], axis=2).reshape(-1, 8)
+
+    @staticmethod
+    def nextVertices(polygons, counts):
+        index = np.arange(polygons.shape[1])[None, :] + 1
+        index = index % np.maximum(counts, 1)[:, None]
+        return np.take_along_axis(polygons, index[:, :, None], axis=1)
+
+    @staticmethod
+    def signedAreas(polygons, counts):
+        polygons = np.asarray(polygons, dtype=np.float64)
+        following = RSDataSetsUtils.nextVertices(polygons, counts)
+        cross = polygons[:, :, 0] * following[:, :, 1] - following[:, :, 0] * polygons[:, :, 1]
+        cross[np.arange(polygons.shape[1])[None, :] >= counts[:, None]] = 0
+        return cross.sum(axis=1) / 2
+
+    @staticmethod
+    def polygonAreas(polygons, counts):
+        return np.abs(RSDataSetsUtils.signedAreas(polygons, counts))
+
+    @staticmethod
+    def clipPolygonsByPolygons(polygons, counts, clips):
+        # Sutherland-Hodgman run on every polygon at once; polygons is (n, m, 2) with counts[i] valid vertices per row,
+        # the rest is padding, and row i is clipped by the convex clips[i], or by clips itself when it is a single (k, 2) polygon
+        polygons = np.asarray(polygons, dtype=np.float64)
+        counts = np.asarray(counts, dtype=np.int64)
+        clips = np.asarray(clips, dtype=np.float64)
+        if clips.ndim == 2:
+            clips = clips[None]
+        following_clips = np.roll(clips, -1, axis=1)
+        # unit inward normals, so axis-aligned edges measure plain coordinate differences
+        normals = np.stack([clips[:, :, 1] - following_clips[:, :, 1], following_clips[:, :, 0] - clips[:, :, 0]], axis=2)
+        lengths = np.hypot(normals[:, :, 0], normals[:, :, 1])
+        orientation = np.where(RSDataSetsUtils.signedAreas(clips, np.full(len(clips), clips.shape[1])) < 0, -1.0, 1.0)
+        normals = normals / np.where(lengths > 0, lengths, 1)[:, :, None] * orientation[:, None, None]
+        for edge in range(clips.shape[1]):
+            start = clips[:, edge][:, None, :]
+            normal = normals[:, edge][:, None, :]
+            n, m = polygons.shape[:2]
+            following = RSDataSetsUtils.nextVertices(polygons, counts)
+            valid = np.arange(m)[None, :] < counts[:, None]
+            distance = ((polygons - start) * normal).sum(axis=2)
+            next_distance = ((following - start) * normal).sum(axis=2)
+            inside = distance >= 0
+            crossing = valid & (inside != (next_distance >= 0))
+            ratio = distance / np.where(crossing, distance - next_distance, 1)
+            intersection = polygons + ratio[:, :, None] * (following - polygons)
+            intersection = np.where(np.abs(normal) == 1, start, intersection)
+            candidates = np.stack([polygons, intersection], axis=2).reshape(n, 2 * m, 2)
+            emitted = np.stack([valid & inside, crossing], axis=2).reshape(n, 2 * m)
+            order = np.argsort(~emitted, axis=1, kind="stable")
+            counts = emitted.sum(axis=1)
+            polygons = np.take_along_axis(candidates, order[:, :, None], axis=1)[:, :max(1, int(counts.max()) if n else 0)]
+        return polygons, counts
+
+    @staticmethod
+    def clipPolygons(polygons, counts, x_min, y_min, x_max, y_max):
+        return RSDataSetsUtils.clipPolygonsByPolygons(polygons, counts, [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]])
 
+    @staticmethod
+    def quadIoUs(quads, other_quads):
+        polygons = np.asarray(quads, dtype=np.float64).reshape(-1, 4, 2)
+        four = np.full(len(polygons), 4)
+        clipped, counts = RSDataSetsUtils.clipPolygonsByPolygons(polygons, four, np.asarray(other_quads, dtype=np.float64).reshape(-1, 4, 2))
+        inter = RSDataSetsUtils.polygonAreas(clipped, counts)
+        union = RSDataSetsUtils.polygonAreas(polygons, four) + RSDataSetsUtils.polygonAreas(np.asarray(other_quads, dtype=np.float64).reshape(-1, 4, 2), four) - inter
+        return inter / np.maximum(union, 1e-12)
 
-class VOCBoudingBox(object):
+    @staticmethod
+    def fitQuads(quads, polygons, counts):
+        # clipped polygons with up to four vertices are kept as they are (a triangle repeats its last vertex);
+        # larger ones have their shortest edge merged into its midpoint until four are left, as DOTA_devkit does,
+        # which keeps every corner inside the convex clipped polygon; corners are then wound and rolled to follow quads
+        points = np.asarray(quads, dtype=np.float64).reshape(-1, 4, 2)
+        polygons = np.asarray(polygons, dtype=np.float64)
+        counts = np.asarray(counts, dtype=np.int64)
+        index = np.minimum(np.arange(4)[None, :], np.maximum(counts, 1)[:, None] - 1)
+        fitted = np.take_along_axis(polygons, index[:, :, None], axis=1)
+        for i in np.nonzero(counts > 4)[0].tolist():
+            vertices = polygons[i, :counts[i]].copy()
+            while len(vertices) > 4:
+                edges = np.roll(vertices, -1, axis=0) - vertices
+                shortest = int(np.argmin(np.hypot(edges[:, 0], edges[:, 1])))
+                vertices[shortest] += edges[shortest] / 2
+                vertices = np.delete(vertices, (shortest + 1) % len(vertices), axis=0)
+            fitted[i] = vertices
+        four = np.full(len(points), 4)
+        flipped = (RSDataSetsUtils.signedAreas(fitted, four) < 0) != (RSDataSetsUtils.signedAreas(points, four) < 0)
+        fitted[flipped] = fitted[flipped, ::-1]
+        rolled = np.stack([np.roll(fitted, -shift, axis=1) for shift in range(4)], axis=1)
+        best = np.argmin(np.linalg.norm(rolled - points[:, None], axis=3).sum(axis=2), axis=1)
+        return rolled[np.arange(len(points)), best].reshape(-1, 8)
 
-    def __init__(self, x_min, x_max, y_min, y_max, cls_name, is_difficult=False, is_truncated=False):
-        self.x_min = int(x_min)
-        self.x_max = int(x_max)
-        self.y_min = int(y_min)
-        self.y_max = int(y_max)
-        self.cls_name = str(cls_name)
-        self.is_difficult = bool(is_difficult)
-        self.is_truncated = bool(is_truncated)
+    voc_xml_header = "<?xml version=\"1.0\" ?>\n<annotation>\n\t<folder>%s</folder>\n\t<filename>%s</filename>\n\t<source>\n\t\t<database>Unknown</database>\n\t</source>\n\t<size>\n\t\t<width>%d</width>\n\t\t<height>%d</height>\n\t\t<depth>%d</depth>\n\t</size>\n\t<segmented>0</segmented>\n"
+    voc_xml_object = "\t<object>\n\t\t<name>%s</name>\n\t\t<pose>Unspecified</pose>\n\t\t<truncated>%d</truncated>\n\t\t<difficult>%d</difficult>\n\t\t<bndbox>\n\t\t\t<xmin>%d</xmin>\n\t\t\t<ymin>%d</ymin>\n\t\t\t<xmax>%d</xmax>\n\t\t\t<ymax>%d</ymax>\n\t\t</bndbox>\n\t</object>\n"
+    voc_xml_footer = "</annotation>\n"
 
+    @staticmethod
+    def getOverlapPairs(xyxy, cls_ids, cell_size):
+        # spatial grid join: every box is entered in each cell it covers, pairs are formed inside a (class, cell)
+        # bucket and kept only in the cell holding the top-left corner of their intersection, so each pair appears once
+        x0, y0 = np.floor_divide(xyxy[:, 0], cell_size).astype(np.int64), np.floor_divide(xyxy[:, 1], cell_size).astype(np.int64)
+        cols = np.floor_divide(xyxy[:, 2], cell_size).astype(np.int64) - x0 + 1
+        rows = np.floor_divide(xyxy[:, 3], cell_size).astype(np.int64) - y0 + 1
+        cells = cols * rows
+        boxes = np.repeat(np.arange(len(xyxy)), cells)
+        local = np.arange(len(boxes)) - np.repeat(np.cumsum(cells) - cells, cells)
+        cell_x = x0[boxes] + local % cols[boxes]
+        cell_y = y0[boxes] + local // cols[boxes]
+        order = np.lexsort((cell_x, cell_y, cls_ids[boxes]))
+        boxes, cell_x, cell_y = boxes[order], cell_x[order], cell_y[order]
+        starts = np.ones(len(boxes), dtype=bool)
+        starts[1:] = (cell_x[1:] != cell_x[:-1]) | (cell_y[1:] != cell_y[:-1]) | (cls_ids[boxes[1:]] != cls_ids[boxes[:-1]])
+        bucket_ends = np.append(np.nonzero(starts)[0][1:], len(boxes))[np.cumsum(starts) - 1]
+        partners = bucket_ends - np.arange(len(boxes)) - 1
+        first = np.repeat(np.arange(len(boxes)), partners)
+        second = first + 1 + np.arange(len(first)) - np.repeat(np.cumsum(partners) - partners, partners)
+        a, b = boxes[first], boxes[second]
+        inter_x0 = np.maximum(xyxy[a, 0], xyxy[b, 0])
+        inter_y0 = np.maximum(xyxy[a, 1], xyxy[b, 1])
+        keep = (inter_x0 < np.minimum(xyxy[a, 2], xyxy[b, 2])) & (inter_y0 < np.minimum(xyxy[a, 3], xyxy[b, 3]))
+        keep &= (np.floor_divide(inter_x0, cell_size) == cell_x[first]) & (np.floor_divide(inter_y0, cell_size) == cell_y[first])
+        return a[keep], b[keep]
 
-class VOCLabel(object):
+    @staticmethod
+    def groupOverlaps(xyxy, cls_ids, scores, iou_threshold=0.5, quads=None):
+        # greedy per-class NMS over the overlapping pairs of a spatial grid, so the cost stays near linear
+        # in the box count; returns the kept boxes and the cluster each of them suppressed
+        xyxy = np.asarray(xyxy, dtype=np.float64).reshape(-1, 4)
+        n = len(xyxy)
+        if n == 0:
+            return np.zeros(0, dtype=np.int64), []
+        cell_size = max(16.0, 2 * float(np.median(np.maximum(xyxy[:, 2] - xyxy[:, 0], xyxy[:, 3] - xyxy[:, 1]))))
+        a, b = RSDataSetsUtils.getOverlapPairs(xyxy, np.asarray(cls_ids), cell_size)
+        if quads is not None:
+            ious = RSDataSetsUtils.quadIoUs(quads[a], quads[b])
+        else:
+            inter = (np.minimum(xyxy[a, 2], xyxy[b, 2]) - np.maximum(xyxy[a, 0], xyxy[b, 0])) * (np.minimum(xyxy[a, 3], xyxy[b, 3]) - np.maximum(xyxy[a, 1], xyxy[b, 1]))
+            areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+            ious = inter / np.maximum(areas[a] + areas[b] - inter, 1e-12)
+        overlapping = ious > iou_threshold
+        a, b = np.concatenate([a[overlapping], b[overlapping]]), np.concatenate([b[overlapping], a[overlapping]])
+        order = np.argsort(a, kind="stable")
+        neighbours = b[order]
+        neighbour_starts = np.searchsorted(a[order], np.arange(n + 1))
+        grouped = np.zeros(n, dtype=bool)
+        keep, clusters = [], []
+        for i in np.argsort(-np.asarray(scores), kind="stable").tolist():
+            if grouped[i]:
+                continue
+            cluster = neighbours[neighbour_starts[i]: neighbour_starts[i + 1]]
+            cluster = np.concatenate([[i], cluster[~grouped[cluster]]]).astype(np.int64)
+            grouped[cluster] = True
+            keep.append(i)
+            clusters.append(cluster)
+        return np.array(keep, dtype=np.int64), clusters
 
-    def __init__(self, img_path, label_path):
-        self.img_path = img_path
-        self.label_path = label_path
-        self.BBoxes = []
-        self.img_w = 0
-        self.img_h = 0
-        self.img_d = 0
+    @staticmethod
+    def fuseClusters(xyxy, scores, clusters, quads=None):
+        # weighted box fusion of each cluster: coordinates averaged by score, score averaged;
+        # quad vertices are first rotated into the order of the cluster's best box
+        sizes = np.array([len(cluster) for cluster in clusters], dtype=np.int64)
+        members = np.concatenate(list(clusters) + [np.zeros(0, dtype=np.int64)])
+        owners = np.repeat(np.arange(len(clusters)), sizes)
+        member_scores = scores[members]
+        totals = np.bincount(owners, member_scores, len(clusters))
+        weights = np.where(totals[owners] > 0, member_scores / np.where(totals > 0, totals, 1)[owners], 1.0 / sizes[owners])
+        fused_scores = totals / np.maximum(sizes, 1)
 
-    def updateSize(self):
-        img = cv2.imread(self.img_path)
-        self.img_w = img.shape[1]
-        self.img_h = img.shape[0]
-        self.img_d = img.shape[2]
-        return self.img_h, self.img_w, self.img_d
+        def weightedSums(values):
+            return np.stack([np.bincount(owners, weights * values[:, j], len(clusters)) for j in range(values.shape[1])], axis=1).reshape(len(clusters), values.shape[1])
+        if quads is None:
+            return weightedSums(xyxy[members]), None, fused_scores
+        points = quads[members].reshape(-1, 4, 2)
+        seeds = quads[members[np.cumsum(sizes) - sizes]].reshape(-1, 4, 2)[owners]
+        rolled = np.stack([np.roll(points, -shift, axis=1) for shift in range(4)], axis=1)
+        best = np.argmin(np.linalg.norm(rolled - seeds[:, None], axis=3).sum(axis=2), axis=1)
+        fused_quads = weightedSums(rolled[np.arange(len(members)), best].reshape(-1, 8))
+        fused_xyxy = np.concatenate([fused_quads.reshape(-1, 4, 2).min(axis=1), fused_quads.reshape(-1, 4, 2).max(axis=1)], axis=1)
+        return fused_xyxy, fused_quads, fused_scores
 
-    def updateBBoxes(self):
-        import xml.etree.ElementTree as ET
-        with open(self.label_path, "r") as input_label_file:
-            tree = ET.parse(input_label_file)
-            root = tree.getroot()
-            for obj in root.iter("object"):
-                try:
-                    diffi = False if obj.find("difficult").text == "0" else True
-                except:
-                    diffi = False
-                try:
-                    trunc = False if obj.find("truncated").text == "0" else True
-                except:
-                    trunc = False
-                clsname = obj.find("name").text
-                xmlbox = obj.find("bndbox")
-                x1 = float(xmlbox.find("xmin").text)
-                x2 = float(xmlbox.find("xmax").text)
-                y1 = float(xmlbox.find("ymin").text)
-                y2 = float(xmlbox.find("ymax").text)
-                self.BBoxes.append(VOCBoudingBox(x1, x2, y1, y2, clsname, diffi, trunc))
-        return self.BBoxes
+    @staticmethod
+    def summarizeValues(values, percentiles=(1, 5, 25, 50, 75, 95, 99)):
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return {"count": 0}
+        points = np.percentile(values, percentiles)
+        return {"count": int(len(values)), "mean": float(values.mean()), "std": float(values.std()), "min": float(values.min()), "max": float(values.max()), "percentiles": dict(("%g" % p, float(v)) for p, v in zip(percentiles, points))}
 
-    def convert2YoloLabel(self, clss):
-        self.updateSize()
-        dw = 1.0/self.img_w
-        dh = 1.0/self.img_h
-        yolo_label = YoloLabel(self.img_path, self.label_path)
-        for box in self.BBoxes:
-            x = (box.x_min + box.x_max)/2.0 - 1
-            y = (box.y_min + box.y_max)/2.0 - 1
-            w = box.x_max - box.x_min
-            h = box.y_max - box.y_min
-            x = x*dw
-            w = w*dw
-            y = y*dh
-            h = h*dh
-            yolo_label.BBoxes.append(YoloBoudingBox(x, y, w, h, clss.index(box.cls_name)))
-        return yolo_label
+    @staticmethod
+    def anchorIoU(wh, anchors):
+        inter = np.minimum(wh[:, None, 0], anchors[None, :, 0]) * np.minimum(wh[:, None, 1], anchors[None, :, 1])
+        return inter / (wh[:, 0:1] * wh[:, 1:2] + anchors[:, 0] * anchors[:, 1] - inter)
 
+    @staticmethod
+    def kmeansAnchors(wh, k, max_iterations=300, max_samples=200000, seed=0):
+        # k-means on box width/height with 1 - IoU as the distance, as used for YOLO anchors
+        wh = np.asarray(wh, dtype=np.float64).reshape(-1, 2)
+        wh = wh[(wh > 0).all(axis=1)]
+        if len(wh) < k:
+            raise ValueError("%d boxes are not enough for %d anchors" % (len(wh), k))
+        rng = np.random.default_rng(seed)
+        if len(wh) > max_samples:
+            wh = wh[rng.choice(len(wh), max_samples, replace=False)]
+        anchors = wh[rng.choice(len(wh), k, replace=False)]
+        assignments = None
+        for iteration in range(max_iterations):
+            nearest = RSDataSetsUtils.anchorIoU(wh, anchors).argmax(axis=1)
+            if assignments is not None and (nearest == assignments).all():
+                break
+            assignments = nearest
+            for i in range(k):
+                members = wh[assignments == i]
+                if len(members):
+                    anchors[i] = np.median(members, axis=0)
+        anchors = anchors[np.argsort(anchors.prod(axis=1))]
+        return anchors, float(RSDataSetsUtils.anchorIoU(wh, anchors).max(axis=1).mean())
 
-class YoloLabel(VOCLabel):
+    @staticmethod
+    def assignSplits(keys, fractions, seed=0):
+        # splits every stratum by the fractions; leftover items go to the parts that are furthest below their share overall
+        keys = np.asarray(keys)
+        fractions = np.asarray(fractions, dtype=np.float64) / float(sum(fractions))
+        rng = np.random.default_rng(seed)
+        parts = np.zeros(len(keys), dtype=np.int64)
+        assigned = np.zeros(len(fractions), dtype=np.int64)
+        groups, inverse, sizes = np.unique(keys, return_inverse=True, return_counts=True)
+        for group in np.argsort(sizes, kind="stable"):
+            members = rng.permutation(np.nonzero(inverse == group)[0])
+            counts = np.floor(fractions * len(members)).astype(np.int64)
+            remainder = len(members) - counts.sum()
+            if remainder:
+                deficit = fractions * (assigned.sum() + len(members)) - (assigned + counts)
+                counts[np.argsort(-deficit, kind="stable")[:remainder]] += 1
+            parts[members] = np.repeat(np.arange(len(fractions)), counts)
+            assigned += counts
+        return parts
 
-    def __init__(self, img_path, label_path):
-        super(YoloLabel, self).__init__(img_path, label_path)
+    @staticmethod
+    def isLinkCurrent(src_path, dst_path, link_mode):
+        try:
+            if link_mode == "symlink":
+                return os.path.islink(dst_path) and os.readlink(dst_path) == src_path
+            if link_mode == "hardlink":
+                return os.path.samefile(src_path, dst_path)
+            src_stat = os.stat(src_path)
+            dst_stat = os.lstat(dst_path)
+            return not os.path.islink(dst_path) and dst_stat.st_size == src_stat.st_size and dst_stat.st_mtime_ns == src_stat.st_mtime_ns
+        except OSError:
+            return False
 
-    def updateBBoxes(self):
-        with open(self.label_path, "r") as input_label_file:
-            lines = [input_label_file.readlines()]
-            for line in lines:
-                for boxes in line:
-                    box = boxes.strip("\n")
-                    box = box.split(" ")
-                    clsid = int(box[0])
-                    x = float(box[1])
-                    y = float(box[2])
-                    w = float(box[3])
-                    h = float(box[4])
-                    self.BBoxes.append(YoloBoudingBox(x, y, w, h, clsid))
-        return self.BBoxes
+    @staticmethod
+    def reflinkFile(src_path, dst_path):
+        import fcntl
+        # FICLONE from linux/fs.h; works on btrfs, XFS and other copy-on-write file systems
+        with open(src_path, "rb") as src_file, open(dst_path, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), 0x40049409, src_file.fileno())
 
-    def convert2VOCLabel(self, clss):
-        self.updateSize()
-        voc_label = VOCLabel(self.img_path, self.label_path)
-        for box in self.BBoxes:
-            x1 = int(box.center_x * self.img_w - box.bbox_width * self.img_w / 2)
-            x2 = int(box.center_x * self.img_w + box.bbox_width * self.img_w / 2)
-            y1 = int(box.center_y * self.img_h - box.bbox_height * self.img_h / 2)
-            y2 = int(box.center_y * self.img_h + box.bbox_height * self.img_h / 2)
-            voc_label.BBoxes.append(VOCBoudingBox(x1, x2, y1, y2, clss[box.cls_id]))
-        return voc_label
+    @staticmethod
+    def linkFile(src_path, dst_path, link_mode):
+        if RSDataSetsUtils.isLinkCurrent(src_path, dst_path, link_mode):
+            return "skipped"
+        tmp_path = dst_path + ".part"
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        status = "linked"
+        if link_mode == "symlink":
+            os.symlink(src_path, tmp_path)
+        elif link_mode == "hardlink":
+            os.link(src_path, tmp_path)
+        else:
+            import shutil
+            if link_mode == "reflink":
+                try:
+                    RSDataSetsUtils.reflinkFile(src_path, tmp_path)
+                except (ImportError, OSError):
+                    status = "fallback"
+            if link_mode == "copy" or status == "fallback":
+                shutil.copyfile(src_path, tmp_path)
+            shutil.copystat(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+        return status
+
+    @staticmethod
+    def readYoloClassIds(label_path):
+        cls_ids = []
+        with open(label_path, "r") as input_label_file:
+            for line in input_label_file:
+                line = line.split(None, 1)
+                if line:
+                    cls_ids.append(int(line[0]))
+        return cls_ids
 
+    @staticmethod
+    def escapeXmlText(text):
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
 
-class RSDataSetsUtils:
+    @staticmethod
+    def renderVOCXml(voc_label):
+        if not (voc_label.img_w and voc_label.img_h):
+            voc_label.updateSize()
+        img_folder, img_name = os.path.split(voc_label.img_path)
+        escape = RSDataSetsUtils.escapeXmlText
+        chunks = [RSDataSetsUtils.voc_xml_header % (escape(img_folder), escape(img_name), voc_label.img_w, voc_label.img_h, voc_label.img_d)]
+        bboxes = voc_label.BBoxes
+        if len(bboxes):
+            names = [escape(name) for name in VOCBBoxes.class_names.names]
+            object_xml = RSDataSetsUtils.voc_xml_object
+            flags = bboxes.flags
+            truncated = ((flags & VOCBBoxes.TRUNCATED) != 0).tolist()
+            difficult = ((flags & VOCBBoxes.DIFFICULT) != 0).tolist()
+            for cls_id, trunc, diffi, (x_min, y_min, x_max, y_max) in zip(bboxes.cls_ids.tolist(), truncated, difficult, bboxes.xyxy.tolist()):
+                chunks.append(object_xml % (names[cls_id], trunc, diffi, x_min, y_min, x_max, y_max))
+        chunks.append(RSDataSetsUtils.voc_xml_footer)
+        return "".join(chunks)
 
     @staticmethod
     def writeVOCXmlLabel(voc_label, xml_label_path):
-        from xml.dom import minidom
-        voc_label.updateSize()
-        img_folder = os.path.split(voc_label.img_path)[0]
-        img_name = os.path.split(voc_label.img_path)[1]
-        doc = minidom.Document()
-        annotation = doc.createElement("annotation")
-        doc.appendChild(annotation)
-        folder = doc.createElement("folder")
-        folder.appendChild(doc.createTextNode(img_folder))
-        annotation.appendChild(folder)
-        filename = doc.createElement("filename")
-        filename.appendChild(doc.createTextNode(img_name))
-        annotation.appendChild(filename)
-        source = doc.createElement("source")
-        database = doc.createElement("database")
-        database.appendChild(doc.createTextNode("Unknown"))
-        source.appendChild(database)
-        annotation.appendChild(source)
-        size = doc.createElement("size")
-        width = doc.createElement("width")
-        width.appendChild(doc.createTextNode(str(voc_label.img_w)))
-        size.appendChild(width)
-        height = doc.createElement("height")
-        height.appendChild(doc.createTextNode(str(voc_label.img_h)))
-        size.appendChild(height)
-        depth = doc.createElement("depth")
-        depth.appendChild(doc.createTextNode(str(voc_label.img_d)))
-        size.appendChild(depth)
-        annotation.appendChild(size)
-        segmented = doc.createElement("segmented")
-        segmented.appendChild(doc.createTextNode("0"))
-        annotation.appendChild(segmented)
-        for box in voc_label.BBoxes:
-            object = doc.createElement("object")
-            nm = doc.createElement("name")
-            nm.appendChild(doc.createTextNode(box.cls_name))
-            object.appendChild(nm)
-            pose = doc.createElement("pose")
-            pose.appendChild(doc.createTextNode("Unspecified"))
-            object.appendChild(pose)
-            truncated = doc.createElement("truncated")
-            truncated.appendChild(doc.createTextNode(
-                "1" if box.is_truncated else "0"))
-            object.appendChild(truncated)
-            difficult = doc.createElement("difficult")
-            difficult.appendChild(doc.createTextNode("1" if box.is_difficult else "0"))
-            object.appendChild(difficult)
-            bndbox = doc.createElement("bndbox")
-            xmin = doc.createElement("xmin")
-            xmin.appendChild(doc.createTextNode(str(box.x_min)))
-            bndbox.appendChild(xmin)
-            ymin = doc.createElement("ymin")
-            ymin.appendChild(doc.createTextNode(str(box.y_min)))
-            bndbox.appendChild(ymin)
-            xmax = doc.createElement("xmax")
-            xmax.appendChild(doc.createTextNode(str(box.x_max)))
-            bndbox.appendChild(xmax)
-            ymax = doc.createElement("ymax")
-            ymax.appendChild(doc.createTextNode(str(box.y_max)))
-            bndbox.appendChild(ymax)
-            object.appendChild(bndbox)
-            annotation.appendChild(object)
-            with open(xml_label_path, "w") as output_label_file:
-                output_label_file.write(doc.toprettyxml())
+        xml_text = RSDataSetsUtils.renderVOCXml(voc_label)
+        with open(xml_label_path, "w") as output_label_file:
+            output_label_file.write(xml_text)
+
+    @staticmethod
+    def writeVOCXmlLabels(voc_labels, xml_label_paths):
+        count = 0
+        for voc_label, xml_label_path in zip(voc_labels, xml_label_paths):
+            RSDataSetsUtils.writeVOCXmlLabel(voc_label, xml_label_path)
+            count += 1
+        return count
+
+    @staticmethod
+    def readVOCXmlObjects(root):
+        cls_names, is_difficult, is_truncated, coords = [], [], [], []
+        for obj in root.iter("object"):
+            xmlbox = obj.find("bndbox")
+            cls_names.append(str(obj.findtext("name")))
+            coords.append((xmlbox.findtext("xmin"), xmlbox.findtext("ymin"), xmlbox.findtext("xmax"), xmlbox.findtext("ymax")))
+            is_difficult.append(obj.findtext("difficult") not in (None, "0"))
+            is_truncated.append(obj.findtext("truncated") not in (None, "0"))
+        return cls_names, coords, is_difficult, is_truncated
+
+    @staticmethod
+    def readVOCXml(label_path):
+        root = etree.parse(label_path).getroot()
+        columns = None
+        if lxml_available:
+            # one XPath per field pulls a whole column; used when every object has every field
+            count = int(root.xpath("count(.//object)"))
+            columns = [root.xpath(".//object/%s/text()" % path) for path in ("name", "bndbox/xmin", "bndbox/ymin", "bndbox/xmax", "bndbox/ymax", "difficult", "truncated")]
+            if not all(len(column) == count for column in columns[:5]) or not all(len(column) in (0, count) for column in columns[5:]):
+                columns = None
+        if columns is not None:
+            cls_names = [str(name) for name in columns[0]]
+            coords = columns[1:5]
+            is_difficult, is_truncated = [np.array(column, dtype=str) != "0" if column else np.zeros(count, dtype=bool) for column in columns[5:]]
+            xyxy = np.array(coords, dtype=np.float64).reshape(4, -1).T
+        else:
+            cls_names, coords, is_difficult, is_truncated = RSDataSetsUtils.readVOCXmlObjects(root)
+            xyxy = np.array(coords, dtype=np.float64).reshape(-1, 4)
+        size = None
+        size_elem = root.find(".//size")
+        if size_elem is not None:
+            size = []
+            for tag in ("height", "width", "depth"):
+                try:
+                    size.append(int(float(size_elem.findtext(tag))))
+                except (TypeError, ValueError):
+                    size.append(0)
+        return xyxy.astype(np.int32), cls_names, np.array(is_difficult, dtype=bool), np.array(is_truncated, dtype=bool), tuple(size or (0, 0, 0))
+
+    @staticmethod
+    def prefetchIter(iterable, depth=8):
+        import queue
+        items = queue.Queue(maxsize=max(1, depth))
+        done = object()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for item in iterable:
+                    while not stop.is_set():
+                        try:
+                            items.put((item, None), timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+                items.put((done, None))
+            except Exception as e:
+                items.put((done, e))
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                item, error = items.get()
+                if item is done:
+                    if error is not None:
+                        raise error
+                    return
+                yield item
+        finally:
+            stop.set()
+
+    @staticmethod
+    def takeResult(item, future):
+        try:
+            return item, future.result(), None
+        except Exception as e:
+            return item, None, e
+
+    @staticmethod
+    def readAhead(func, items, workers=4, depth=None, admit=None):
+        # ordered map of func over items on a thread pool, keeping at most depth calls in flight;
+        # yields (item, result, error) so one failing item does not stop the others;
+        # admit(item, wait) reserves what an item needs before it is started, returning False instead of waiting
+        # makes read-ahead hand out finished items first
+        if workers is None or workers < 1:
+            for item in items:
+                if admit is not None:
+                    admit(item, True)
+                try:
+                    yield item, func(item), None
+                except Exception as e:
+                    yield item, None, e
+            return
+        import collections
+        from concurrent.futures import ThreadPoolExecutor
+        depth = max(1, depth or 2 * workers)
+        pending = collections.deque()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                for item in items:
+                    while admit is not None and not admit(item, not pending):
+                        yield RSDataSetsUtils.takeResult(*pending.popleft())
+                    pending.append((item, executor.submit(func, item)))
+                    if len(pending) >= depth:
+                        yield RSDataSetsUtils.takeResult(*pending.popleft())
+                while pending:
+                    yield RSDataSetsUtils.takeResult(*pending.popleft())
+            finally:
+                for item, future in pending:
+                    future.cancel()
+
+    @staticmethod
+    def writeLabelStream(label_stream, dst_path, target="voc", classes=None):
+        if not os.path.exists(dst_path):
+            os.makedirs(dst_path)
+        count = 0
+        for img_path, voc_label in label_stream:
+            name = os.path.splitext(os.path.basename(img_path))[0]
+            if target == "voc":
+                RSDataSetsUtils.writeVOCXmlLabel(voc_label, os.path.join(dst_path, name + ".xml"))
+            else:
+                RSDataSetsUtils.writeYoloTxtLabel(voc_label.convert2YoloLabel(classes), os.path.join(dst_path, name + ".txt"))
+            count += 1
+        return count
 
     @staticmethod
     def writeYoloTxtLabel(yolo_label, label_txt_path):
@@ -205,63 +2033,191 @@ class RSDataSetsUtils:
                 output_label_file.write("%d %.16f %.16f %.16f %.16f\n" % (box.cls_id, box.center_x, box.center_y, box.width, box.height))
 
     @staticmethod
-    def getDOTA(img_path, label_path):
-        voc_label = VOCLabel(img_path, label_path)
+    def getQuads(voc_label):
+        if voc_label.OBBoxes is not None:
+            return voc_label.OBBoxes.quads, voc_label.OBBoxes.cls_ids, voc_label.OBBoxes.is_difficult
+        return RSDataSetsUtils.xyxy2Quads(voc_label.BBoxes.xyxy), voc_label.BBoxes.cls_ids, voc_label.BBoxes.is_difficult
+
+    @staticmethod
+    def writeDOTATxtLabel(voc_label, label_txt_path):
+        quads, cls_ids, is_difficult = RSDataSetsUtils.getQuads(voc_label)
+        names = VOCBBoxes.class_names.names
+        with open(label_txt_path, "w") as output_label_file:
+            for quad, cls_id, diffi in zip(quads.tolist(), cls_ids.tolist(), is_difficult.tolist()):
+                output_label_file.write("%.1f %.1f %.1f %.1f %.1f %.1f %.1f %.1f %s %d\n" % tuple(quad + [names[cls_id], diffi]))
+
+    @staticmethod
+    def writeYoloOBBTxtLabel(voc_label, clss, label_txt_path):
+        if not (voc_label.img_w and voc_label.img_h):
+            voc_label.updateSize()
+        quads, cls_ids, is_difficult = RSDataSetsUtils.getQuads(voc_label)
+        quads = quads / np.tile([float(voc_label.img_w), float(voc_label.img_h)], 4)
+        cls_ids = VOCBBoxes.class_names.getIndices(cls_ids, clss)
+        with open(label_txt_path, "w") as output_label_file:
+            for cls_id, quad in zip(cls_ids.tolist(), quads.tolist()):
+                output_label_file.write("%d %.16f %.16f %.16f %.16f %.16f %.16f %.16f %.16f\n" % tuple([cls_id] + quad))
+
+    @staticmethod
+    def writeDetections(det_path, det_format, img_path, img_w, img_h, xyxy, quads, cls_ids, scores, clss=None):
+        if quads is None:
+            quads = RSDataSetsUtils.xyxy2Quads(xyxy)
+        if det_format == "voc":
+            voc_label = VOCLabel(img_path, det_path)
+            voc_label.img_w, voc_label.img_h, voc_label.img_d = img_w, img_h, 3
+            voc_label.BBoxes.extendArrays(np.round(xyxy).astype(np.int32), cls_ids, np.zeros(len(xyxy), dtype=bool), np.zeros(len(xyxy), dtype=bool))
+            RSDataSetsUtils.writeVOCXmlLabel(voc_label, det_path)
+            return
+        names = VOCBBoxes.class_names.names
+        with open(det_path, "w") as output_det_file:
+            if det_format == "dota":
+                for quad, cls_id, score in zip(quads.tolist(), cls_ids.tolist(), scores.tolist()):
+                    output_det_file.write("%.1f %.1f %.1f %.1f %.1f %.1f %.1f %.1f %s %.4f\n" % tuple(quad + [names[cls_id], score]))
+                return
+            indices = VOCBBoxes.class_names.getIndices(cls_ids, clss)
+            if det_format == "yolo_obb":
+                quads = quads / np.tile([float(img_w), float(img_h)], 4)
+                for cls_id, quad, score in zip(indices.tolist(), quads.tolist(), scores.tolist()):
+                    output_det_file.write("%d %.16f %.16f %.16f %.16f %.16f %.16f %.16f %.16f %.4f\n" % tuple([cls_id] + quad + [score]))
+                return
+            center = (xyxy[:, :2] + xyxy[:, 2:]) / 2 / [img_w, img_h]
+            size = (xyxy[:, 2:] - xyxy[:, :2]) / [img_w, img_h]
+            for cls_id, (center_x, center_y), (width, height), score in zip(indices.tolist(), center.tolist(), size.tolist(), scores.tolist()):
+                output_det_file.write("%d %.16f %.16f %.16f %.16f %.4f\n" % (cls_id, center_x, center_y, width, height, score))
+
+    @staticmethod
+    def matchLabelLines(label_path, line_pattern, ignore_words=()):
         with open(label_path, "r") as input_label_file:
-            lines = [input_label_file.readlines()]
-            for line in lines:
-                for boxes in line:
-                    if "imagesource" in boxes or "gsd" in boxes:
-                        continue
-                    box = boxes.strip("\n")
-                    box = box.split(" ")
-                    x_min = min(float(box[0]), float(box[2]), float(box[4]), float(box[6]))
-                    y_min = min(float(box[1]), float(box[3]), float(box[5]), float(box[7]))
-                    x_max = max(float(box[0]), float(box[2]), float(box[4]), float(box[6]))
-                    y_max = max(float(box[1]), float(box[3]), float(box[5]), float(box[7]))
-                    cls_name = box[8]
-                    is_difficult = False if box[9] == "0" else True
-                    voc_label.BBoxes.append(VOCBoudingBox(x_min, x_max, y_min, y_max, cls_name, is_difficult))
-        return voc_label
+            rows = line_pattern.findall(input_label_file.read())
+        rows = np.array(rows, dtype=str).reshape(-1, line_pattern.groups)
+        valid = rows[:, 0] != ""
+        malformed = ~valid & (np.char.str_len(np.char.strip(rows[:, -1])) > 0)
+        for word in ignore_words:
+            malformed &= np.char.find(rows[:, -1], word) < 0
+        return rows[valid, :-1], np.nonzero(valid)[0] + 1, (np.nonzero(malformed)[0] + 1).tolist()
 
     @staticmethod
-    def getVisDrone(img_path, label_path):
-        classes = ["ignored regions", "pedestrian", "people", "bicycle", "car", "van", "truck", "tricycle", "awning-tricycle", "bus", "motor", "others"]
-        voc_label = VOCLabel(img_path, label_path)
+    def splitLabelColumns(label_path, num_columns, min_fields, dtype, sep=None, ignore_words=(), delete_chars=""):
+        # returns None when a line is malformed, the caller then falls back to matchLabelLines for the line numbers
         with open(label_path, "r") as input_label_file:
-            lines = [input_label_file.readlines()]
-            for line in lines:
-                for boxes in line:
-                    box = boxes.strip("\n")
-                    box = box.split(",")
-                    x_min = box[0]
-                    y_min = box[1]
-                    x_max = int(box[0]) + int(box[2])
-                    y_max = int(box[1]) + int(box[3])
-                    cls_name = classes[int(box[5])]
-                    is_truncated = True if int(box[6]) > 0 or int(box[7]) > 0 else False
-                    is_difficult = True if int(box[7]) > 1 else False
-                    voc_label.BBoxes.append(VOCBoudingBox(x_min, x_max, y_min, y_max, cls_name, is_difficult, is_truncated))
+            text = input_label_file.read()
+        if delete_chars:
+            text = text.translate(dict.fromkeys(map(ord, delete_chars)))
+        rows = []
+        for line in text.splitlines():
+            fields = line.split(sep)
+            if len(fields) >= min_fields:
+                rows.append(fields)
+            elif line.strip() and not any(word in line for word in ignore_words):
+                return None
+        try:
+            values = np.array([fields[:num_columns] for fields in rows], dtype=dtype).reshape(-1, num_columns)
+        except ValueError:
+            return None
+        if values.dtype.kind == "f" and not np.isfinite(values).all():
+            return None
+        return values, rows
+
+    @staticmethod
+    def checkParseErrors(label_path, errors):
+        if errors:
+            raise ValueError("%s: malformed line(s) %s" % (label_path, ", ".join(str(i) for i in errors)))
+
+    @staticmethod
+    def parseDOTAQuads(label_path):
+        columns = RSDataSetsUtils.splitLabelColumns(label_path, 8, 10, np.float64, ignore_words=("imagesource", "gsd"))
+        if columns is None:
+            tokens, line_numbers, errors = RSDataSetsUtils.matchLabelLines(label_path, RSDataSetsUtils.dota_line_pattern, ("imagesource", "gsd"))
+            return tokens[:, :8].astype(np.float64), VOCBBoxes.class_names.getColumnIds(tokens[:, 8]), tokens[:, 9] != "0", errors
+        quads, rows = columns
+        cls_ids = VOCBBoxes.class_names.getColumnIds([fields[8] for fields in rows])
+        return quads, cls_ids, np.array([fields[9] != "0" for fields in rows], dtype=bool), []
+
+    @staticmethod
+    def parseDOTA(label_path):
+        quads, cls_ids, is_difficult, errors = RSDataSetsUtils.parseDOTAQuads(label_path)
+        return RSDataSetsUtils.quads2XYXY(quads), cls_ids, is_difficult, np.zeros(len(quads), dtype=bool), errors
+
+    @staticmethod
+    def parseVisDrone(label_path):
+        columns = RSDataSetsUtils.splitLabelColumns(label_path, 8, 8, np.int64, ",")
+        values, errors = columns[0] if columns is not None else None, []
+        if values is None or not ((values[:, 5] >= 0) & (values[:, 5] < len(RSDataSetsUtils.visdrone_classes))).all():
+            tokens, line_numbers, errors = RSDataSetsUtils.matchLabelLines(label_path, RSDataSetsUtils.visdrone_line_pattern)
+            values = tokens.astype(np.int64)
+            known = values[:, 5] < len(RSDataSetsUtils.visdrone_classes)
+            if not known.all():
+                errors = sorted(errors + line_numbers[~known].tolist())
+                values = values[known]
+        xyxy = np.stack([values[:, 0], values[:, 1], values[:, 0] + values[:, 2], values[:, 1] + values[:, 3]], axis=1).astype(np.int32)
+        cls_ids = VOCBBoxes.class_names.getIds(RSDataSetsUtils.visdrone_classes)[values[:, 5]]
+        return xyxy, cls_ids, values[:, 7] > 1, (values[:, 6] > 0) | (values[:, 7] > 0), errors
+
+    @staticmethod
+    def parseVHR(label_path):
+        columns = RSDataSetsUtils.splitLabelColumns(label_path, 5, 5, np.int64, ",", delete_chars="()")
+        values, errors = columns[0] if columns is not None else None, []
+        if values is None or not ((values[:, 4] >= 0) & (values[:, 4] < len(RSDataSetsUtils.vhr_classes))).all():
+            tokens, line_numbers, errors = RSDataSetsUtils.matchLabelLines(label_path, RSDataSetsUtils.vhr_line_pattern)
+            values = tokens.astype(np.int64)
+            known = values[:, 4] < len(RSDataSetsUtils.vhr_classes)
+            if not known.all():
+                errors = sorted(errors + line_numbers[~known].tolist())
+                values = values[known]
+        cls_ids = VOCBBoxes.class_names.getIds(RSDataSetsUtils.vhr_classes)[values[:, 4]]
+        return values[:, :4].astype(np.int32), cls_ids, np.zeros(len(values), dtype=bool), np.zeros(len(values), dtype=bool), errors
+
+    @staticmethod
+    def parseDetections(det_path, det_format, tile_w, tile_h, clss=None):
+        # returns xyxy and quads (None for axis-aligned formats) in tile pixels, class ids and scores;
+        # yolo and yolo_obb take an optional trailing confidence, dota takes the score in place of the difficult flag
+        if det_format == "voc":
+            xyxy, cls_names, is_difficult, is_truncated, size = RSDataSetsUtils.readVOCXml(det_path)
+            return xyxy.astype(np.float64), None, VOCBBoxes.class_names.getIds(cls_names), np.ones(len(xyxy))
+        if det_format == "dota":
+            tokens, line_numbers, errors = RSDataSetsUtils.matchLabelLines(det_path, RSDataSetsUtils.dota_line_pattern, ("imagesource", "gsd"))
+            RSDataSetsUtils.checkParseErrors(det_path, errors)
+            quads = tokens[:, :8].astype(np.float64)
+            return np.concatenate([quads.reshape(-1, 4, 2).min(axis=1), quads.reshape(-1, 4, 2).max(axis=1)], axis=1), quads, VOCBBoxes.class_names.getIds(tokens[:, 8].tolist()), tokens[:, 9].astype(np.float64)
+        line_pattern = RSDataSetsUtils.yolo_obb_det_line_pattern if det_format == "yolo_obb" else RSDataSetsUtils.yolo_det_line_pattern
+        tokens, line_numbers, errors = RSDataSetsUtils.matchLabelLines(det_path, line_pattern)
+        known = tokens[:, 0].astype(np.int64) < len(clss)
+        RSDataSetsUtils.checkParseErrors(det_path, sorted(errors + line_numbers[~known].tolist()))
+        cls_ids = VOCBBoxes.class_names.getIds(clss)[tokens[:, 0].astype(np.int64)]
+        scores = np.where(tokens[:, -1] == "", "1", tokens[:, -1]).astype(np.float64)
+        values = tokens[:, 1: -1].astype(np.float64)
+        if det_format == "yolo_obb":
+            quads = values * np.tile([float(tile_w), float(tile_h)], 4)
+            return np.concatenate([quads.reshape(-1, 4, 2).min(axis=1), quads.reshape(-1, 4, 2).max(axis=1)], axis=1), quads, cls_ids, scores
+        center = values[:, :2] * [tile_w, tile_h]
+        half = values[:, 2:] * [tile_w, tile_h] / 2
+        return np.concatenate([center - half, center + half], axis=1), None, cls_ids, scores
+
+    @staticmethod
+    def getParsedLabel(img_path, label_path, parser):
+        xyxy, cls_names, is_difficult, is_truncated, errors = parser(label_path)
+        RSDataSetsUtils.checkParseErrors(label_path, errors)
+        voc_label = VOCLabel(img_path, label_path)
+        voc_label.BBoxes.extendArrays(xyxy, cls_names, is_difficult, is_truncated)
         return voc_label
 
     @staticmethod
-    def getVHR(img_path, label_path):
-        classes = ["airplane", "ship", "storage tank", "baseball diamond", "tennis court", "basketball court", "ground track field", "harbor", "bridge", "vehicle"]
+    def getDOTA(img_path, label_path):
+        quads, cls_ids, is_difficult, errors = RSDataSetsUtils.parseDOTAQuads(label_path)
+        RSDataSetsUtils.checkParseErrors(label_path, errors)
         voc_label = VOCLabel(img_path, label_path)
-        with open(label_path, "r") as input_label_file:
-            lines = [input_label_file.readlines()]
-            for line in lines:
-                for boxes in line:
-                    box = boxes.strip("\n")
-                    box = box.split(",")
-                    x_min = int(box[0].replace("(", ""))
-                    y_min = int(box[1].replace(")", ""))
-                    x_max = int(box[2].replace("(", ""))
-                    y_max = int(box[3].replace(")", ""))
-                    cls_name = classes[int(box[4])]
-                    voc_label.BBoxes.append(VOCBoudingBox(x_min, x_max, y_min, y_max, cls_name))
+        voc_label.OBBoxes = OrientedBBoxes()
+        voc_label.OBBoxes.extendArrays(quads, cls_ids, is_difficult)
+        voc_label.BBoxes.extendArrays(voc_label.OBBoxes.getXYXY(), voc_label.OBBoxes.cls_ids, is_difficult)
         return voc_label
 
+    @staticmethod
+    def getVisDrone(img_path, label_path):
+        return RSDataSetsUtils.getParsedLabel(img_path, label_path, RSDataSetsUtils.parseVisDrone)
+
+    @staticmethod
+    def getVHR(img_path, label_path):
+        return RSDataSetsUtils.getParsedLabel(img_path, label_path, RSDataSetsUtils.parseVHR)
+
     @staticmethod
     def fillRight(img, size_w):
         size = img.shape
@@ -280,6 +2236,24 @@ class RSDataSetsUtils:
         img_fill_right_bottom = cv2.copyMakeBorder(img, 0, size_h - size[0], 0, size_w - size[1], cv2.BORDER_CONSTANT, value=(107, 113, 115))
         return img_fill_right_bottom
 
+    @staticmethod
+    def getImgWriteParams(img_format, quality=None):
+        img_format = img_format.lower().lstrip(".")
+        if img_format in ("jpg", "jpeg"):
+            return [cv2.IMWRITE_JPEG_QUALITY, 95 if quality is None else int(quality)]
+        elif img_format == "webp":
+            return [cv2.IMWRITE_WEBP_QUALITY, 101 if quality is None else int(quality)]
+        elif img_format == "png" and quality is not None:
+            return [cv2.IMWRITE_PNG_COMPRESSION, int(quality)]
+        return []
+
+    @staticmethod
+    def writeImg(img_path, img, params=None):
+        if os.path.splitext(img_path)[-1].lower() == ".npy":
+            np.save(img_path, np.ascontiguousarray(img))
+        elif not cv2.imwrite(img_path, img, params or []):
+            raise IOError("can not write image: %s" % img_path)
+
     @staticmethod
     def isBetween(a, b):
         flag = True
@@ -288,26 +2262,58 @@ class RSDataSetsUtils:
                 flag = False
         return flag
 
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def getClassColor(cls_name):
+        import zlib
+        hue = zlib.crc32(cls_name.encode("utf-8")) % 180
+        return tuple(int(c) for c in cv2.cvtColor(np.uint8([[[hue, 220, 255]]]), cv2.COLOR_HSV2BGR)[0, 0])
+
+    @staticmethod
+    def drawLabel(img, voc_label, scale_x=1.0, scale_y=1.0):
+        if voc_label.OBBoxes is not None:
+            polygons = np.round(voc_label.OBBoxes.quads.reshape(-1, 4, 2) * [scale_x, scale_y]).astype(np.int32)
+            for polygon, cls_name in zip(polygons, voc_label.OBBoxes.cls_names):
+                color = RSDataSetsUtils.getClassColor(cls_name)
+                cv2.polylines(img, [polygon], True, color, 1)
+                cv2.putText(img, cls_name, (int(polygon[0, 0]), max(int(polygon[0, 1]), 10)), cv2.FONT_HERSHEY_PLAIN, 0.75, color, thickness=1)
+            return img
+        xyxy = np.round(voc_label.BBoxes.xyxy * [scale_x, scale_y, scale_x, scale_y]).astype(np.int32)
+        for (x_min, y_min, x_max, y_max), cls_name in zip(xyxy.tolist(), voc_label.BBoxes.cls_names):
+            color = RSDataSetsUtils.getClassColor(cls_name)
+            cv2.rectangle(img, (x_min, y_min), (x_max, y_max), color, 1)
+            cv2.putText(img, cls_name, (x_min, max(y_min, 10)), cv2.FONT_HERSHEY_PLAIN, 0.75, color, thickness=1)
+        return img
+
+    @staticmethod
+    def composeSheet(cells, captions, cols, cell_size):
+        caption_h = 14
+        rows = max(1, -(-len(cells) // cols))
+        sheet = np.full((rows * (cell_size + caption_h), cols * cell_size, 3), 32, dtype=np.uint8)
+        for i, (cell, caption) in enumerate(zip(cells, captions)):
+            top, left = (i // cols) * (cell_size + caption_h), (i % cols) * cell_size
+            offset_y, offset_x = (cell_size - cell.shape[0]) // 2, (cell_size - cell.shape[1]) // 2
+            sheet[top + offset_y: top + offset_y + cell.shape[0], left + offset_x: left + offset_x + cell.shape[1]] = cell
+            cv2.putText(sheet, caption, (left + 2, top + cell_size + caption_h - 3), cv2.FONT_HERSHEY_PLAIN, 0.8, (255, 255, 255), thickness=1)
+        return sheet
+
     @staticmethod
     def plotLabeledImg(voc_label):
-        img = cv2.imread(voc_label.img_path)
-        for box in voc_label.BBoxes:
-            cv2.putText(img,box.cls_name,(box.x_min, box.y_min), cv2.FONT_HERSHEY_PLAIN, 0.75, (0, 0, 255), thickness=1)
-            cv2.rectangle(img, (box.x_min, box.y_min), (box.x_max, box.y_max), (0, 255, 0), 1)
+        img = RSDataSetsUtils.drawLabel(cv2.imread(voc_label.img_path), voc_label)
         cv2.imshow(voc_label.img_path, img)
         cv2.waitKey()
 
     @staticmethod
     def getImgExtName(name, path):
-        ext_list = [".jpg", ".png", ".bmp", ".jpeg", ".jpe", ".pbm", ".pgm", ".ppm", ".sr", ".ras", ".tiff", ".tif", ".exr", "jp2"]
-        for i in ext_list:
-            if os.path.exists(path + name):
-                return i
+        img_path = ImgPathIndex.forFolder(path).getPath(name)
+        return None if img_path is None else os.path.splitext(img_path)[-1]
 
 
 class RSDataSetsConverter(RSDataSetsUtils):
 
-    def __init__(self, dataset_name, dataset_type, images_folder_path, labels_folder_path):
+    def __init__(self, dataset_name, dataset_type, images_folder_path, labels_folder_path, instrumentation=None, io_threads=0):
+        self.instrumentation = instrumentation if instrumentation is not None else NullInstrumentation()
+        self.io_threads = io_threads
         self.dataset_name = dataset_name
         self.dataset_type = dataset_type.lower()
         if self.dataset_type not in ["visdrone", "voc", "dota", "yolo", "vhr"]:
@@ -316,248 +2322,1071 @@ class RSDataSetsConverter(RSDataSetsUtils):
         self.images_folder_path = images_folder_path
         self.labels_folder_path = labels_folder_path
 
-    def convert2VOC(self):
-        file_list = os.listdir(self.labels_folder_path)
-        if self.dataset_type == "yolo":
-            for label_filename in file_list:
-                if os.path.splitext(label_filename)[-1] != ".txt":
-                    continue
-                label_full_path = os.path.join(self.labels_folder_path, label_filename)
-                img_full_path = os.path.join(self.images_folder_path, os.path.splitext(label_filename)[0] + self.getImgExtName(os.path.splitext(label_filename)[0], self.images_folder_path))
-                yolo_label = YoloLabel(img_full_path, label_full_path)
-                yolo_label.updateSize()
-                yolo_label.updateBBoxes()
-                voc_label = yolo_label.convert2VOCLabel(classes)
-                output_file_name = os.path.splitext(os.path.basename(img_full_path))[0] + ".txt"
-                save_path = os.path.join(self.labels_folder_path, "../YOLO")
-                if not os.path.exists(save_path):
-                    os.makedirs(save_path)
-                self.writeYoloTxtLabel(yolo_label, os.path.join(save_path, output_file_name))
+    def getLabelExtName(self):
+        return ".xml" if self.dataset_type == "voc" else ".txt"
+
+    def getImgPath(self, name):
+        return ImgPathIndex.forFolder(self.images_folder_path).getPath(name, ".png" if self.dataset_type == "dota" else ".jpg")
+
+    def getDefaultClasses(self):
+        return {"dota": self.dota_classes, "visdrone": self.visdrone_classes, "vhr": self.vhr_classes}.get(self.dataset_type)
+
+    def getVOCLabel(self, img_full_path, label_full_path, classes=None):
         if self.dataset_type == "dota":
-            for label_filename in file_list:
-                if os.path.splitext(label_filename)[-1] != ".txt":
-                    continue
-                label_full_path = os.path.join(self.labels_folder_path, label_filename)
-                img_full_path = os.path.join(self.images_folder_path, os.path.splitext(label_filename)[0] + ".png")
-                voc_label = self.getDOTA(img_full_path, label_full_path)
-                output_file_name = os.path.splitext(os.path.basename(img_full_path))[0] + ".xml"
-                save_path = os.path.join(self.labels_folder_path, "../VOC")
-                if not os.path.exists(save_path):
-                    os.makedirs(save_path)
-                self.writeVOCXmlLabel(voc_label, os.path.join(save_path, output_file_name))
+            return self.getDOTA(img_full_path, label_full_path)
         elif self.dataset_type == "visdrone":
-            for label_filename in file_list:
-                if os.path.splitext(label_filename)[-1] != ".txt":
-                    continue
-                label_full_path = os.path.join(self.labels_folder_path, label_filename)
-                img_full_path = os.path.join(self.images_folder_path, os.path.splitext(label_filename)[0] + ".jpg")
-                voc_label = self.getVisDrone(img_full_path, label_full_path)
-                output_file_name = os.path.splitext(os.path.basename(img_full_path))[0] + ".xml"
-                save_path = os.path.join(self.labels_folder_path, "../VOC")
-                if not os.path.exists(save_path):
-                    os.makedirs(save_path)
-                self.writeVOCXmlLabel(voc_label, os.path.join(save_path, output_file_name))
+            return self.getVisDrone(img_full_path, label_full_path)
         elif self.dataset_type == "vhr":
-            for label_filename in file_list:
-                if os.path.splitext(label_filename)[-1] != ".txt":
-                    continue
-                label_full_path = os.path.join(self.labels_folder_path, label_filename)
-                img_full_path = os.path.join(self.images_folder_path, os.path.splitext(label_filename)[0] + ".jpg")
-                voc_label = self.getVHR(img_full_path, label_full_path)
-                output_file_name = os.path.splitext(os.path.basename(img_full_path))[0] + ".xml"
-                save_path = os.path.join(self.labels_folder_path, "../VOC")
-                if not os.path.exists(save_path):
-                    os.makedirs(save_path)
-                self.writeVOCXmlLabel(voc_label, os.path.join(save_path, output_file_name))
-        else:
-            print("type: \"%s\" to voc, Not yet supported!" %(self.dataset_type))
+            return self.getVHR(img_full_path, label_full_path)
+        elif self.dataset_type == "voc":
+            voc_label = VOCLabel(img_full_path, label_full_path)
+            voc_label.updateBBoxes()
+            return voc_label
+        yolo_label = YoloLabel(img_full_path, label_full_path)
+        yolo_label.updateBBoxes()
+        return yolo_label.convert2VOCLabel(classes)
 
-    def convert2Yolo(self, classes = None):
-        file_list = os.listdir(self.labels_folder_path)
-        if self.dataset_type == "voc":
-            for label_filename in file_list:
-                if os.path.splitext(label_filename)[-1] != ".xml":
-                    continue
-                label_full_path = os.path.join(self.labels_folder_path, label_filename)
-                img_full_path = os.path.join(self.images_folder_path, os.path.splitext(label_filename)[0] + ".jpg")
-                voc_label = VOCLabel(img_full_path, label_full_path)
+    def loadLabel(self, label_filename, classes=None, with_size=True):
+        name = os.path.splitext(label_filename)[0]
+        with self.instrumentation.stage("parse"):
+            voc_label = self.getVOCLabel(self.getImgPath(name), os.path.join(self.labels_folder_path, label_filename), classes)
+        if with_size and not (voc_label.img_w and voc_label.img_h):
+            with self.instrumentation.stage("image_size"):
                 voc_label.updateSize()
-                voc_label.updateBBoxes()
-                yolo_label = voc_label.convert2YoloLabel(classes)
-                output_file_name = os.path.splitext(os.path.basename(img_full_path))[0] + ".txt"
-                save_path = os.path.join(self.labels_folder_path, "../YOLO")
-                if not os.path.exists(save_path):
-                    os.makedirs(save_path)
-                self.writeYoloTxtLabel(yolo_label, os.path.join(save_path, output_file_name))
-        if self.dataset_type == "dota":
-            classes = ["plane", "ship", "storage-tank", "baseball-diamond", "tennis-court", "basketball-court", "ground-track-field", "harbor", "bridge", "large-vehicle", "small-vehicle", "helicopter", "roundabout", "soccer-ball-field", "swimming-pool", "container-crane", "airport", "helipad"]
-            for label_filename in file_list:
-                if os.path.splitext(label_filename)[-1] != ".xml":
-                    continue
-                label_full_path = os.path.join(self.labels_folder_path, label_filename)
-                img_full_path = os.path.join(self.images_folder_path, os.path.splitext(label_filename)[0] + ".png")
-                voc_label = self.getDOTA(img_full_path, label_full_path)
-                yolo_label = voc_label.convert2YoloLabel(classes)
-                output_file_name = os.path.splitext(os.path.basename(img_full_path))[0] + ".txt"
-                save_path = os.path.join(self.labels_folder_path, "../YOLO")
-                if not os.path.exists(save_path):
-                    os.makedirs(save_path)
-                self.writeYoloTxtLabel(yolo_label, os.path.join(save_path, output_file_name))
-        elif self.dataset_type == "visdrone":
-            classes = ["ignored regions", "pedestrian", "people", "bicycle", "car", "van", "truck", "tricycle", "awning-tricycle", "bus", "motor", "others"]
-            for label_filename in file_list:
-                if os.path.splitext(label_filename)[-1] != ".xml":
-                    continue
-                label_full_path = os.path.join(self.labels_folder_path, label_filename)
-                img_full_path = os.path.join(self.images_folder_path, os.path.splitext(label_filename)[0] + ".jpg")
-                voc_label = self.getVisDrone(img_full_path, label_full_path)
-                yolo_label = voc_label.convert2YoloLabel(classes)
-                output_file_name = os.path.splitext(os.path.basename(img_full_path))[0] + ".txt"
-                save_path = os.path.join(self.labels_folder_path, "../YOLO")
-                if not os.path.exists(save_path):
-                    os.makedirs(save_path)
-                self.writeYoloTxtLabel(yolo_label, os.path.join(save_path, output_file_name))
-        elif self.dataset_type == "vhr":
-            classes = ["airplane", "ship", "storage tank", "baseball diamond", "tennis court", "basketball court", "ground track field", "harbor", "bridge", "vehicle"]
-            for label_filename in file_list:
-                if os.path.splitext(label_filename)[-1] != ".xml":
-                    continue
-                label_full_path = os.path.join(self.labels_folder_path, label_filename)
-                img_full_path = os.path.join(
-                    self.images_folder_path, os.path.splitext(label_filename)[0] + ".jpg")
-                voc_label = self.getVHR(img_full_path, label_full_path)
+        if self.instrumentation.enabled:
+            self.instrumentation.count("files")
+            self.instrumentation.count("boxes", len(voc_label.BBoxes))
+            self.instrumentation.count("bytes_read", os.path.getsize(voc_label.label_path))
+        return voc_label
+
+    def convertLabel(self, label_filename, target, classes=None):
+        self.writeLabel(label_filename, self.loadLabel(label_filename, classes), target, classes)
+
+    def writeLabel(self, label_filename, voc_label, target, classes=None):
+        name = os.path.splitext(label_filename)[0]
+        instrumentation = self.instrumentation
+        if target == "voc":
+            output_path = os.path.join(self.labels_folder_path, "../VOC", name + ".xml")
+            with instrumentation.stage("serialize"):
+                xml_text = self.renderVOCXml(voc_label)
+            with instrumentation.stage("write"):
+                with open(output_path, "w") as output_label_file:
+                    output_label_file.write(xml_text)
+        elif target == "yolo_obb":
+            output_path = os.path.join(self.labels_folder_path, "../YOLO_OBB", name + ".txt")
+            with instrumentation.stage("write"):
+                self.writeYoloOBBTxtLabel(voc_label, classes, output_path)
+        else:
+            output_path = os.path.join(self.labels_folder_path, "../YOLO", name + ".txt")
+            with instrumentation.stage("convert"):
                 yolo_label = voc_label.convert2YoloLabel(classes)
-                output_file_name = os.path.splitext(os.path.basename(img_full_path))[0] + ".txt"
-                save_path = os.path.join(self.labels_folder_path, "../YOLO")
-                if not os.path.exists(save_path):
-                    os.makedirs(save_path)
-                self.writeYoloTxtLabel(yolo_label, os.path.join(save_path, output_file_name))
+            with instrumentation.stage("write"):
+                self.writeYoloTxtLabel(yolo_label, output_path)
+        if instrumentation.enabled:
+            instrumentation.count("bytes_written", os.path.getsize(output_path))
+
+    def getLabelFiles(self):
+        label_ext = self.getLabelExtName()
+        return sorted(i for i in os.listdir(self.labels_folder_path) if os.path.splitext(i)[-1] == label_ext)
+
+    def reportUnmatched(self, label_filenames, max_names=10):
+        if not os.path.isdir(self.images_folder_path):
+            print("%s: image folder not found" % self.images_folder_path)
+            return [os.path.splitext(label_filename)[0] for label_filename in label_filenames], []
+        labels_without_img, imgs_without_label = ImgPathIndex.forFolder(self.images_folder_path).getUnmatched(os.path.splitext(label_filename)[0] for label_filename in label_filenames)
+        for folder, names, message in ((self.labels_folder_path, labels_without_img, "label(s) without image"), (self.images_folder_path, imgs_without_label, "image(s) without label")):
+            if names:
+                print("%s: %d %s: %s%s" % (folder, len(names), message, ", ".join(names[:max_names]), ", ..." if len(names) > max_names else ""))
+        return labels_without_img, imgs_without_label
+
+    def loadChunk(self, label_filenames, classes=None, with_size=False):
+        loaded = []
+        for label_filename, voc_label, error in self.readAhead(lambda label_filename: self.loadLabel(label_filename, classes, with_size), label_filenames, self.io_threads):
+            loaded.append((label_filename, voc_label, None if error is None else "%s: %s" % (type(error).__name__, error)))
+        return loaded, ImgSizeCache.popUpdates()
+
+    def runChunk(self, chunk, func, *args):
+        return func(chunk, *args), self.instrumentation.pop()
+
+    def iterChunks(self, func, chunks, workers, *args):
+        if workers is None or workers < 1:
+            workers = os.cpu_count() or 1
+        stage = func.__name__.replace("Chunk", "")
+        total = sum(len(chunk) for chunk in chunks)
+        done = 0
+        if workers == 1 or len(chunks) <= 1:
+            for chunk in chunks:
+                result = func(chunk, *args)
+                done += len(chunk)
+                self.instrumentation.progress(stage, done, total)
+                yield result
         else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as executor:
+                for chunk, (result, data) in zip(chunks, executor.map(self.runChunk, chunks, [func] * len(chunks), *[[arg] * len(chunks) for arg in args])):
+                    self.instrumentation.merge(data)
+                    done += len(chunk)
+                    self.instrumentation.progress(stage, done, total)
+                    yield result
+
+    def convertChunk(self, label_filenames, target, classes=None):
+        errors = []
+
+        def write(label_filename, voc_label):
+            try:
+                self.writeLabel(label_filename, voc_label, target, classes)
+            except Exception as e:
+                errors.append((label_filename, "%s: %s" % (type(e).__name__, e)))
+        # labels are read ahead and written behind on io_threads threads; both stay bounded
+        write_queue = WriteBehindQueue(self.io_threads, 64 << 20)
+        for label_filename, voc_label, error in self.readAhead(lambda label_filename: self.loadLabel(label_filename, classes), label_filenames, self.io_threads):
+            if error is not None:
+                errors.append((label_filename, "%s: %s" % (type(error).__name__, error)))
+                continue
+            write_queue.submit(4096 + 256 * len(voc_label.BBoxes), write, label_filename, voc_label)
+        write_queue.close()
+        order = dict((label_filename, i) for i, label_filename in enumerate(label_filenames))
+        errors.sort(key=lambda error: order[error[0]])
+        return errors, ImgSizeCache.popUpdates()
+
+    def statsChunk(self, label_filenames, classes=None):
+        loaded_filenames, img_sizes, counts, missing, errors = [], [], [], [], []
+        bboxes = VOCBBoxes()
+        for label_filename in label_filenames:
+            try:
+                with self.instrumentation.stage("parse"):
+                    voc_label = self.getVOCLabel(self.getImgPath(os.path.splitext(label_filename)[0]), os.path.join(self.labels_folder_path, label_filename), classes)
+                if voc_label.img_w and voc_label.img_h:
+                    img_size = (voc_label.img_h, voc_label.img_w)
+                elif os.path.exists(voc_label.img_path):
+                    with self.instrumentation.stage("image_size"):
+                        img_size = voc_label.updateSize()[:2]
+                else:
+                    img_size = (0, 0)
+                    missing.append(label_filename)
+            except Exception as e:
+                errors.append((label_filename, "%s: %s" % (type(e).__name__, e)))
+                continue
+            loaded_filenames.append(label_filename)
+            img_sizes.append(img_size)
+            counts.append(len(voc_label.BBoxes))
+            bboxes.extendColumns(xyxy=voc_label.BBoxes.xyxy, cls_ids=voc_label.BBoxes.cls_ids, flags=voc_label.BBoxes.flags)
+        return (loaded_filenames, np.array(img_sizes, dtype=np.int64).reshape(-1, 2), np.array(counts, dtype=np.int64), missing, bboxes, errors), ImgSizeCache.popUpdates()
+
+    @instrumentedRun("getStatistics")
+    def getStatistics(self, classes=None, workers=1, chunk_size=256, kmeans_k=0, report_path=None, max_examples=100):
+        if self.dataset_type == "yolo" and classes is None:
+            print("type: \"yolo\" to statistics, classes are required!")
+            return None
+        file_list = self.getLabelFiles()
+        unlabeled = self.reportUnmatched(file_list)[1]
+        chunks = [file_list[i: i + chunk_size] for i in range(0, len(file_list), chunk_size)]
+        label_filenames, img_sizes, counts, missing, box_parts, errors = [], [], [], [], [], []
+        for result, size_updates in self.iterChunks(self.statsChunk, chunks, workers, classes):
+            ImgSizeCache.mergeUpdates(size_updates)
+            label_filenames.extend(result[0])
+            img_sizes.append(result[1])
+            counts.append(result[2])
+            missing.extend(result[3])
+            box_parts.append(result[4])
+            errors.extend(result[5])
+        ImgSizeCache.saveAll()
+        img_sizes = np.concatenate(img_sizes) if img_sizes else np.zeros((0, 2), dtype=np.int64)
+        counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+        bboxes = VOCBBoxes(int(counts.sum()))
+        for part in box_parts:
+            bboxes.extendColumns(xyxy=part.xyxy, cls_ids=part.cls_ids, flags=part.flags)
+        xyxy = bboxes.xyxy.astype(np.int64)
+        cls_ids = bboxes.cls_ids
+        img_index = np.repeat(np.arange(len(counts)), counts)
+        box_index = np.arange(len(xyxy)) - np.repeat(np.cumsum(counts) - counts, counts)
+        widths = xyxy[:, 2] - xyxy[:, 0]
+        heights = xyxy[:, 3] - xyxy[:, 1]
+        img_h = img_sizes[img_index, 0]
+        img_w = img_sizes[img_index, 1]
+        degenerate = (widths <= 0) | (heights <= 0)
+        out_of_bounds = (img_w > 0) & ((xyxy[:, 0] < 0) | (xyxy[:, 1] < 0) | (xyxy[:, 2] > img_w) | (xyxy[:, 3] > img_h))
+        proper = ~degenerate
+
+        def examples(mask):
+            indices = np.nonzero(mask)[0][:max_examples]
+            return {"count": int(mask.sum()), "examples": [{"label": label_filenames[img_index[i]], "box": int(box_index[i]), "xyxy": xyxy[i].tolist()} for i in indices]}
+
+        names = VOCBBoxes.class_names.names
+        class_count = len(names)
+        box_hist = np.bincount(cls_ids, minlength=class_count)
+        img_hist = np.bincount(np.unique(img_index * class_count + cls_ids) % class_count, minlength=class_count) if class_count else box_hist
+        class_report = dict((names[i], {"boxes": int(box_hist[i]), "images": int(img_hist[i])}) for i in np.nonzero(box_hist)[0])
+        areas = widths[proper] * heights[proper]
+        aspect_ratios = widths[proper] / heights[proper].astype(np.float64)
+        ratio_edges = [0, 0.125, 0.25, 0.5, 1, 2, 4, 8, np.inf]
+        ratio_hist = np.histogram(aspect_ratios, ratio_edges)[0]
+        report = {
+            "dataset": self.dataset_name,
+            "type": self.dataset_type,
+            "labels": len(file_list),
+            "images": len(label_filenames),
+            "boxes": int(len(xyxy)),
+            "difficult": int(bboxes.is_difficult.sum()),
+            "truncated": int(bboxes.is_truncated.sum()),
+            "classes": class_report,
+            "objects_per_image": dict(self.summarizeValues(counts), empty=int((counts == 0).sum())),
+            "box_width": self.summarizeValues(widths[proper]),
+            "box_height": self.summarizeValues(heights[proper]),
+            "box_area": dict(self.summarizeValues(np.sqrt(areas)), small=int((areas < 32 ** 2).sum()), medium=int(((areas >= 32 ** 2) & (areas < 96 ** 2)).sum()), large=int((areas >= 96 ** 2).sum())),
+            "aspect_ratio": dict(self.summarizeValues(aspect_ratios), histogram=dict(("%g-%g" % (ratio_edges[i], ratio_edges[i + 1]), int(ratio_hist[i])) for i in range(len(ratio_hist)))),
+            "problems": {
+                "parse_errors": [{"label": label_filename, "error": message} for label_filename, message in errors],
+                "missing_images": {"count": len(missing), "examples": missing[:max_examples]},
+                "unlabeled_images": {"count": len(unlabeled), "examples": unlabeled[:max_examples]},
+                "degenerate_boxes": examples(degenerate),
+                "out_of_bounds_boxes": examples(out_of_bounds),
+                "unknown_classes": sorted(set(class_report) - set(classes)) if classes is not None else [],
+            },
+        }
+        if kmeans_k:
+            try:
+                anchors, mean_iou = self.kmeansAnchors(np.stack([widths[proper], heights[proper]], axis=1), kmeans_k)
+                report["anchors"] = {"k": kmeans_k, "wh": np.rint(anchors).astype(np.int64).tolist(), "mean_iou": mean_iou}
+            except ValueError as e:
+                print("anchors: %s" % e)
+                report["anchors"] = None
+        for label_filename, message in errors:
+            print("%s: %s" % (os.path.join(self.labels_folder_path, label_filename), message))
+        if report_path is not None:
+            with open(report_path, "w") as report_file:
+                json.dump(report, report_file, indent=1)
+        return report
+
+    def convertAll(self, target, classes=None, workers=1, chunk_size=None, incremental=False, use_hash=False):
+        output_ext = ".xml" if target == "voc" else ".txt"
+        file_list = self.getLabelFiles()
+        self.reportUnmatched(file_list)
+        save_path = os.path.join(self.labels_folder_path, {"voc": "../VOC", "yolo": "../YOLO", "yolo_obb": "../YOLO_OBB"}[target])
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        pending = file_list
+        if incremental:
+            manifest = IncrementalManifest(os.path.normpath(save_path) + ".manifest.json", {"dataset_type": self.dataset_type, "target": target, "classes": classes}, use_hash)
+            fingerprints = {}
+            pending = []
+            for label_filename in file_list:
+                input_paths = [os.path.join(self.labels_folder_path, label_filename)]
+                try:
+                    input_paths.append(self.getImgPath(os.path.splitext(label_filename)[0]))
+                except Exception:
+                    pass
+                fingerprints[label_filename] = manifest.getFingerprints(input_paths)
+                if not manifest.isUpToDate(label_filename, fingerprints[label_filename]):
+                    pending.append(label_filename)
+        if workers is None or workers < 1:
+            workers = os.cpu_count() or 1
+        if chunk_size is None:
+            chunk_size = max(1, min(256, -(-len(pending) // (workers * 4))))
+        chunks = [pending[i: i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        errors = []
+        for chunk_errors, size_updates in self.iterChunks(self.convertChunk, chunks, workers, target, classes):
+            errors.extend(chunk_errors)
+            ImgSizeCache.mergeUpdates(size_updates)
+        ImgSizeCache.saveAll()
+        removed = []
+        if incremental:
+            failed = set(label_filename for label_filename, message in errors)
+            for label_filename in pending:
+                if label_filename not in failed:
+                    output_path = os.path.join(save_path, os.path.splitext(label_filename)[0] + output_ext)
+                    removed.extend(manifest.record(label_filename, fingerprints[label_filename], [output_path]))
+            removed.extend(manifest.removeOrphans(file_list))
+            manifest.save()
+        for label_filename, message in errors:
+            print("%s: %s" % (os.path.join(self.labels_folder_path, label_filename), message))
+        return {"target": target, "total": len(file_list), "converted": len(pending) - len(errors), "skipped": len(file_list) - len(pending), "removed": removed, "errors": errors}
+
+    @instrumentedRun("convert2VOC")
+    def convert2VOC(self, classes=None, workers=1, chunk_size=None, incremental=False, use_hash=False):
+        if self.dataset_type not in ["yolo", "dota", "visdrone", "vhr"]:
+            print("type: \"%s\" to voc, Not yet supported!" %(self.dataset_type))
+            return None
+        if self.dataset_type == "yolo" and classes is None:
+            print("type: \"yolo\" to voc, classes are required!")
+            return None
+        return self.convertAll("voc", classes, workers, chunk_size, incremental, use_hash)
+
+    @instrumentedRun("convert2Yolo")
+    def convert2Yolo(self, classes = None, workers=1, chunk_size=None, incremental=False, use_hash=False):
+        if self.dataset_type not in ["voc", "dota", "visdrone", "vhr"]:
             print("type: \"%s\" to yolo, Not yet supported!" %(self.dataset_type))
+            return None
+        if classes is None:
+            classes = self.getDefaultClasses()
+        return self.convertAll("yolo", classes, workers, chunk_size, incremental, use_hash)
 
-    def Prepare4Darknet(self, dst_path, part):
-        if not os.path.exists(dst_path):
-            os.makedirs(dst_path)
-        os.makedirs(os.path.join(dst_path, self.dataset_name, part))
-        for i in os.listdir(self.images_folder_path):
-            os.symlink(os.path.join(self.images_folder_path, i), os.path.join(dst_path, self.dataset_name, part, i))
-        for i in os.listdir(self.labels_folder_path):
-            os.symlink(os.path.join(self.images_folder_path, i), os.path.join(dst_path, self.dataset_name, part, i))
-        with open(os.path.join(dst_path, self.dataset_name, part + ".txt"), "w") as output_list_file:
-            for i in os.listdir(self.images_folder_path):
-                output_list_file.write(os.path.abspath(os.path.join(self.images_folder_path, i)) + "\n")
-
-    def Prepare4YoloV5(self, dst_path, part):
+    @instrumentedRun("convert2YoloOBB")
+    def convert2YoloOBB(self, classes=None, workers=1, chunk_size=None, incremental=False, use_hash=False):
+        if self.dataset_type not in ["voc", "dota", "visdrone", "vhr"]:
+            print("type: \"%s\" to yolo obb, Not yet supported!" %(self.dataset_type))
+            return None
+        if classes is None:
+            classes = self.getDefaultClasses()
+        return self.convertAll("yolo_obb", classes, workers, chunk_size, incremental, use_hash)
+
+    def generateLabels(self, classes=None, filter_classes=None, skip_empty=False):
+        filter_ids = None if filter_classes is None else VOCBBoxes.class_names.getIds(filter_classes)
+        file_list = self.getLabelFiles()
+        self.reportUnmatched(file_list)
+        for label_filename, voc_label, error in self.readAhead(lambda label_filename: self.loadLabel(label_filename, classes, False), file_list, self.io_threads):
+            if error is not None:
+                print("%s: %s: %s" % (os.path.join(self.labels_folder_path, label_filename), type(error).__name__, error))
+                continue
+            if filter_ids is not None:
+                voc_label.selectClasses(filter_ids)
+            if skip_empty and not len(voc_label.BBoxes):
+                continue
+            yield voc_label.img_path, voc_label
+
+    def iterLabels(self, classes=None, filter_classes=None, skip_empty=False, prefetch=0):
+        if self.dataset_type == "yolo" and classes is None:
+            print("type: \"yolo\" to labels, classes are required!")
+            return iter(())
+        label_stream = self.generateLabels(classes, filter_classes, skip_empty)
+        return self.prefetchIter(label_stream, prefetch) if prefetch > 0 else label_stream
+
+    def selectChunk(self, label_filenames, classes=None, filter_classes=None, skip_empty=False):
+        filter_ids = None if filter_classes is None else VOCBBoxes.class_names.getIds(filter_classes)
+        selected = []
+        for label_filename, voc_label, error in self.loadChunk(label_filenames, classes)[0]:
+            if error is not None:
+                continue
+            cls_ids = voc_label.BBoxes.cls_ids
+            if filter_ids is not None:
+                cls_ids = cls_ids[np.isin(cls_ids, filter_ids)]
+            if len(cls_ids) or not (skip_empty or filter_ids is not None):
+                selected.append(label_filename)
+        return selected, ImgSizeCache.popUpdates()
+
+    def renderChunk(self, items, dst_path, classes=None, filter_classes=None, max_side=512, sheet=None, cache_size=1 << 30, cache_path=None):
+        filter_ids = None if filter_classes is None else VOCBBoxes.class_names.getIds(filter_classes)
+        thumbnail_cache = ThumbnailCache.forFolder(self.images_folder_path, cache_size) if cache_path is None else ThumbnailCache(cache_path, cache_size)
+        instrumentation = self.instrumentation
+        rendered, errors, cells, captions = [], [], [], []
+        for item_index, label_filename in items:
+            name = os.path.splitext(label_filename)[0]
+            try:
+                voc_label = self.loadLabel(label_filename, classes)
+                if filter_ids is not None:
+                    voc_label.selectClasses(filter_ids)
+                with instrumentation.stage("thumbnail"):
+                    img = thumbnail_cache.get(voc_label.img_path, max_side)
+                with instrumentation.stage("draw"):
+                    self.drawLabel(img, voc_label, float(img.shape[1]) / voc_label.img_w, float(img.shape[0]) / voc_label.img_h)
+            except Exception as e:
+                errors.append((label_filename, "%s: %s" % (type(e).__name__, e)))
+                continue
+            entry = {"label": label_filename, "img": voc_label.img_path, "boxes": len(voc_label.BBoxes)}
+            if sheet is None:
+                entry["output"] = name + ".jpg"
+                with instrumentation.stage("write"):
+                    self.writeImg(os.path.join(dst_path, entry["output"]), img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+            else:
+                entry["output"] = "sheet_%05d.jpg" % (item_index // (sheet[0] * sheet[1]))
+                entry["cell"] = len(cells)
+                cells.append(img)
+                captions.append("%s (%d)" % (name, len(voc_label.BBoxes)))
+            rendered.append(entry)
+        if cells:
+            with instrumentation.stage("write"):
+                self.writeImg(os.path.join(dst_path, rendered[0]["output"]), self.composeSheet(cells, captions, sheet[0], max_side), [cv2.IMWRITE_JPEG_QUALITY, 90])
+        if instrumentation.enabled:
+            instrumentation.count("thumbnail_cache_hits", thumbnail_cache.hits)
+            instrumentation.count("thumbnail_cache_misses", thumbnail_cache.misses)
+        return (rendered, errors, thumbnail_cache.hits, thumbnail_cache.misses), ImgSizeCache.popUpdates()
+
+    @instrumentedRun("renderLabels")
+    def renderLabels(self, dst_path, classes=None, filter_classes=None, skip_empty=False, sample=None, seed=0, max_side=512, sheet=None, workers=1, cache_size=1 << 30, cache_path=None):
+        if self.dataset_type == "yolo" and classes is None:
+            print("type: \"yolo\" to render, classes are required!")
+            return None
         if not os.path.exists(dst_path):
             os.makedirs(dst_path)
-        os.makedirs(os.path.join(dst_path, self.dataset_name, "image", part))
-        for i in os.listdir(self.images_folder_path):
-            os.symlink(os.path.abspath(os.path.join(self.images_folder_path, i)), os.path.join(dst_path, self.dataset_name, "image", part, i))
-        for i in os.listdir(self.labels_folder_path):
-            os.symlink(os.path.abspath(os.path.join(self.labels_folder_path, i)), os.path.join(dst_path, self.dataset_name, "label", part, i))
+        file_list = self.getLabelFiles()
+        self.reportUnmatched(file_list)
+        selected = file_list
+        if filter_classes is not None or skip_empty:
+            selected = []
+            chunks = [file_list[i: i + 256] for i in range(0, len(file_list), 256)]
+            for chunk_selected, size_updates in self.iterChunks(self.selectChunk, chunks, workers, classes, filter_classes, skip_empty):
+                selected.extend(chunk_selected)
+                ImgSizeCache.mergeUpdates(size_updates)
+        if sample is not None and sample < len(selected):
+            picked = np.sort(np.random.default_rng(seed).choice(len(selected), sample, replace=False))
+            selected = [selected[i] for i in picked]
+        # a chunk is one contact sheet, so each worker composes and writes whole sheets
+        chunk_size = sheet[0] * sheet[1] if sheet is not None else max(1, min(64, -(-len(selected) // (max(1, workers) * 4))))
+        items = list(enumerate(selected))
+        chunks = [items[i: i + chunk_size] for i in range(0, len(items), chunk_size)]
+        rendered, errors, hits, misses = [], [], 0, 0
+        for (chunk_rendered, chunk_errors, chunk_hits, chunk_misses), size_updates in self.iterChunks(self.renderChunk, chunks, workers, dst_path, classes, filter_classes, max_side, sheet, cache_size, cache_path):
+            rendered.extend(chunk_rendered)
+            errors.extend(chunk_errors)
+            hits += chunk_hits
+            misses += chunk_misses
+            ImgSizeCache.mergeUpdates(size_updates)
+        ImgSizeCache.saveAll()
+        with open(os.path.join(dst_path, "render.json"), "w") as index_file:
+            json.dump({"dataset": self.dataset_name, "max_side": max_side, "sheet": sheet, "items": rendered}, index_file, indent=1)
+        for label_filename, message in errors:
+            print("%s: %s" % (os.path.join(self.labels_folder_path, label_filename), message))
+        return {"selected": len(selected), "rendered": len(rendered), "outputs": len(set(entry["output"] for entry in rendered)), "errors": errors, "thumbnail_cache_hits": hits, "thumbnail_cache_misses": misses}
+
+    @instrumentedRun("convert2Packed")
+    def convert2Packed(self, dst_path=None, classes=None, include_images=False, shard_size=1 << 30, workers=1, chunk_size=256):
+        if self.dataset_type == "yolo" and classes is None:
+            print("type: \"yolo\" to packed, classes are required!")
+            return None
+        if dst_path is None:
+            dst_path = os.path.join(self.labels_folder_path, "../PACKED")
+        file_list = self.getLabelFiles()
+        self.reportUnmatched(file_list)
+        chunks = [file_list[i: i + chunk_size] for i in range(0, len(file_list), chunk_size)]
+        writer = PackedDataSetWriter(dst_path, self.dataset_name, include_images, shard_size)
+        errors = []
+        for loaded, size_updates in self.iterChunks(self.loadChunk, chunks, workers, classes, True):
+            ImgSizeCache.mergeUpdates(size_updates)
+            for label_filename, voc_label, error in loaded:
+                if error is None:
+                    with self.instrumentation.stage("pack"):
+                        writer.add(voc_label)
+                else:
+                    errors.append((label_filename, error))
+        writer.close()
+        ImgSizeCache.saveAll()
+        for label_filename, message in errors:
+            print("%s: %s" % (os.path.join(self.labels_folder_path, label_filename), message))
+        return {"target": "packed", "total": len(file_list), "converted": len(file_list) - len(errors), "errors": errors}
+
+    def getExportPairs(self, labels_path):
+        images = ImgPathIndex.forFolder(self.images_folder_path).load(True)
+        labels = {}
+        for entry in os.scandir(labels_path):
+            if entry.is_file() and os.path.splitext(entry.name)[1] == ".txt":
+                labels[os.path.splitext(entry.name)[0]] = entry.name
+        pairs = [(name, images[name], labels.get(name)) for name in sorted(images)]
+        return pairs, sorted(name for name in labels if name not in images)
+
+    def writeExportConfig(self, dataset_path, layout, parts, classes):
+        names_path = os.path.join(dataset_path, self.dataset_name + ".names")
+        with open(names_path, "w") as names_file:
+            for cls_name in classes:
+                names_file.write("%s\n" % cls_name)
+        list_paths = dict((part, os.path.abspath(os.path.join(dataset_path, part + ".txt"))) for part in parts)
+        if layout == "darknet":
+            with open(os.path.join(dataset_path, self.dataset_name + ".data"), "w") as data_file:
+                data_file.write("classes = %d\n" % len(classes))
+                for part, key in (("train", "train"), ("val", "valid"), ("test", "test")):
+                    if part in list_paths:
+                        data_file.write("%s = %s\n" % (key, list_paths[part]))
+                data_file.write("names = %s\nbackup = backup/\n" % os.path.abspath(names_path))
+        else:
+            with open(os.path.join(dataset_path, self.dataset_name + ".yaml"), "w") as yaml_file:
+                yaml_file.write("path: %s\n" % json.dumps(os.path.abspath(dataset_path)))
+                for part in parts:
+                    yaml_file.write("%s: %s\n" % (part, json.dumps(part + ".txt")))
+                yaml_file.write("nc: %d\nnames: %s\n" % (len(classes), json.dumps(list(classes))))
+
+    def export(self, dst_path, layout="yolov5", part="train", splits=None, link_mode="symlink", stratify=True, seed=0, workers=8, labels_path=None, classes=None):
+        if layout not in ["darknet", "yolov5"]:
+            print("layout: \"%s\", Not yet supported!" %(layout))
+            return None
+        if link_mode not in ["symlink", "hardlink", "reflink", "copy", "list"]:
+            print("link mode: \"%s\", Not yet supported!" %(link_mode))
+            return None
+        if labels_path is None:
+            labels_path = self.labels_folder_path if self.dataset_type == "yolo" else os.path.join(self.labels_folder_path, "../YOLO")
+        if not os.path.isdir(labels_path):
+            print("%s: no YOLO labels, run convert2Yolo first!" % labels_path)
+            return None
+        splits = list(splits.items()) if splits else [(part, 1.0)]
+        part_names = [name for name, fraction in splits]
+        dataset_path = os.path.join(dst_path, self.dataset_name)
+        names_path = os.path.join(dataset_path, self.dataset_name + ".names")
+        if classes is None:
+            classes = self.getDefaultClasses()
+        if classes is None and os.path.exists(names_path):
+            # reuse the names an earlier export of another part wrote
+            with open(names_path, "r") as names_file:
+                classes = [line.strip() for line in names_file if line.strip()] or None
+        if classes is None:
+            print("type: \"%s\" to export, classes are required!" % self.dataset_type)
+            return None
+        pairs, unmatched_labels = self.getExportPairs(labels_path)
+
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            if len(splits) > 1:
+                keys = np.full(len(pairs), -1, dtype=np.int64)
+                if stratify:
+                    label_paths = [os.path.join(labels_path, label_name) for name, img_name, label_name in pairs if label_name is not None]
+                    labelled = np.array([label_name is not None for name, img_name, label_name in pairs], dtype=bool)
+                    img_cls_ids = [np.unique(np.array(cls_ids, dtype=np.int64)) for cls_ids in executor.map(self.readYoloClassIds, label_paths)]
+                    frequency = np.bincount(np.concatenate(img_cls_ids + [np.zeros(0, dtype=np.int64)]))
+                    # each image is stratified by the rarest class it contains
+                    keys[labelled] = [cls_ids[np.argmin(frequency[cls_ids])] if len(cls_ids) else -1 for cls_ids in img_cls_ids]
+                assigned = self.assignSplits(keys, [fraction for name, fraction in splits], seed)
+            else:
+                assigned = np.zeros(len(pairs), dtype=np.int64)
+
+            tasks = []
+            task_parts = []
+            planned = set()
+            lists = dict((name, []) for name in part_names)
+            for (name, img_name, label_name), part_index in zip(pairs, assigned.tolist()):
+                part_name = part_names[part_index]
+                src_img = os.path.abspath(os.path.join(self.images_folder_path, img_name))
+                if link_mode == "list":
+                    lists[part_name].append(src_img)
+                    continue
+                if layout == "darknet":
+                    dst_img = os.path.join(dataset_path, part_name, os.path.basename(img_name))
+                    dst_label = os.path.join(dataset_path, part_name, name + ".txt")
+                else:
+                    dst_img = os.path.join(dataset_path, "images", part_name, os.path.basename(img_name))
+                    dst_label = os.path.join(dataset_path, "labels", part_name, name + ".txt")
+                tasks.append((src_img, dst_img))
+                task_parts.append(part_name)
+                if label_name is not None:
+                    tasks.append((os.path.abspath(os.path.join(labels_path, label_name)), dst_label))
+                    task_parts.append(part_name)
+                planned.update((os.path.normpath(dst_img), os.path.normpath(dst_label)))
+                lists[part_name].append(os.path.abspath(dst_img))
+            for folder in set(os.path.dirname(dst) for src, dst in tasks) | set([dataset_path]):
+                if not os.path.exists(folder):
+                    os.makedirs(folder)
+
+            # export.json keeps the files of every exported part relative to dataset_path; only the parts exported now
+            # are cleaned up, other parts are kept unless they were written with a different layout
+            export_manifest_path = os.path.join(dataset_path, "export.json")
+            removed = 0
+            previous_parts = {}
+            if os.path.exists(export_manifest_path):
+                with open(export_manifest_path, "r") as manifest_file:
+                    previous = json.load(manifest_file)
+                previous_parts = previous.get("parts", {})
+                replaced = previous_parts if previous.get("layout") != layout else dict((name, entry) for name, entry in previous_parts.items() if name in part_names)
+                previous_config_path = os.path.join(dataset_path, self.dataset_name + (".data" if previous.get("layout") == "darknet" else ".yaml"))
+                if previous.get("layout") != layout and os.path.exists(previous_config_path):
+                    os.remove(previous_config_path)
+                for name, entry in list(replaced.items()):
+                    for dst in entry.get("files", []):
+                        dst = os.path.normpath(os.path.join(dataset_path, dst))
+                        if dst not in planned and os.path.lexists(dst):
+                            os.remove(dst)
+                            removed += 1
+                    previous_parts.pop(name)
+                    list_path = os.path.join(dataset_path, name + ".txt")
+                    if name not in part_names and os.path.exists(list_path):
+                        os.remove(list_path)
+
+            def linkChunk(chunk):
+                return [self.linkFile(src, dst, link_mode) for src, dst in chunk]
+            statuses = {"linked": 0, "skipped": 0, "fallback": 0}
+            chunks = [tasks[i: i + 1024] for i in range(0, len(tasks), 1024)]
+            for chunk_statuses in executor.map(linkChunk, chunks):
+                for status in chunk_statuses:
+                    statuses[status] += 1
+
+        for part_name, img_paths in lists.items():
+            with open(os.path.join(dataset_path, part_name + ".txt"), "w") as output_list_file:
+                for img_path in img_paths:
+                    output_list_file.write(img_path + "\n")
+        part_files = dict((name, []) for name in part_names)
+        for (src, dst), part_name in zip(tasks, task_parts):
+            part_files[part_name].append(os.path.relpath(dst, dataset_path))
+        for name in part_names:
+            previous_parts[name] = {"link_mode": link_mode, "splits": splits, "seed": seed, "files": sorted(part_files[name])}
+        exported_parts = [name for name in ("train", "val", "test") if name in previous_parts] + sorted(name for name in previous_parts if name not in ("train", "val", "test"))
+        self.writeExportConfig(dataset_path, layout, exported_parts, classes)
+        with open(export_manifest_path, "w") as manifest_file:
+            json.dump({"layout": layout, "parts": previous_parts}, manifest_file, indent=1)
+        for name in unmatched_labels:
+            print("%s: label without image" % os.path.join(labels_path, name + ".txt"))
+        return {"layout": layout, "link_mode": link_mode, "parts": dict((name, len(img_paths)) for name, img_paths in lists.items()), "linked": statuses["linked"], "reflink_fallbacks": statuses["fallback"], "skipped": statuses["skipped"], "removed": removed, "unlabeled_images": sum(1 for pair in pairs if pair[2] is None), "unmatched_labels": unmatched_labels}
+
+    def Prepare4Darknet(self, dst_path, part, classes=None):
+        return self.export(dst_path, "darknet", part, classes=classes)
+
+    def Prepare4YoloV5(self, dst_path, part, classes=None):
+        return self.export(dst_path, "yolov5", part, classes=classes)
 
 
 class RSDataSetsSpliter(RSDataSetsUtils):
 
-    def __init__(self, oringin_imgs_folder_path, oringin_labels_folder_path):
+    def __init__(self, oringin_imgs_folder_path, oringin_labels_folder_path, instrumentation=None, io_threads=0):
+        self.instrumentation = instrumentation if instrumentation is not None else NullInstrumentation()
+        self.io_threads = io_threads
         self.oringin_imgs_folder_path = oringin_imgs_folder_path
         self.oringin_labels_folder_path = oringin_labels_folder_path
 
-    def splitImgs(self, img_dst_path, size_w, size_h, step):
+    @staticmethod
+    def getTileWindows(img_h, img_w, size_w, size_h, step):
+        starts_h = [0] if img_h < size_h else sorted(set(min(h, img_h - size_h) for h in range(0, img_h - 1, step)))
+        starts_w = [0] if img_w < size_w else sorted(set(min(w, img_w - size_w) for w in range(0, img_w - 1, step)))
+        return [(start_h, start_w) for start_h in starts_h for start_w in starts_w]
+
+    @staticmethod
+    def cropTile(img, start_x, start_y, size_w, size_h):
+        cropped = img[start_y: start_y + size_h, start_x: start_x + size_w]
+        if cropped.shape[0] < size_h or cropped.shape[1] < size_w:
+            cropped = RSDataSetsUtils.fillRightBottom(cropped, size_w, size_h)
+        return cropped
+
+    @staticmethod
+    def clipTileBoxes(bboxes, box_index, start_x, start_y, size_w, size_h, policy="drop", min_overlap=0.5):
+        end_x = start_x + size_w
+        end_y = start_y + size_h
+        if policy == "drop":
+            tile_bboxes = bboxes.select(box_index.queryInside(start_x, start_y, end_x, end_y))
+        else:
+            indices = box_index.queryIntersect(start_x, start_y, end_x, end_y)
+            xyxy = bboxes.xyxy[indices]
+            clipped = xyxy.copy()
+            np.clip(clipped[:, 0::2], start_x, end_x, out=clipped[:, 0::2])
+            np.clip(clipped[:, 1::2], start_y, end_y, out=clipped[:, 1::2])
+            unchanged = (clipped == xyxy).all(axis=1)
+            clipped_w = (clipped[:, 2] - clipped[:, 0]).astype(np.int64)
+            clipped_h = (clipped[:, 3] - clipped[:, 1]).astype(np.int64)
+            keep = (clipped_w > 0) & (clipped_h > 0)
+            if policy == "iou":
+                area = (xyxy[:, 2] - xyxy[:, 0]).astype(np.int64) * (xyxy[:, 3] - xyxy[:, 1])
+                keep &= clipped_w * clipped_h >= min_overlap * area
+            keep |= unchanged
+            tile_bboxes = bboxes.select(indices[keep])
+            tile_bboxes.xyxy[:] = clipped[keep]
+            tile_bboxes.flags[~unchanged[keep]] |= VOCBBoxes.TRUNCATED
+        tile_bboxes.xyxy[:] -= np.array([start_x, start_y, start_x, start_y], dtype=np.int32)
+        return tile_bboxes
+
+    @staticmethod
+    def clipTileOBBoxes(obboxes, box_index, start_x, start_y, size_w, size_h, policy="drop", min_overlap=0.5):
+        end_x = start_x + size_w
+        end_y = start_y + size_h
+        indices = box_index.queryIntersect(start_x, start_y, end_x, end_y)
+        quads = obboxes.quads[indices]
+        polygons = quads.reshape(-1, 4, 2)
+        inside = ((polygons >= [start_x, start_y]) & (polygons <= [end_x, end_y])).all(axis=(1, 2))
+        if policy == "drop":
+            keep = inside
+            clipped, counts = polygons, np.full(len(polygons), 4)
+        else:
+            clipped, counts = RSDataSetsUtils.clipPolygons(polygons, np.full(len(polygons), 4), start_x, start_y, end_x, end_y)
+            areas = RSDataSetsUtils.polygonAreas(clipped, counts)
+            keep = areas > 0
+            if policy == "iou":
+                keep &= areas >= min_overlap * RSDataSetsUtils.polygonAreas(polygons, np.full(len(polygons), 4))
+            keep |= inside
+            fitted = RSDataSetsUtils.fitQuads(quads, clipped, counts)
+            quads = np.where(inside[:, None], quads, fitted)
+        valid = np.arange(clipped.shape[1])[None, :] < counts[:, None]
+        xs = clipped[:, :, 0]
+        ys = clipped[:, :, 1]
+        xyxy = np.stack([np.where(valid, xs, np.inf).min(axis=1), np.where(valid, ys, np.inf).min(axis=1), np.where(valid, xs, -np.inf).max(axis=1), np.where(valid, ys, -np.inf).max(axis=1)], axis=1)[keep]
+        tile_obboxes = obboxes.select(indices[keep])
+        tile_obboxes.quads[:] = quads[keep] - np.tile([start_x, start_y], 4)
+        tile_obboxes.flags[~inside[keep]] |= OrientedBBoxes.TRUNCATED
+        tile_bboxes = VOCBBoxes()
+        tile_bboxes.extendArrays(xyxy.astype(np.int32) - np.array([start_x, start_y, start_x, start_y], dtype=np.int32), tile_obboxes.cls_ids, tile_obboxes.is_difficult, tile_obboxes.is_truncated)
+        return tile_bboxes, tile_obboxes
+
+    @staticmethod
+    def getManifestPath(img_dst_path):
+        return os.path.normpath(img_dst_path) + ".manifest.json"
+
+    @staticmethod
+    def writeTileManifest(manifest_path, manifest):
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, "w") as manifest_file:
+            json.dump(manifest, manifest_file, indent=1)
+        os.replace(tmp_path, manifest_path)
+
+    @staticmethod
+    def readTileManifest(manifest_path):
+        with open(manifest_path, "r") as manifest_file:
+            return json.load(manifest_file)
+
+    def getSourceImgs(self):
+        return ImgPathIndex.forFolder(self.oringin_imgs_folder_path).getImgs()
+
+    def getSourceLabelPath(self, name):
+        label_path = os.path.join(self.oringin_labels_folder_path, name + ".xml")
+        txt_label_path = os.path.join(self.oringin_labels_folder_path, name + ".txt")
+        if not os.path.exists(label_path) and os.path.exists(txt_label_path):
+            return txt_label_path
+        return label_path
+
+    def loadSourceLabel(self, img_path, label_path):
+        if label_path.endswith(".txt"):
+            return self.getDOTA(img_path, label_path)
+        voc_label = VOCLabel(img_path, label_path)
+        if os.path.exists(label_path):
+            voc_label.updateBBoxes()
+        return voc_label
+
+    def openSourceImg(self, img_path, max_memory):
+        # a source that can not be read by window is decoded whole even when it alone exceeds max_memory
+        img = WindowedImageReader(img_path)
+        if img.shape is None:
+            print("can not read image: %s" % img_path)
+            return None
+        if img.blocks is None and not isinstance(img.img, np.memmap) and img.img.nbytes > max_memory:
+            print("%s: format can not be read by window, decoded whole image (%d MB)" % (img_path, img.img.nbytes >> 20))
+        return img
+
+    def getIncrementalState(self, img_dst_path, params, use_hash):
+        return IncrementalManifest(os.path.normpath(img_dst_path) + ".incremental.json", params, use_hash)
+
+    def getPendingSources(self, img_list, source_tiles_list, state, with_label):
+        pending = []
+        for img_index, img_name in enumerate(img_list):
+            img_path = os.path.join(self.oringin_imgs_folder_path, img_name)
+            label_path = self.getSourceLabelPath(os.path.splitext(os.path.basename(img_name))[0]) if with_label else None
+            fingerprints = None
+            if state is not None:
+                fingerprints = state.getFingerprints([img_path, label_path] if with_label else [img_path])
+                if state.isUpToDate(img_name, fingerprints):
+                    source_tiles_list[img_index] = state.getData(img_name)
+                    continue
+            pending.append((img_index, img_name, img_path, label_path, fingerprints))
+        return pending
+
+    @staticmethod
+    def getSourceBytes(img_path):
+        # estimate reserved before a source is opened: decoded BGR bytes, nothing for memory-mapped .npy files
+        if os.path.splitext(img_path)[-1].lower() == ".npy":
+            return 0
+        try:
+            img_h, img_w = ImgSizeCache.forFolder(os.path.dirname(img_path)).getSize(img_path)[:2]
+        except (OSError, ValueError):
+            return 0
+        return img_h * img_w * 3
+
+    @staticmethod
+    def getDecodedBytes(img):
+        return 0 if img.blocks is not None or isinstance(img.img, np.memmap) else img.img.nbytes
+
+    def admitSources(self, write_queue, reserved):
+        # sources are opened only while their decoded size fits the write queue budget
+        def admit(source, wait):
+            nbytes = self.getSourceBytes(source[2])
+            if not write_queue.reserve(nbytes, wait):
+                return False
+            reserved[source[0]] = nbytes
+            return True
+        return admit
+
+    def openSource(self, source, max_memory):
+        img_path, label_path = source[2], source[3]
+        with self.instrumentation.stage("open_image"):
+            img = self.openSourceImg(img_path, max_memory)
+        if img is None or label_path is None:
+            return img, None
+        with self.instrumentation.stage("read_label"):
+            return img, self.loadSourceLabel(img_path, label_path)
+
+    def writeTile(self, img, tile_img_path, start_x, start_y, size_w, size_h, write_params=None):
+        with self.instrumentation.stage("crop"):
+            cropped = self.cropTile(img, start_x, start_y, size_w, size_h)
+        with self.instrumentation.stage("write_tile"):
+            self.writeImg(tile_img_path, cropped, write_params)
+
+    @instrumentedRun("splitImgs")
+    def splitImgs(self, img_dst_path, size_w, size_h, step, manifest_path=None, workers=1, max_memory=512 << 20, tile_format="png", quality=None, incremental=False, use_hash=False):
         if not os.path.exists(img_dst_path):
             os.makedirs(img_dst_path)
-        img_list = os.listdir(self.oringin_imgs_folder_path)
-        for img_name in img_list:
-            name = os.path.splitext(img_name)[0]
-            img = cv2.imread(os.path.join(self.oringin_imgs_folder_path, img_name))
-            size = img.shape
-            if size[0] >= size_h and size[1] >= size_w:
-                for h in range(0, size[0] - 1, step):
-                    start_h = h
-                    for w in range(0, size[1] - 1, step):
-                        start_w = w
-                        end_h = start_h + size_h
-                        if end_h > size[0]:
-                            start_h = size[0] - size_h
-                            end_h = start_h + size_h
-                        end_w = start_w + size_w
-                        if end_w > size[1]:
-                            start_w = size[1] - size_w
-                        end_w = start_w + size_w
-                        cropped = img[start_h: end_h, start_w: end_w]
-                        name_img = name + "_" + \
-                            str(start_h) + "_" + str(start_w)
-                        cv2.imwrite(os.path.join(img_dst_path, name_img + ".png"), cropped)
-            elif size[0] >= size_h and size[1] < size_w:
-                img0 = self.fillRight(img, size_w)
-                for h in range(0, size[0] - 1, step):
-                    start_h = h
-                    start_w = 0
-                    end_h = start_h + size_h
-                    if end_h > size[0]:
-                        start_h = size[0] - size_h
-                        end_h = start_h + size_h
-                    end_w = start_w + size_w
-                    cropped = img0[start_h: end_h, start_w: end_w]
-                    name_img = name + "_" + str(start_h) + "_" + str(start_w)
-                    cv2.imwrite(os.path.join(img_dst_path, name_img + ".png"), cropped)
-            elif size[0] < size_h and size[1] >= size_w:
-                img0 = self.fillBottom(img, size_h)
-                for w in range(0, size[1] - 1, step):
-                    start_h = 0
-                    start_w = w
-                    end_w = start_w + size_w
-                    if end_w > size[1]:
-                        start_w = size[1] - size_w
-                        end_w = start_w + size_w
-                    end_h = start_h + size_h
-                    cropped = img0[start_h: end_h, start_w: end_w]
-                    name_img = name + "_" + str(start_h) + "_" + str(start_w)
-                    cv2.imwrite(os.path.join(img_dst_path, name_img + ".png"), cropped)
-            elif size[0] < size_h and size[1] < size_w:
-                img0 = self.fillRightBottom(img, size_w, size_h)
-                cropped = img0[0: size_h, 0: size_w]
-                name_img = name + "_" + "0" + "_" + "0"
-                cv2.imwrite(os.path.join(img_dst_path, name_img + ".png"), cropped)
+        tile_format = tile_format.lower().lstrip(".")
+        write_params = self.getImgWriteParams(tile_format, quality)
+        stage_name = "splitImgs"
+        if incremental:
+            state = self.getIncrementalState(img_dst_path, {"mode": "splitImgs", "size_w": size_w, "size_h": size_h, "step": step, "tile_format": tile_format, "quality": quality}, use_hash)
+        img_list = self.getSourceImgs()
+        source_tiles_list = [[] for img_name in img_list]
+        pending = self.getPendingSources(img_list, source_tiles_list, state if incremental else None, False)
+        write_queue = WriteBehindQueue(workers, max_memory)
+        reserved = {}
+        instrumentation = self.instrumentation
+        # sources are opened io_threads ahead, tiles are cropped and encoded on the write threads;
+        # each decoded source counts against max_memory until its last tile is written
+        for (img_index, img_name, img_path, label_path, fingerprints), opened, error in self.readAhead(lambda source: self.openSource(source, max_memory), pending, self.io_threads, self.io_threads, self.admitSources(write_queue, reserved)):
+            instrumentation.progress(stage_name, img_index, len(img_list))
+            if error is not None:
+                raise error
+            img = opened[0]
+            if img is None:
+                write_queue.release(reserved.pop(img_index))
+                continue
+            name = os.path.splitext(os.path.basename(img_name))[0]
+            source_tiles = []
+            windows = self.getTileWindows(img.shape[0], img.shape[1], size_w, size_h, step)
+            hold = write_queue.holdSource(self.getDecodedBytes(img), len(windows), reserved.pop(img_index))
+            for start_h, start_w in windows:
+                name_img = name + "_" + str(start_h) + "_" + str(start_w)
+                write_queue.submit(size_w * size_h * img.shape[2], self.writeTile, img, os.path.join(img_dst_path, name_img + "." + tile_format), start_w, start_h, size_w, size_h, write_params, hold=hold)
+                source_tiles.append({"tile": name_img + "." + tile_format, "source_img": img_path, "x": start_w, "y": start_h, "source_w": img.shape[1], "source_h": img.shape[0]})
+            source_tiles_list[img_index] = source_tiles
+            if instrumentation.enabled:
+                instrumentation.count("source_images")
+                instrumentation.count("tiles", len(source_tiles))
+                instrumentation.count("bytes_read", os.path.getsize(img_path))
+                instrumentation.count("bytes_encoded", len(source_tiles) * size_w * size_h * img.shape[2])
+            if incremental:
+                state.record(img_name, fingerprints, [os.path.join(img_dst_path, tile["tile"]) for tile in source_tiles], source_tiles)
+        instrumentation.progress(stage_name, len(img_list), len(img_list))
+        with instrumentation.stage("write_drain"):
+            write_queue.close()
+        if incremental:
+            state.removeOrphans(img_list)
+            state.save()
+        tiles = [tile for source_tiles in source_tiles_list for tile in source_tiles]
+        manifest = {"img_dir": img_dst_path, "label_dir": None, "size_w": size_w, "size_h": size_h, "step": step, "policy": None, "tile_format": tile_format, "quality": quality, "tiles": tiles}
+        self.writeTileManifest(manifest_path or self.getManifestPath(img_dst_path), manifest)
+        return manifest
 
-    def getVOCLabelfromOrig(self, oringin_voc_label, out_img_floder, out_label_floder, start_x, start_y, size_w, size_h):
-        oringin_voc_label.updateBBoxes()
+    @instrumentedRun("split")
+    def split(self, img_dst_path, label_dst_path, size_w, size_h, step, policy="drop", min_overlap=0.5, manifest_path=None, workers=1, max_memory=512 << 20, tile_format="png", quality=None, incremental=False, use_hash=False, label_format="voc"):
+        if policy not in ["drop", "clip", "iou"]:
+            print("policy: \"%s\", Not yet supported!" %(policy))
+            return None
+        if label_format not in ["voc", "dota"]:
+            print("label format: \"%s\", Not yet supported!" %(label_format))
+            return None
+        label_ext = ".xml" if label_format == "voc" else ".txt"
+        tile_format = tile_format.lower().lstrip(".")
+        write_params = self.getImgWriteParams(tile_format, quality)
+        stage_name = "split"
+        for folder in (img_dst_path, label_dst_path):
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+        if incremental:
+            state = self.getIncrementalState(img_dst_path, {"mode": "split", "label_dir": os.path.abspath(label_dst_path), "size_w": size_w, "size_h": size_h, "step": step, "policy": policy, "min_overlap": min_overlap, "tile_format": tile_format, "quality": quality, "label_format": label_format}, use_hash)
+        img_list = self.getSourceImgs()
+        source_tiles_list = [[] for img_name in img_list]
+        pending = self.getPendingSources(img_list, source_tiles_list, state if incremental else None, True)
+        write_queue = WriteBehindQueue(workers, max_memory)
+        reserved = {}
+        instrumentation = self.instrumentation
+        for (img_index, img_name, img_path, label_path, fingerprints), opened, error in self.readAhead(lambda source: self.openSource(source, max_memory), pending, self.io_threads, self.io_threads, self.admitSources(write_queue, reserved)):
+            instrumentation.progress(stage_name, img_index, len(img_list))
+            if error is not None:
+                raise error
+            img, oringin_voc_label = opened
+            if img is None:
+                write_queue.release(reserved.pop(img_index))
+                continue
+            name = os.path.splitext(os.path.basename(img_name))[0]
+            oriented = oringin_voc_label.OBBoxes is not None
+            box_index = BoxGridIndex(oringin_voc_label.OBBoxes.getBounds() if oriented else oringin_voc_label.BBoxes.xyxy, size_w, size_h)
+            tile_labels, tile_label_paths, source_tiles = [], [], []
+            windows = self.getTileWindows(img.shape[0], img.shape[1], size_w, size_h, step)
+            hold = write_queue.holdSource(self.getDecodedBytes(img), len(windows), reserved.pop(img_index))
+            for start_h, start_w in windows:
+                name_img = name + "_" + str(start_h) + "_" + str(start_w)
+                tile_img_path = os.path.join(img_dst_path, name_img + "." + tile_format)
+                write_queue.submit(size_w * size_h * img.shape[2], self.writeTile, img, tile_img_path, start_w, start_h, size_w, size_h, write_params, hold=hold)
+                voc_label = VOCLabel(tile_img_path, os.path.join(label_dst_path, name_img + label_ext))
+                voc_label.img_w, voc_label.img_h, voc_label.img_d = size_w, size_h, img.shape[2]
+                with instrumentation.stage("clip_boxes"):
+                    if oriented:
+                        voc_label.BBoxes, voc_label.OBBoxes = self.clipTileOBBoxes(oringin_voc_label.OBBoxes, box_index, start_w, start_h, size_w, size_h, policy, min_overlap)
+                    else:
+                        voc_label.BBoxes = self.clipTileBoxes(oringin_voc_label.BBoxes, box_index, start_w, start_h, size_w, size_h, policy, min_overlap)
+                tile_labels.append(voc_label)
+                tile_label_paths.append(voc_label.label_path)
+                source_tiles.append({"tile": name_img + "." + tile_format, "label": name_img + label_ext, "source_img": img_path, "source_label": label_path, "x": start_w, "y": start_h, "source_w": img.shape[1], "source_h": img.shape[0], "boxes": len(voc_label.BBoxes)})
+            with instrumentation.stage("write_labels"):
+                if label_format == "voc":
+                    self.writeVOCXmlLabels(tile_labels, tile_label_paths)
+                else:
+                    for voc_label, tile_label_path in zip(tile_labels, tile_label_paths):
+                        self.writeDOTATxtLabel(voc_label, tile_label_path)
+            source_tiles_list[img_index] = source_tiles
+            if instrumentation.enabled:
+                instrumentation.count("source_images")
+                instrumentation.count("tiles", len(source_tiles))
+                instrumentation.count("boxes", sum(tile["boxes"] for tile in source_tiles))
+                instrumentation.count("bytes_read", os.path.getsize(img_path) + (os.path.getsize(label_path) if os.path.exists(label_path) else 0))
+                instrumentation.count("bytes_encoded", len(source_tiles) * size_w * size_h * img.shape[2])
+            if incremental:
+                state.record(img_name, fingerprints, [os.path.join(img_dst_path, tile["tile"]) for tile in source_tiles] + tile_label_paths, source_tiles)
+        instrumentation.progress(stage_name, len(img_list), len(img_list))
+        with instrumentation.stage("write_drain"):
+            write_queue.close()
+        if incremental:
+            state.removeOrphans(img_list)
+            state.save()
+        tiles = [tile for source_tiles in source_tiles_list for tile in source_tiles]
+        manifest = {"img_dir": img_dst_path, "label_dir": label_dst_path, "size_w": size_w, "size_h": size_h, "step": step, "policy": policy, "tile_format": tile_format, "quality": quality, "tiles": tiles}
+        self.writeTileManifest(manifest_path or self.getManifestPath(img_dst_path), manifest)
+        return manifest
+
+    def getTileLabel(self, oringin_voc_label, box_index, out_img_floder, out_label_floder, start_x, start_y, size_w, size_h, tile_ext=None):
         img_name = os.path.splitext(os.path.split(oringin_voc_label.img_path)[1])
         label_name = os.path.splitext(os.path.split(oringin_voc_label.label_path)[1])
-        img_name = os.path.join(out_img_floder, img_name[0] + "_%s_%s" %(start_y, start_x) + img_name[1])
+        img_name = os.path.join(out_img_floder, img_name[0] + "_%s_%s" %(start_y, start_x) + (img_name[1] if tile_ext is None else tile_ext))
         label_name = os.path.join(out_label_floder, label_name[0] + "_%s_%s" %(start_y, start_x) + label_name[1])
         voc_label = VOCLabel(img_name, label_name)
-        for box in oringin_voc_label.BBoxes:
-            if self.isBetween((box.x_min, box.x_max), (start_x, start_x + size_w)) and self.isBetween((box.y_min, box.y_max), (start_y, start_y + size_h)):
-                voc_label.BBoxes.append(VOCBoudingBox(box.x_min - start_x, box.x_max - start_x, box.y_min - start_y, box.y_max - start_y, box.cls_name, box.is_difficult, box.is_truncated))
+        voc_label.BBoxes = self.clipTileBoxes(oringin_voc_label.BBoxes, box_index, start_x, start_y, size_w, size_h)
         return voc_label
 
+    def getVOCLabelfromOrig(self, oringin_voc_label, out_img_floder, out_label_floder, start_x, start_y, size_w, size_h):
+        oringin_voc_label.updateBBoxes()
+        box_index = BoxGridIndex(oringin_voc_label.BBoxes.xyxy, size_w, size_h)
+        return self.getTileLabel(oringin_voc_label, box_index, out_img_floder, out_label_floder, start_x, start_y, size_w, size_h)
+
+    @instrumentedRun("splitLabels")
     def splitLabels(self, img_floder, out_img_floder, label_floder, out_label_floder, size_h, size_w):
         if not os.path.exists(out_label_floder):
             os.makedirs(out_label_floder)
-        img_list = os.listdir(out_img_floder)
-        for img_name in img_list:
-            name = os.path.splitext(img_name)[0]
-            name_list = name.split('_')
-            txt_name = name_list[0]
-            y = int(name_list[1])
-            x = int(name_list[2])
-            oringin_voc_label = VOCLabel(os.path.join(img_floder, txt_name + ".png"), os.path.join(label_floder, txt_name + ".xml"))
-            voc_label = self.getVOCLabelfromOrig(oringin_voc_label, out_img_floder, out_label_floder, x, y, size_w, size_h)
-            self.writeVOCXmlLabel(voc_label, os.path.join(out_label_floder, name + ".xml"))
+        tiles = {}
+        manifest_path = self.getManifestPath(out_img_floder)
+        if os.path.exists(manifest_path):
+            for tile in self.readTileManifest(manifest_path)["tiles"]:
+                txt_name = os.path.splitext(os.path.basename(tile["source_img"]))[0]
+                tiles.setdefault(txt_name, []).append((tile["x"], tile["y"]) + os.path.splitext(tile["tile"]))
+        else:
+            for img_name in sorted(os.listdir(out_img_floder)):
+                name = os.path.splitext(img_name)[0]
+                name_list = name.rsplit("_", 2)
+                if len(name_list) != 3 or not (name_list[1].isdigit() and name_list[2].isdigit()):
+                    continue
+                tiles.setdefault(name_list[0], []).append((int(name_list[2]), int(name_list[1]), name, os.path.splitext(img_name)[1]))
+        instrumentation = self.instrumentation
+        for source_index, (txt_name, windows) in enumerate(tiles.items()):
+            instrumentation.progress("splitLabels", source_index, len(tiles))
+            oringin_voc_label = VOCLabel(ImgPathIndex.forFolder(img_floder).getPath(txt_name, windows[0][3]), os.path.join(label_floder, txt_name + ".xml"))
+            with instrumentation.stage("read_label"):
+                oringin_voc_label.updateBBoxes()
+            box_index = BoxGridIndex(oringin_voc_label.BBoxes.xyxy, size_w, size_h)
+            for x, y, name, tile_ext in windows:
+                with instrumentation.stage("clip_boxes"):
+                    voc_label = self.getTileLabel(oringin_voc_label, box_index, out_img_floder, out_label_floder, x, y, size_w, size_h, tile_ext)
+                with instrumentation.stage("write_labels"):
+                    self.writeVOCXmlLabel(voc_label, os.path.join(out_label_floder, name + ".xml"))
+                if instrumentation.enabled:
+                    instrumentation.count("boxes", len(voc_label.BBoxes))
+            if instrumentation.enabled:
+                instrumentation.count("source_labels")
+                instrumentation.count("tiles", len(windows))
+        instrumentation.progress("splitLabels", len(tiles), len(tiles))
+        ImgSizeCache.saveAll()
+
+    def getTileOffsets(self, tiles_path, manifest_path=None):
+        manifest_path = manifest_path or self.getManifestPath(tiles_path)
+        sources = {}
+        if os.path.exists(manifest_path):
+            manifest = self.readTileManifest(manifest_path)
+            for tile in manifest["tiles"]:
+                sources.setdefault(tile["source_img"], []).append((os.path.splitext(tile["tile"])[0], tile["x"], tile["y"], tile["source_w"], tile["source_h"]))
+            return sources, manifest["size_w"], manifest["size_h"]
+        # no manifest: offsets come from the name_y_x tile names, sizes from the tiles and the source images
+        img_index = ImgPathIndex.forFolder(self.oringin_imgs_folder_path)
+        size_w = size_h = None
+        for tile_name in ImgPathIndex.forFolder(tiles_path).getImgs():
+            name_list = os.path.splitext(os.path.basename(tile_name))[0].rsplit("_", 2)
+            if len(name_list) != 3 or not (name_list[1].isdigit() and name_list[2].isdigit()):
+                continue
+            source_img = img_index.getPath(name_list[0])
+            if source_img is None:
+                print("%s: source image not found" % os.path.join(tiles_path, tile_name))
+                continue
+            if size_w is None:
+                size_h, size_w = ImgSizeCache.forFolder(tiles_path).getSize(os.path.join(tiles_path, tile_name))[:2]
+            source_h, source_w = ImgSizeCache.forFolder(self.oringin_imgs_folder_path).getSize(source_img)[:2]
+            sources.setdefault(source_img, []).append((os.path.splitext(os.path.basename(tile_name))[0], int(name_list[2]), int(name_list[1]), source_w, source_h))
+        return sources, size_w, size_h
+
+    @instrumentedRun("mergeDetections")
+    def mergeDetections(self, tiles_path, det_folder, dst_path, det_format="yolo", output_format="voc", classes=None, method="nms", iou_threshold=0.5, score_threshold=0.0, manifest_path=None):
+        if det_format not in ["voc", "yolo", "yolo_obb", "dota"] or output_format not in ["voc", "yolo", "yolo_obb", "dota"]:
+            print("format: \"%s\" to \"%s\", Not yet supported!" %(det_format, output_format))
+            return None
+        if method not in ["nms", "wbf"]:
+            print("method: \"%s\", Not yet supported!" %(method))
+            return None
+        if classes is None and (det_format in ["yolo", "yolo_obb"] or output_format in ["yolo", "yolo_obb"]):
+            print("format: \"yolo\" to merge, classes are required!")
+            return None
+        if not os.path.exists(dst_path):
+            os.makedirs(dst_path)
+        det_ext = ".xml" if det_format == "voc" else ".txt"
+        output_ext = ".xml" if output_format == "voc" else ".txt"
+        sources, size_w, size_h = self.getTileOffsets(tiles_path, manifest_path)
+        instrumentation = self.instrumentation
+        errors = []
+        total = merged = 0
+
+        def readSource(source_img):
+            parts = []
+            for tile_name, x, y, source_w, source_h in sources[source_img]:
+                det_path = os.path.join(det_folder, tile_name + det_ext)
+                if not os.path.exists(det_path):
+                    continue
+                try:
+                    xyxy, quads, cls_ids, scores = self.parseDetections(det_path, det_format, size_w, size_h, classes)
+                except Exception as e:
+                    errors.append((det_path, "%s: %s" % (type(e).__name__, e)))
+                    continue
+                offset = np.array([x, y], dtype=np.float64)
+                parts.append((xyxy + np.tile(offset, 2), None if quads is None else quads + np.tile(offset, 4), cls_ids, scores))
+            return parts
+
+        source_list = sorted(sources)
+        for source_index, (source_img, parts, error) in enumerate(self.readAhead(instrumentation.wrap("read_detections", readSource), source_list, self.io_threads)):
+            instrumentation.progress("mergeDetections", source_index, len(source_list))
+            if error is not None:
+                raise error
+            source_w, source_h = sources[source_img][0][3:5]
+            oriented = any(part[1] is not None for part in parts)
+            xyxy = np.concatenate([part[0] for part in parts] + [np.zeros((0, 4))])
+            quads = np.concatenate([self.xyxy2Quads(part[0]) if part[1] is None else part[1] for part in parts] + [np.zeros((0, 8))]) if oriented else None
+            cls_ids = np.concatenate([part[2] for part in parts] + [np.zeros(0, dtype=np.int32)])
+            scores = np.concatenate([part[3] for part in parts] + [np.zeros(0)])
+            confident = scores >= score_threshold
+            xyxy, cls_ids, scores = xyxy[confident], cls_ids[confident], scores[confident]
+            quads = None if quads is None else quads[confident]
+            with instrumentation.stage("merge"):
+                keep, clusters = self.groupOverlaps(xyxy, cls_ids, scores, iou_threshold, quads)
+                if method == "wbf":
+                    xyxy, quads, scores = self.fuseClusters(xyxy, scores, clusters, quads)
+                else:
+                    xyxy, quads, scores = xyxy[keep], None if quads is None else quads[keep], scores[keep]
+                cls_ids = cls_ids[keep]
+                xyxy = np.clip(xyxy, 0, [source_w, source_h, source_w, source_h])
+                if quads is not None:
+                    quads = np.clip(quads, 0, np.tile([source_w, source_h], 4))
+            with instrumentation.stage("write_labels"):
+                name = os.path.splitext(os.path.basename(source_img))[0]
+                self.writeDetections(os.path.join(dst_path, name + output_ext), output_format, source_img, source_w, source_h, xyxy, quads, cls_ids, scores, classes)
+            total += int(confident.sum())
+            merged += len(keep)
+            if instrumentation.enabled:
+                instrumentation.count("source_images")
+                instrumentation.count("boxes", int(confident.sum()))
+                instrumentation.count("merged_boxes", len(keep))
+        instrumentation.progress("mergeDetections", len(source_list), len(source_list))
+        ImgSizeCache.saveAll()
+        for det_path, message in errors:
+            print("%s: %s" % (det_path, message))
+        return {"sources": len(source_list), "tiles": sum(len(tiles) for tiles in sources.values()), "detections": total, "merged": merged, "errors": errors}
 
     def deleteEmptySample(self, images_folder_path, labels_folder_path):
-        txt_list = os.listdir(images_folder_path)
+        img_index = ImgPathIndex.forFolder(images_folder_path)
+        txt_list = sorted(i for i in os.listdir(labels_folder_path) if os.path.splitext(i)[-1] == ".txt")
         for txt_name in txt_list:
-            name = os.path.splitext(
-                (os.path.split(images_folder_path)[1]))[0]
             txt_path = os.path.join(labels_folder_path, txt_name)
-            img_path = os.path.join(images_folder_path, name + ".png")
+            img_path = img_index.getPath(os.path.splitext(txt_name)[0])
             with open(txt_path, "r") as f:
                 data = f.read()
-                f.close()
-                if(data == ""):
-                    os.remove(txt_path)
+            if data.strip() == "":
+                os.remove(txt_path)
+                if img_path is not None and os.path.exists(img_path):
                     os.remove(img_path)
 
     def __del__(self):
@@ -0,0 +1,385 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+
+benchmark
+
+~~~~~~~~~~~~~~~~
+
+Synthesizes DOTA, VisDrone, NWPU VHR-10, VOC and YOLO data sets and times the hot paths of RSDataSetsUtils on them;
+
+Results are printed and saved as JSON so that runs can be compared with --compare;
+
+Only the original RSDataSetsUtils API is required, so the same script can be run against older checkouts.
+
+"""
+
+import os
+import gc
+import sys
+import json
+import time
+import ctypes
+import shutil
+import inspect
+import threading
+import tempfile
+import platform
+import resource
+import argparse
+import cv2
+import numpy as np
+from RSDataSetsUtils import VOCLabel, YoloLabel, RSDataSetsUtils, RSDataSetsConverter, RSDataSetsSpliter
+try:
+    from RSDataSetsUtils import ImgSizeCache
+except ImportError:
+    ImgSizeCache = None
+
+dota_classes = ["plane", "ship", "storage-tank", "baseball-diamond", "tennis-court", "basketball-court", "ground-track-field", "harbor", "bridge", "large-vehicle", "small-vehicle", "helicopter", "roundabout", "soccer-ball-field", "swimming-pool", "container-crane", "airport", "helipad"]
+visdrone_classes = ["ignored regions", "pedestrian", "people", "bicycle", "car", "van", "truck", "tricycle", "awning-tricycle", "bus", "motor", "others"]
+vhr_classes = ["airplane", "ship", "storage tank", "baseball diamond", "tennis court", "basketball court", "ground track field", "harbor", "bridge", "vehicle"]
+
+
+def getPeakRSS():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def getCurrentRSS():
+    # None where /proc is not available
+    try:
+        with open("/proc/self/statm", "r") as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def trimHeap():
+    # hands freed heap pages back to the OS, so a stage is not measured against memory an earlier stage left resident
+    gc.collect()
+    try:
+        ctypes.CDLL(None).malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+
+
+class RSSSampler(object):
+
+    # peak RSS growth of one stage over the RSS it started with, polled on a thread; where the current RSS can not be
+    # read the growth of the process-wide ru_maxrss is used, which misses stages that stay below an earlier peak
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+        self.baseline = self.peak = None
+        self.start_peak = 0
+
+    def __enter__(self):
+        trimHeap()
+        self.start_peak = getPeakRSS()
+        self.baseline = self.peak = getCurrentRSS()
+        if self.baseline is not None:
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss = getCurrentRSS()
+        if rss is not None and rss > self.peak:
+            self.peak = rss
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.sample()
+
+    def getDelta(self):
+        if self.baseline is None:
+            return max(0, getPeakRSS() - self.start_peak)
+        return self.peak - self.baseline
+
+
+def getFolderBytes(paths):
+    return sum(os.path.getsize(path) for path in paths)
+
+
+def listFiles(folder):
+    return [os.path.join(folder, i) for i in sorted(os.listdir(folder)) if not i.startswith(".")]
+
+
+def callSupported(func, *args, **kwargs):
+    # drops keyword arguments that the installed RSDataSetsUtils does not know yet
+    parameters = inspect.signature(func).parameters
+    return func(*args, **dict((key, value) for key, value in kwargs.items() if key in parameters))
+
+
+def rBoxes2Quads(rboxes):
+    cos = np.cos(rboxes[:, 4])[:, None]
+    sin = np.sin(rboxes[:, 4])[:, None]
+    corner_x = np.array([-0.5, 0.5, 0.5, -0.5]) * rboxes[:, 2:3]
+    corner_y = np.array([-0.5, -0.5, 0.5, 0.5]) * rboxes[:, 3:4]
+    xs = rboxes[:, 0:1] + corner_x * cos - corner_y * sin
+    ys = rboxes[:, 1:2] + corner_x * sin + corner_y * cos
+    return np.stack([xs, ys], axis=2).reshape(-1, 8)
+
+
+def synthesizeBoxes(rng, img_w, img_h, count):
+    box_w = rng.integers(8, max(9, min(128, img_w // 4)), count)
+    box_h = rng.integers(8, max(9, min(128, img_h // 4)), count)
+    x_min = rng.integers(0, img_w - box_w)
+    y_min = rng.integers(0, img_h - box_h)
+    return np.stack([x_min, y_min, x_min + box_w, y_min + box_h], axis=1)
+
+
+def synthesizeImage(rng, img_w, img_h):
+    gradient = np.add.outer(np.arange(img_h) * 255 // max(1, img_h), np.arange(img_w) * 255 // max(1, img_w)) // 2
+    noise = rng.integers(0, 32, (img_h, img_w, 3))
+    return (gradient[:, :, None] + noise).astype(np.uint8)
+
+
+def synthesizeDataSets(root, images, img_w, img_h, boxes_per_image, seed=0):
+    rng = np.random.default_rng(seed)
+    folders = {}
+    box_counts = {"dota": 0, "visdrone": 0, "vhr": 0}
+    for name, img_dir, label_dir in (("dota", "images", "labelTxt"), ("visdrone", "images", "annotations"), ("vhr", "positive image set", "ground truth"), ("voc", "images", "VOC"), ("yolo", "images", "YOLO")):
+        folders[name] = (os.path.join(root, name, img_dir), os.path.join(root, name, label_dir))
+        for folder in folders[name]:
+            os.makedirs(folder)
+    for i in range(images):
+        img = synthesizeImage(rng, img_w, img_h)
+        counts = rng.poisson(boxes_per_image, 3)
+        name = "%06d" % i
+        for dataset, count in zip(("dota", "visdrone", "vhr"), counts.tolist()):
+            box_counts[dataset] += count
+
+        cv2.imwrite(os.path.join(folders["dota"][0], name + ".png"), img)
+        xyxy = synthesizeBoxes(rng, img_w, img_h, counts[0])
+        rboxes = np.stack([(xyxy[:, 0] + xyxy[:, 2]) / 2.0, (xyxy[:, 1] + xyxy[:, 3]) / 2.0, (xyxy[:, 2] - xyxy[:, 0]) / 2.0, (xyxy[:, 3] - xyxy[:, 1]) / 2.0, rng.uniform(-np.pi, np.pi, len(xyxy))], axis=1)
+        cls_ids = rng.integers(0, len(dota_classes), len(xyxy))
+        with open(os.path.join(folders["dota"][1], name + ".txt"), "w") as label_file:
+            label_file.write("imagesource:GoogleEarth\ngsd:0.5\n")
+            for quad, cls_id in zip(rBoxes2Quads(rboxes).tolist(), cls_ids.tolist()):
+                label_file.write("%.1f %.1f %.1f %.1f %.1f %.1f %.1f %.1f %s %d\n" % tuple(quad + [dota_classes[cls_id], cls_id % 7 == 0]))
+
+        cv2.imwrite(os.path.join(folders["visdrone"][0], name + ".jpg"), img)
+        cv2.imwrite(os.path.join(folders["voc"][0], name + ".jpg"), img)
+        xyxy = synthesizeBoxes(rng, img_w, img_h, counts[1])
+        with open(os.path.join(folders["visdrone"][1], name + ".txt"), "w") as label_file:
+            for x_min, y_min, x_max, y_max in xyxy.tolist():
+                label_file.write("%d,%d,%d,%d,1,%d,%d,%d\n" % (x_min, y_min, x_max - x_min, y_max - y_min, rng.integers(1, 11), rng.integers(0, 2), rng.integers(0, 3)))
+
+        cv2.imwrite(os.path.join(folders["vhr"][0], name + ".jpg"), img)
+        xyxy = synthesizeBoxes(rng, img_w, img_h, counts[2])
+        with open(os.path.join(folders["vhr"][1], name + ".txt"), "w") as label_file:
+            for x_min, y_min, x_max, y_max in xyxy.tolist():
+                label_file.write("(%d,%d),(%d,%d),%d\n" % (x_min, y_min, x_max, y_max, rng.integers(0, len(vhr_classes))))
+
+        voc_label = RSDataSetsUtils.getVisDrone(os.path.join(folders["voc"][0], name + ".jpg"), os.path.join(folders["visdrone"][1], name + ".txt"))
+        voc_label.img_w, voc_label.img_h, voc_label.img_d = img_w, img_h, 3
+        RSDataSetsUtils.writeVOCXmlLabel(voc_label, os.path.join(folders["voc"][1], name + ".xml"))
+        RSDataSetsUtils.writeYoloTxtLabel(voc_label.convert2YoloLabel(visdrone_classes), os.path.join(folders["yolo"][1], name + ".txt"))
+    box_counts["voc"] = box_counts["yolo"] = box_counts["visdrone"]
+    return folders, box_counts
+
+
+def checkRoundTrip(folders, seed=0, count=10000):
+    # VOC -> YOLO -> VOC has to give back the integer boxes and class names, checked before anything is timed
+    if not hasattr(RSDataSetsUtils, "voc2YoloBoxes"):
+        return
+    rng = np.random.default_rng(seed)
+    img_w = rng.integers(16, 8192, count)
+    img_h = rng.integers(16, 8192, count)
+    x_min = rng.integers(0, img_w - 1)
+    y_min = rng.integers(0, img_h - 1)
+    xyxy = np.stack([x_min, y_min, rng.integers(x_min + 1, img_w + 1), rng.integers(y_min + 1, img_h + 1)], axis=1)
+    restored = RSDataSetsUtils.yolo2VOCBoxes(RSDataSetsUtils.voc2YoloBoxes(xyxy, img_w, img_h), img_w, img_h)
+    mismatched = np.nonzero((restored != xyxy).any(axis=1))[0]
+    if len(mismatched):
+        raise AssertionError("VOC -> YOLO -> VOC changed %d of %d boxes, e.g. %s -> %s" % (len(mismatched), count, xyxy[mismatched[0]].tolist(), restored[mismatched[0]].tolist()))
+    # the synthesized YOLO labels were written from the VisDrone ones, so reading them back has to restore those
+    files = 0
+    for img_path, label_path, yolo_path in zip(listFiles(folders["visdrone"][0]), listFiles(folders["visdrone"][1]), listFiles(folders["yolo"][1])):
+        voc_label = RSDataSetsUtils.getVisDrone(img_path, label_path)
+        yolo_label = YoloLabel(img_path, yolo_path)
+        yolo_label.updateBBoxes()
+        restored_label = yolo_label.convert2VOCLabel(visdrone_classes)
+        if not np.array_equal(restored_label.BBoxes.xyxy, voc_label.BBoxes.xyxy) or not np.array_equal(restored_label.BBoxes.cls_ids, voc_label.BBoxes.cls_ids):
+            raise AssertionError("%s: VOC -> YOLO -> VOC does not restore %s" % (yolo_path, label_path))
+        files += 1
+    print("VOC -> YOLO -> VOC round trip exact on %d random boxes and %d label files" % (count, files))
+
+
+def resetSizeCache(folder):
+    if ImgSizeCache is None:
+        return
+    ImgSizeCache._instances.clear()
+    cache_path = os.path.join(os.path.dirname(os.path.abspath(folder)), ImgSizeCache.cache_file_name)
+    if os.path.exists(cache_path):
+        os.remove(cache_path)
+
+
+def measure(results, name, func, files=0, boxes=0, nbytes=0, output_paths=None):
+    # nbytes is the data the stage actually reads or writes; stages without it report no MB/s
+    with RSSSampler() as sampler:
+        start = time.perf_counter()
+        func()
+        seconds = time.perf_counter() - start
+    if output_paths is not None:
+        nbytes = getFolderBytes(output_paths)
+    result = {"seconds": seconds, "files": files, "boxes": boxes, "bytes": nbytes, "files_per_s": files / seconds if seconds else 0.0, "boxes_per_s": boxes / seconds if seconds else 0.0, "mb_per_s": nbytes / seconds / (1 << 20) if seconds and nbytes else None, "rss_delta_mb": sampler.getDelta() / float(1 << 20)}
+    results[name] = result
+    mb_per_s = "%8.1f MB/s" % result["mb_per_s"] if result["mb_per_s"] is not None else "%13s" % "-"
+    print("%-24s %8.3fs %10.1f files/s %12.1f boxes/s %s %8.1f MB peak RSS growth" % (name, seconds, result["files_per_s"], result["boxes_per_s"], mb_per_s, result["rss_delta_mb"]))
+    return result
+
+
+def runBenchmarks(folders, box_counts, root, tile_size, workers, io_threads=0):
+    results = {}
+    dota_imgs, dota_labels = folders["dota"]
+    img_paths = listFiles(dota_imgs)
+    img_bytes = getFolderBytes(img_paths)
+
+    def updateSizes():
+        sizes = [VOCLabel(img_path, None).updateSize() for img_path in img_paths]
+        if ImgSizeCache is not None:
+            ImgSizeCache.saveAll()
+        return sizes
+    resetSizeCache(dota_imgs)
+    # only the headers are read, so the image bytes would overstate MB/s
+    measure(results, "updateSize (cold)", updateSizes, len(img_paths))
+    if ImgSizeCache is not None:
+        ImgSizeCache._instances.clear()
+        measure(results, "updateSize (cached)", updateSizes, len(img_paths))
+
+    parsers = (("getDOTA", "dota", RSDataSetsUtils.getDOTA), ("getVisDrone", "visdrone", RSDataSetsUtils.getVisDrone), ("getVHR", "vhr", RSDataSetsUtils.getVHR))
+    for name, dataset, parser in parsers:
+        label_paths = listFiles(folders[dataset][1])
+        measure(results, name, lambda: [parser(label_path, label_path) for label_path in label_paths], len(label_paths), box_counts[dataset], getFolderBytes(label_paths))
+
+    voc_paths = listFiles(folders["voc"][1])
+    measure(results, "VOCLabel.updateBBoxes", lambda: [VOCLabel(label_path, label_path).updateBBoxes() for label_path in voc_paths], len(voc_paths), box_counts["voc"], getFolderBytes(voc_paths))
+    yolo_paths = listFiles(folders["yolo"][1])
+    measure(results, "YoloLabel.updateBBoxes", lambda: [YoloLabel(label_path, label_path).updateBBoxes() for label_path in yolo_paths], len(yolo_paths), box_counts["yolo"], getFolderBytes(yolo_paths))
+
+    voc_labels = []
+    for img_path, label_path in zip(listFiles(folders["visdrone"][0]), listFiles(folders["visdrone"][1])):
+        voc_labels.append(RSDataSetsUtils.getVisDrone(img_path, label_path))
+        voc_labels[-1].updateSize()
+    out_folder = os.path.join(root, "out")
+    for folder in ("VOC", "YOLO"):
+        os.makedirs(os.path.join(out_folder, folder))
+    voc_out = [os.path.join(out_folder, "VOC", "%06d.xml" % i) for i in range(len(voc_labels))]
+    measure(results, "writeVOCXmlLabel", lambda: [RSDataSetsUtils.writeVOCXmlLabel(label, path) for label, path in zip(voc_labels, voc_out)], len(voc_labels), box_counts["visdrone"], output_paths=voc_out)
+    yolo_labels = [label.convert2YoloLabel(visdrone_classes) for label in voc_labels]
+    yolo_out = [os.path.join(out_folder, "YOLO", "%06d.txt" % i) for i in range(len(yolo_labels))]
+    measure(results, "writeYoloTxtLabel", lambda: [RSDataSetsUtils.writeYoloTxtLabel(label, path) for label, path in zip(yolo_labels, yolo_out)], len(yolo_labels), box_counts["visdrone"], output_paths=yolo_out)
+
+    converter = callSupported(RSDataSetsConverter, "benchmark", "dota", dota_imgs, dota_labels, io_threads=io_threads)
+    dota_boxes = box_counts["dota"]
+    measure(results, "convert2VOC", lambda: callSupported(converter.convert2VOC, workers=workers), len(img_paths), dota_boxes)
+    measure(results, "convert2Yolo", lambda: callSupported(converter.convert2Yolo, workers=workers), len(img_paths), dota_boxes)
+
+    pixel_bytes = sum(int(np.prod(size)) for size in updateSizes())
+    voc_folder = os.path.join(dota_labels, "../VOC")
+    spliter = callSupported(RSDataSetsSpliter, dota_imgs, voc_folder, io_threads=io_threads)
+    tiles_folder = os.path.join(root, "tiles")
+    measure(results, "splitImgs", lambda: callSupported(spliter.splitImgs, tiles_folder, tile_size, tile_size, tile_size, workers=workers), len(img_paths), 0, pixel_bytes)
+    measure(results, "splitLabels", lambda: spliter.splitLabels(dota_imgs, tiles_folder, voc_folder, os.path.join(root, "tile_labels"), tile_size, tile_size), len(img_paths), dota_boxes)
+    if hasattr(spliter, "split"):
+        measure(results, "split", lambda: spliter.split(os.path.join(root, "split_images"), os.path.join(root, "split_labels"), tile_size, tile_size, tile_size, policy="clip", workers=workers), len(img_paths), dota_boxes, pixel_bytes)
+    return results
+
+
+def prepareWorkDir(work_dir):
+    # returns the folder and whether the script created it; an existing folder has to be empty
+    if work_dir is None:
+        return tempfile.mkdtemp(prefix="rsdatasets_benchmark_"), True
+    if not os.path.exists(work_dir):
+        os.makedirs(work_dir)
+        return work_dir, True
+    if not os.path.isdir(work_dir) or os.listdir(work_dir):
+        raise ValueError("work dir \"%s\" is not an empty folder, refusing to use it!" % work_dir)
+    return work_dir, False
+
+
+def cleanWorkDir(work_dir, created):
+    if created:
+        shutil.rmtree(work_dir)
+        return
+    for name in os.listdir(work_dir):
+        path = os.path.join(work_dir, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+
+def compareResults(results, previous):
+    print("\n%-24s %12s %12s %8s %12s %12s" % ("stage", "previous s", "current s", "speedup", "previous MB", "current MB"))
+    for name, result in results.items():
+        if name in previous:
+            before = previous[name]["seconds"]
+            # results saved before the per-stage RSS growth was measured have no memory figure
+            before_mb = "%12.1f" % previous[name]["rss_delta_mb"] if "rss_delta_mb" in previous[name] else "%12s" % "-"
+            print("%-24s %12.3f %12.3f %7.2fx %s %12.1f" % (name, before, result["seconds"], before / result["seconds"] if result["seconds"] else 0.0, before_mb, result["rss_delta_mb"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the conversion, parsing and tiling hot paths of RSDataSetsUtils.")
+    parser.add_argument("--images", type=int, default=50, help="images per synthesized data set")
+    parser.add_argument("--width", type=int, default=1024, help="image width")
+    parser.add_argument("--height", type=int, default=1024, help="image height")
+    parser.add_argument("--boxes", type=float, default=100, help="mean boxes per image")
+    parser.add_argument("--tile-size", type=int, default=512, help="tile size for the split benchmarks")
+    parser.add_argument("--workers", type=int, default=1, help="workers passed to the parallel entry points")
+    parser.add_argument("--io-threads", type=int, default=0, help="read-ahead / write-behind threads of the converter and splitter")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the synthesized data")
+    parser.add_argument("--work-dir", default=None, help="empty or new folder for the synthesized data (default: a new temporary folder), cleaned afterwards unless --keep")
+    parser.add_argument("--keep", action="store_true", help="keep the synthesized data")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to save the results")
+    parser.add_argument("--compare", default=None, help="results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    try:
+        work_dir, created = prepareWorkDir(args.work_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        start = time.perf_counter()
+        folders, box_counts = synthesizeDataSets(work_dir, args.images, args.width, args.height, args.boxes, args.seed)
+        print("synthesized %d images per data set in %.1fs" % (args.images, time.perf_counter() - start))
+        checkRoundTrip(folders, args.seed)
+        results = runBenchmarks(folders, box_counts, work_dir, args.tile_size, args.workers, args.io_threads)
+    finally:
+        if args.keep:
+            print("synthesized data kept in %s" % work_dir)
+        else:
+            cleanWorkDir(work_dir, created)
+    report = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "config": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=1)
+    print("results saved to %s" % args.output)
+    if args.compare is not None:
+        with open(args.compare, "r") as previous_file:
+            compareResults(results, json.load(previous_file)["results"])
+
+
+if __name__ == "__main__":
+    main()
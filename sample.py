@@ -6,6 +6,7 @@ from RSDataSetsUtils import RSDataSetsConverter, RSDataSetsSpliter
 DOTAConverter = RSDataSetsConverter(dataset_name="DOTA", dataset_type="DOTA", images_folder_path="TestDataSet/DOTA/train/images", labels_folder_path="TestDataSet/DOTA/train/labelTxt")
 DOTAConverter.convert2VOC()
 DOTAConverter.convert2Yolo()
+DOTAConverter.convert2YoloOBB()
 DOTAConverter.Prepare4Darknet("DOTA4Darknet", "train")
 DOTAConverter.Prepare4YoloV5("DOTA4YoloV5", "train")
 
@@ -14,6 +15,8 @@ VisDroneConverter.convert2VOC()
 VisDroneConverter.convert2Yolo()
 VisDroneConverter.Prepare4Darknet("VisDrone20194Darknet", "train")
 VisDroneConverter.Prepare4YoloV5("VisDrone20194YoloV5", "train")
+VisDroneConverter.getStatistics(kmeans_k=9, report_path="TestDataSet/VisDrone2019/train/statistics.json")
+VisDroneConverter.renderLabels("TestDataSet/VisDrone2019/train/QA", sheet=(2, 2), max_side=512)
 
 VisDroneVOCConverter = RSDataSetsConverter(dataset_name="VisDrone2019_VOC", dataset_type="VOC", images_folder_path="TestDataSet/VisDrone2019_VOC/train/images", labels_folder_path="TestDataSet/VisDrone2019_VOC/train/VOC")
 VisDroneVOCConverter.convert2Yolo(classes=["ignored regions", "pedestrian", "people", "bicycle", "car", "van", "truck", "tricycle", "awning-tricycle", "bus", "motor", "others"])
@@ -27,3 +30,8 @@ VHRConverter.Prepare4YoloV5("VHR4YoloV5", "train")
 DOTASpilter = RSDataSetsSpliter(oringin_imgs_folder_path="TestDataSet/DOTA/train/images", oringin_labels_folder_path="TestDataSet/DOTA/train/VOC")
 DOTASpilter.splitImgs(img_dst_path="TestDataSet/DOTA/train/devided_images", size_w=412, size_h=412, step=412)
 DOTASpilter.splitLabels(img_floder="TestDataSet/DOTA/train/images", out_img_floder="TestDataSet/DOTA/train/devided_images", label_floder="TestDataSet/DOTA/train/VOC", out_label_floder="TestDataSet/DOTA/train/devided_labels", size_w=412, size_h=412)
+DOTASpilter.split(img_dst_path="TestDataSet/DOTA/train/tiled_images", label_dst_path="TestDataSet/DOTA/train/tiled_labels", size_w=412, size_h=412, step=412, policy="clip")
+DOTASpilter.mergeDetections(tiles_path="TestDataSet/DOTA/train/tiled_images", det_folder="TestDataSet/DOTA/train/tiled_labels", dst_path="TestDataSet/DOTA/train/merged_labels", det_format="voc", output_format="voc")
+
+DOTAOBBSpilter = RSDataSetsSpliter(oringin_imgs_folder_path="TestDataSet/DOTA/train/images", oringin_labels_folder_path="TestDataSet/DOTA/train/labelTxt")
+DOTAOBBSpilter.split(img_dst_path="TestDataSet/DOTA/train/tiled_obb_images", label_dst_path="TestDataSet/DOTA/train/tiled_obb_labels", size_w=412, size_h=412, step=412, policy="clip", label_format="dota")